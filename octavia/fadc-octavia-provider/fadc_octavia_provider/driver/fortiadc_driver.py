@@ -31,6 +31,7 @@ from octavia.common import constants as consts
 from octavia_lib.api.drivers import data_models as driver_dm
 from octavia_lib.api.drivers import exceptions
 from octavia_lib.api.drivers import provider_base 
+from fadc_octavia_provider.fortiadc_agent import tracing
 
 CONF = cfg.CONF
 CONF.import_group('oslo_messaging', 'octavia.common.config')
@@ -62,18 +63,18 @@ class FortiadcDriver(provider_base.ProviderDriver):
         payload = {consts.LOADBALANCER: loadbalancer.to_dict(),
                    consts.FLAVOR: loadbalancer.flavor,
                    consts.AVAILABILITY_ZONE: loadbalancer.availability_zone}
-        self.client.cast({}, 'create_load_balancer', **payload)
+        self.client.cast(tracing.rpc_context(), 'create_load_balancer', **payload)
 
     def loadbalancer_delete(self, loadbalancer, cascade=False):
         LOG.debug('driver: loadbalancer_delete')
         payload = {consts.LOADBALANCER: loadbalancer.to_dict(),
                    'cascade': cascade}
-        self.client.cast({}, 'delete_load_balancer', **payload)
+        self.client.cast(tracing.rpc_context(), 'delete_load_balancer', **payload)
 
     def loadbalancer_failover(self, loadbalancer_id):
         LOG.debug('driver: loadbalancer_failover')
         payload = {consts.LOAD_BALANCER_ID: loadbalancer_id}
-        self.client.cast({}, 'failover_load_balancer', **payload)
+        self.client.cast(tracing.rpc_context(), 'failover_load_balancer', **payload)
 
     def loadbalancer_update(self, old_loadbalancer, new_loadbalancer):
         LOG.debug('driver: loadbalancer_update')
@@ -89,18 +90,18 @@ class FortiadcDriver(provider_base.ProviderDriver):
 
         payload = {constants.LOAD_BALANCER_ID: lb_id,
                    constants.LOAD_BALANCER_UPDATES: lb_dict}
-        self.client.cast({}, 'update_load_balancer', **payload)
+        self.client.cast(tracing.rpc_context(), 'update_load_balancer', **payload)
 
     def listener_create(self, listener):
         LOG.debug('driver: listener_create')
         payload = {consts.LISTENER: listener.to_dict()}
 
-        self.client.cast({}, 'create_listener', **payload)
+        self.client.cast(tracing.rpc_context(), 'create_listener', **payload)
 
     def listener_delete(self, listener):
         LOG.debug('driver: listener_delete')
         payload = {consts.LISTENER: listener.to_dict()}
-        self.client.cast({}, 'delete_listener', **payload)
+        self.client.cast(tracing.rpc_context(), 'delete_listener', **payload)
 
     def listener_update(self, old_listener, new_listener):
         LOG.debug('driver: listener_update')
@@ -109,7 +110,7 @@ class FortiadcDriver(provider_base.ProviderDriver):
 
         payload = {consts.ORIGINAL_LISTENER: original_listener,
                    consts.LISTENER_UPDATES: listener_updates}
-        self.client.cast({}, 'update_listener', **payload)
+        self.client.cast(tracing.rpc_context(), 'update_listener', **payload)
 
 
     def _pool_convert_to_dict(self, pool):
@@ -132,12 +133,12 @@ class FortiadcDriver(provider_base.ProviderDriver):
     def pool_create(self, pool):
         LOG.debug('driver: pool_create')
         payload = {consts.POOL: self._pool_convert_to_dict(pool)}
-        self.client.cast({}, 'create_pool', **payload)
+        self.client.cast(tracing.rpc_context(), 'create_pool', **payload)
 
     def pool_delete(self, pool):
         LOG.debug('driver: pool_delete')
         payload = {consts.POOL: pool.to_dict(recurse=True)}
-        self.client.cast({}, 'delete_pool', **payload)
+        self.client.cast(tracing.rpc_context(), 'delete_pool', **payload)
 
     def pool_update(self, old_pool, new_pool):
         LOG.debug('driver: pool_update')
@@ -145,7 +146,7 @@ class FortiadcDriver(provider_base.ProviderDriver):
         pool_dict.pop('pool_id')
         payload = {consts.ORIGINAL_POOL: old_pool.to_dict(),
                    consts.POOL_UPDATES: pool_dict}
-        self.client.cast({}, 'update_pool', **payload)
+        self.client.cast(tracing.rpc_context(), 'update_pool', **payload)
 
     def member_create(self, member):
         LOG.debug('driver: member_create')
@@ -153,12 +154,12 @@ class FortiadcDriver(provider_base.ProviderDriver):
         db_pool = self.repositories.pool.get(db_apis.get_session(),
                                              id=pool_id)
         payload = {consts.MEMBER: member.to_dict()}
-        self.client.cast({}, 'create_member', **payload)
+        self.client.cast(tracing.rpc_context(), 'create_member', **payload)
 
     def member_delete(self, member):
         LOG.debug('driver: member_delete')
         payload = {consts.MEMBER: member.to_dict()}
-        self.client.cast({}, 'delete_member', **payload)
+        self.client.cast(tracing.rpc_context(), 'delete_member', **payload)
 
     def member_update(self, old_member, new_member):
         LOG.debug('driver: member_update')
@@ -169,7 +170,7 @@ class FortiadcDriver(provider_base.ProviderDriver):
         member_updates.pop(consts.MEMBER_ID)
         payload = {consts.ORIGINAL_MEMBER: original_member,
                    consts.MEMBER_UPDATES: member_updates}
-        self.client.cast({}, 'update_member', **payload)
+        self.client.cast(tracing.rpc_context(), 'update_member', **payload)
 
     def member_batch_update(self, pool_id, members):
         LOG.debug('driver: member_batch_update')
@@ -204,17 +205,17 @@ class FortiadcDriver(provider_base.ProviderDriver):
         payload = {'old_members': [m.to_dict() for m in deleted_members],
                    'new_members': [m.to_dict() for m in new_members],
                    'updated_members': updated_members}
-        self.client.cast({}, 'batch_update_members', **payload)
+        self.client.cast(tracing.rpc_context(), 'batch_update_members', **payload)
 
     def health_monitor_create(self, healthmonitor):
         LOG.debug('driver: health_monitor_create')
         payload = {consts.HEALTH_MONITOR: healthmonitor.to_dict()}
-        self.client.cast({}, 'create_health_monitor', **payload)
+        self.client.cast(tracing.rpc_context(), 'create_health_monitor', **payload)
 
     def health_monitor_delete(self, healthmonitor):
         LOG.debug('driver: health_monitor_delete')
         payload = {consts.HEALTH_MONITOR: healthmonitor.to_dict()}
-        self.client.cast({}, 'delete_health_monitor', **payload)
+        self.client.cast(tracing.rpc_context(), 'delete_health_monitor', **payload)
 
     def health_monitor_update(self, old_healthmonitor, new_healthmonitor):
         LOG.debug('driver: health_monitor_update')
@@ -231,7 +232,7 @@ class FortiadcDriver(provider_base.ProviderDriver):
 
         payload = {consts.ORIGINAL_HEALTH_MONITOR: old_healthmonitor.to_dict(),
                    consts.HEALTH_MONITOR_UPDATES: healthmon_dict}
-        self.client.cast({}, 'update_health_monitor', **payload)
+        self.client.cast(tracing.rpc_context(), 'update_health_monitor', **payload)
 
 
     def l7policy_create(self, l7policy):
@@ -0,0 +1,262 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Bulk loading of the provider's load balancer graphs for the sync jobs.
+
+LoadBalancerRepository.get_all converts every row with to_data_model(),
+which lazily loads each relationship it walks, one query per object. Here
+the load balancers are read in pages ordered by id and every relationship
+of the graph is loaded up front with one SELECT ... IN per relationship and
+page, so a page costs a fixed number of queries whatever its size.
+changed_projects() finds the projects an incremental sync has to look at,
+unchanged() and is_orphan() check the loaded graphs against the database
+again before the device is changed. stats_objects() gives sync_stats the
+listeners and members to poll, listener_stats() the counters it adds to,
+listener_ids() and member_ids() the listeners and members whose history is
+kept.
+"""
+
+import datetime
+
+from oslo_log import log as logging
+from sqlalchemy import func
+from sqlalchemy import orm
+
+from octavia.common import constants
+from octavia.common import data_models
+from octavia.db import models
+
+LOG = logging.getLogger(__name__)
+
+provider = 'fortiadc_driver'
+default_page_size = 500
+
+# relationship paths from LoadBalancer that to_data_model() walks. Paths
+# missing in the installed Octavia are skipped, the many-to-one back
+# references (listener.load_balancer, member.pool, ...) are found in the
+# session identity map without a query.
+graph = (
+    ('vip',),
+    ('additional_vips',),
+    ('amphorae',),
+    ('_tags',),
+    ('listeners',),
+    ('listeners', '_tags'),
+    ('listeners', 'sni_containers'),
+    ('listeners', 'allowed_cidrs'),
+    ('listeners', 'l7policies'),
+    ('listeners', 'l7policies', '_tags'),
+    ('listeners', 'l7policies', 'l7rules'),
+    ('listeners', 'l7policies', 'l7rules', '_tags'),
+    ('pools',),
+    ('pools', '_tags'),
+    ('pools', '_default_listeners'),
+    ('pools', 'l7policies'),
+    ('pools', 'session_persistence'),
+    ('pools', 'members'),
+    ('pools', 'members', '_tags'),
+    ('pools', 'health_monitor'),
+    ('pools', 'health_monitor', '_tags'),
+)
+
+
+def eager_options(model=models.LoadBalancer, paths=graph):
+    options = []
+    for path in paths:
+        cls, option = model, None
+        for name in path:
+            attr = getattr(cls, name, None)
+            if attr is None or not hasattr(attr, 'property') or \
+                    not isinstance(attr.property, orm.RelationshipProperty):
+                break
+            option = orm.selectinload(attr) if option is None else option.selectinload(attr)
+            cls = attr.property.mapper.class_
+        else:
+            options.append(option)
+    return options
+
+
+def iter_loadbalancers(session, page_size=default_page_size, project_ids=None, **filters):
+    """Data models of the provider's load balancers, read page by page.
+
+    project_ids limits them to those projects.
+    """
+    page_size = max(1, page_size)
+    model = models.LoadBalancer
+    query = session.query(model).filter_by(provider=provider, **filters)
+    if project_ids is not None:
+        if not project_ids:
+            return
+        query = query.filter(model.project_id.in_(list(project_ids)))
+    query = query.options(*eager_options()).order_by(model.id)
+    last_id = None
+    while True:
+        page = query if last_id is None else query.filter(model.id > last_id)
+        rows = page.limit(page_size).all()
+        LOG.debug('bulk load: %d load balancers after %s', len(rows), last_id)
+        for row in rows:
+            yield row.to_data_model()
+        if len(rows) < page_size:
+            return
+        last_id = rows[-1].id
+        # the models of a page are not needed once converted
+        session.expunge_all()
+
+
+def _stamp(model):
+    return func.coalesce(model.updated_at, model.created_at)
+
+
+def changed_projects(session, since=None):
+    """{project_id: newest change} of the projects with a provider object
+    created or updated after since, of every project when since is None.
+
+    Load balancers and every object under them count, a change of a member
+    marks the project of its load balancer.
+    """
+    lb = models.LoadBalancer
+    pool = models.Pool
+    joins = (
+        (lb, ()),
+        (models.Listener, ((models.Listener, models.Listener.load_balancer_id == lb.id),)),
+        (pool, ((pool, pool.load_balancer_id == lb.id),)),
+        (models.Member, ((pool, pool.load_balancer_id == lb.id),
+                         (models.Member, models.Member.pool_id == pool.id))),
+        (models.HealthMonitor, ((pool, pool.load_balancer_id == lb.id),
+                                (models.HealthMonitor, models.HealthMonitor.pool_id == pool.id))),
+    )
+    result = {}
+    for model, path in joins:
+        query = session.query(lb.project_id, func.max(_stamp(model)))
+        for target, onclause in path:
+            query = query.join(target, onclause)
+        query = query.filter(lb.provider == provider)
+        if since is not None:
+            query = query.filter(_stamp(model) > since)
+        for project_id, stamp in query.group_by(lb.project_id):
+            if stamp is not None and (project_id not in result or stamp > result[project_id]):
+                result[project_id] = stamp
+    return result
+
+
+def group_by_device(loadbalancers, d_projects):
+    """{fadc_FQDN: {project_id: [lb, ...]}}, projects without a device skipped."""
+    devices = {}
+    for lb in loadbalancers:
+        device = d_projects.get(lb.project_id, {}).get('fadc_FQDN')
+        if device is None:
+            LOG.warning('no fortiadc device for project %s of lb %s', lb.project_id, lb.id)
+            continue
+        devices.setdefault(device, {}).setdefault(lb.project_id, []).append(lb)
+    return devices
+
+
+def unchanged(session, loadbalancers):
+    """Ids of the load balancers still ACTIVE and not updated since loaded."""
+    by_id = dict((lb.id, lb) for lb in loadbalancers)
+    if not by_id:
+        return set()
+    model = models.LoadBalancer
+    rows = session.query(model.id, model.provisioning_status, model.updated_at).filter(
+        model.id.in_(list(by_id)))
+    return set(lb_id for lb_id, status, updated_at in rows
+               if status == constants.ACTIVE and updated_at == by_id[lb_id].updated_at)
+
+
+def is_orphan(session, object_id, grace=0):
+    """Whether Octavia has no live object with this id.
+
+    A deleted object created less than grace seconds ago does not count
+    either, its delete flow may still be running.
+    """
+    recent = datetime.datetime.utcnow() - datetime.timedelta(seconds=grace)
+    for model in (models.LoadBalancer, models.Listener, models.Pool,
+                  models.Member, models.HealthMonitor):
+        row = session.query(model.provisioning_status, model.created_at).filter(
+            model.id == object_id).first()
+        if row is None:
+            continue
+        status, created_at = row
+        if status != constants.DELETED or (created_at is not None and created_at > recent):
+            return False
+    return True
+
+
+def stats_objects(session, members=False):
+    """{project_id: (listeners, members)} of the provider's ACTIVE load
+    balancers, for sync_stats.
+
+    One query for the listeners, and one for the members when members is
+    set, whatever the number of load balancers. The data models only carry
+    the id and the project (vdom) sync_stats needs.
+    """
+    lb = models.LoadBalancer
+    result = {}
+    listener = models.Listener
+    query = session.query(listener.id, lb.project_id).join(lb, listener.load_balancer_id == lb.id)
+    query = query.filter(lb.provider == provider,
+                         lb.provisioning_status == constants.ACTIVE,
+                         listener.provisioning_status != constants.DELETED)
+    for listener_id, project_id in query.order_by(lb.project_id, listener.id):
+        result.setdefault(project_id, ([], []))[0].append(
+            data_models.Listener(id=listener_id, project_id=project_id))
+    if not members:
+        return result
+    pool = models.Pool
+    member = models.Member
+    query = session.query(member.id, lb.project_id).join(pool, member.pool_id == pool.id)
+    query = query.join(lb, pool.load_balancer_id == lb.id)
+    query = query.filter(lb.provider == provider,
+                         lb.provisioning_status == constants.ACTIVE,
+                         member.provisioning_status != constants.DELETED)
+    for member_id, project_id in query.order_by(lb.project_id, member.id):
+        result.setdefault(project_id, ([], []))[1].append(
+            data_models.Member(id=member_id, project_id=project_id))
+    return result
+
+
+def listener_stats(session, listener_ids):
+    """{listener_id: [bytes_in, bytes_out, total_connections]} Octavia holds,
+    summed over the rows of every reporter like StatsMixin does."""
+    if not listener_ids:
+        return {}
+    model = models.ListenerStatistics
+    query = session.query(model.listener_id, func.sum(model.bytes_in),
+                          func.sum(model.bytes_out), func.sum(model.total_connections))
+    query = query.filter(model.listener_id.in_(list(listener_ids))).group_by(model.listener_id)
+    return dict((row[0], [int(v or 0) for v in row[1:]]) for row in query)
+
+
+def listener_ids(session):
+    """Ids of the provider's listeners Octavia has not deleted."""
+    lb = models.LoadBalancer
+    listener = models.Listener
+    query = session.query(listener.id).join(lb, listener.load_balancer_id == lb.id)
+    query = query.filter(lb.provider == provider,
+                         listener.provisioning_status != constants.DELETED)
+    return set(row[0] for row in query)
+
+
+def member_ids(session):
+    """Ids of the provider's members Octavia has not deleted."""
+    lb = models.LoadBalancer
+    pool = models.Pool
+    member = models.Member
+    query = session.query(member.id).join(pool, member.pool_id == pool.id)
+    query = query.join(lb, pool.load_balancer_id == lb.id)
+    query = query.filter(lb.provider == provider,
+                         member.provisioning_status != constants.DELETED)
+    return set(row[0] for row in query)
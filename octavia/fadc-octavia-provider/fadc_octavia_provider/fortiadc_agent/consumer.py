@@ -27,6 +27,9 @@ from oslo_utils import uuidutils
 from octavia.common import constants
 from octavia.common import rpc
 from fadc_octavia_provider.fortiadc_agent import endpoints
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import tracing
+from fadc_octavia_provider.fortiadc_agent.servicemanager import session_pool
 
 LOG = logging.getLogger(__name__)
 
@@ -48,6 +51,8 @@ class ConsumerService(cotyledon.Service):
 
     def run(self):
         LOG.info('Starting V2 consumer...')
+        metrics.start_snapshots(self.conf)
+        tracing.configure(self.conf)
         target = messaging.Target(topic=self.topic, server=self.server,
                                   fanout=False)
         self.endpoints = [endpoints.Endpoints()]
@@ -56,7 +61,12 @@ class ConsumerService(cotyledon.Service):
             executor='threading',
             access_policy=self.access_policy
         )
-        self.message_listener.start()
+        if self.endpoints[0].dispatcher:
+            # the endpoints only queue the casts, one intake thread of this
+            # server hands them to the dispatcher in the order they arrived
+            self.message_listener.start(override_pool_size=1)
+        else:
+            self.message_listener.start()
         if CONF.task_flow.jobboard_enabled:
             LOG.debug('jobboard_enabled...')
             for e in self.endpoints:
@@ -75,8 +85,12 @@ class ConsumerService(cotyledon.Service):
         if self.endpoints:
             LOG.info('Shutting down V2 endpoint worker executors...')
             for e in self.endpoints:
+                if e.dispatcher:
+                    e.dispatcher.shutdown()
                 try:
                     e.worker.executor.shutdown()
                 except AttributeError:
                     pass
+        LOG.info('Logging out pooled Fortiadc sessions...')
+        session_pool.get_session_pool(self.conf).close_all()
         super().terminate()
@@ -17,6 +17,9 @@
 
 """
 
+from concurrent import futures
+import time
+
 from octavia_lib.common import constants as lib_consts
 from oslo_config import cfg
 from oslo_log import log as logging
@@ -35,9 +38,18 @@ from octavia.common import utils
 from fadc_octavia_provider.fortiadc_agent.flows import flow_utils
 #from octavia.controller.worker.v2 import taskflow_jobboard_driver as tsk_driver
 from octavia.db import api as db_apis
+from octavia.db import models
 from octavia.db import repositories as repo
 from octavia_lib.api.drivers import driver_lib
 from fadc_octavia_provider.fortiadc_agent.fadc_device_driver import FadcdeviceDriver
+from fadc_octavia_provider.fortiadc_agent import bulk_loader
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import reconciler
+from fadc_octavia_provider.fortiadc_agent import stats_pipeline
+from fadc_octavia_provider.fortiadc_agent import sync_watermark
+from fadc_octavia_provider.fortiadc_agent import taskflow_engine
+from fadc_octavia_provider.fortiadc_agent import timeseries
+from fadc_octavia_provider.fortiadc_agent import tracing
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
@@ -68,6 +80,9 @@ class ControllerWorker(object):
         self._listener_repo = repo.ListenerRepository()
         self._member_repo = repo.MemberRepository()
         self._pool_repo = repo.PoolRepository()
+        # set by the endpoints when casts are dispatched, see lb_dispatcher
+        self.dispatcher = None
+        stats_pipeline.get_aggregator().baseline = self._stored_listener_stats
 
         self.driver_lib = driver_lib.DriverLibrary(
             status_socket=CONF.driver_agent.status_socket_path,
@@ -84,7 +99,7 @@ class ControllerWorker(object):
                 invoke_args=(persistence,),
                 invoke_on_load=True).driver
         else:
-            self.tf_engine = base_taskflow.BaseTaskFlowEngine()
+            self.tf_engine = taskflow_engine.FadcTaskFlowEngine()
 
     @tenacity.retry(
         retry=(
@@ -109,10 +124,12 @@ class ControllerWorker(object):
             self.services_controller.run_poster(func, *args, **kwargs)
         else:
             store = kwargs.pop('store', None)
-            tf = self.tf_engine.taskflow_load(
-                func(*args, **kwargs), store=store)
-            with tf_logging.DynamicLoggingListener(tf, log=LOG):
-                tf.run()
+            with tracing.span('flow.' + func.__name__):
+                tf = self.tf_engine.taskflow_load(
+                    func(*args, **kwargs), store=store)
+                with tf_logging.DynamicLoggingListener(tf, log=LOG), \
+                        taskflow_engine.MetricsListener(tf, func.__name__):
+                    tf.run()
 
     def delete_amphora(self, amphora_id):
         try:
@@ -754,45 +771,206 @@ class ControllerWorker(object):
                     self.create_health_monitor(dict_health_monitor)
 
 
-    def sync_state(self, name):
-        LOG.debug('sync_state called')
-        delete_lb_list, _ = self._lb_repo.get_all(db_apis.get_session(), provisioning_status='PENDING_DELETE', provider='fortiadc_driver')
-        for lb in delete_lb_list:
+    def load_balancer_of(self, pool_id=None, listener_id=None):
+        """(load balancer id, project id) of a pool or listener."""
+        query = db_apis.get_session().query(models.LoadBalancer.id, models.LoadBalancer.project_id)
+        if pool_id:
+            query = query.join(models.Pool, models.Pool.load_balancer_id == models.LoadBalancer.id)
+            query = query.filter(models.Pool.id == pool_id)
+        else:
+            query = query.join(models.Listener, models.Listener.load_balancer_id == models.LoadBalancer.id)
+            query = query.filter(models.Listener.id == listener_id)
+        row = query.first()
+        return (row[0], row[1]) if row else (None, None)
+
+    def _yield_to_provisioning(self):
+        if self.dispatcher is not None:
+            self.dispatcher.yield_to_provisioning()
+
+    def _sync_loadbalancers(self, project_ids=None):
+        session = db_apis.get_session()
+        if CONF.fadc_sync_bulk_load:
+            return bulk_loader.iter_loadbalancers(session, CONF.fadc_sync_page_size,
+                                                  project_ids=project_ids)
+        if project_ids is None:
+            lb_list, _ = self._lb_repo.get_all(session, provider='fortiadc_driver')
+            return lb_list
+        lb_list = []
+        for project_id in project_ids:
+            lbs, _ = self._lb_repo.get_all(session, provider='fortiadc_driver', project_id=project_id)
+            lb_list.extend(lbs)
+        return lb_list
+
+    def _is_unchanged(self, lb):
+        return lb.id in bulk_loader.unchanged(db_apis.get_session(), [lb])
+
+    def _is_orphan(self, object_id):
+        return bulk_loader.is_orphan(db_apis.get_session(), object_id,
+                                     CONF.fadc_sync_orphan_grace)
+
+    def sync_state(self, name, full=True):
+        LOG.debug('sync_state called, full %s', full)
+        watermark = sync_watermark.get_watermark(CONF)
+        with watermark.exclusive() as acquired:
+            if not acquired:
+                LOG.info('sync_state: the previous pass is still running, skipped')
+                return
+            self._sync_state(watermark, full)
+
+    def _sync_state(self, watermark, full):
+        start = time.time()
+        # a mark in memory is not shared with the other consumer processes
+        full = full or not watermark.path
+        kind = 'full' if full else 'incremental'
+        # the mark is taken before reading, changes made during the pass
+        # are newer and seen by the next one
+        since = None if full else watermark.since()
+        changed = bulk_loader.changed_projects(db_apis.get_session(), since)
+        if since is not None and not changed:
+            LOG.debug('sync_state: nothing changed since %s', since)
+            metrics.SYNC_SWEEP_SECONDS.observe(time.time() - start, kind=kind)
+            return
+        # a vdom is reconciled as a whole, so every load balancer of a
+        # changed project is loaded, not only the changed ones
+        project_ids = None if since is None else list(changed)
+        lb_list = [lb for lb in self._sync_loadbalancers(project_ids)
+                   if lb.provisioning_status != constants.DELETED]
+        for lb in lb_list:
+            if lb.provisioning_status != constants.PENDING_DELETE:
+                continue
             LOG.debug('sync_state: delete lb %s', lb.id)
             dict_lb = lb.to_dict()
             dict_lb[constants.LOADBALANCER_ID] = lb.id
             self.delete_load_balancer(dict_lb, True)
 
-        active_lb_list, _ = self._lb_repo.get_all(db_apis.get_session(), provisioning_status='ACTIVE', provider='fortiadc_driver')
-        for lb in active_lb_list:
-            LOG.debug('sync_state: check lb %s', lb.id)
-            if lb.listeners:
-                for listener in lb.listeners:
-                    LOG.debug('sync_state: check listener %s', listener.id)
-                    res = FadcdeviceDriver(CONF, listener.project_id).listener.get_status(listener)
-                    LOG.debug('sync_state: res is %s', res)
-                    if res:
-                        if isinstance(res, str) and res.find('payload') and len(res) < 20:
-                            LOG.debug('sync_state: len is %d', len(res))
-                            try:
-                                self.deploy_loadbalancer(lb)
-                            except:
-                                LOG.error('sync_state: failed to deploy %s', listener.id)
-
+        # one reconcile per vdom: active load balancers are compared with
+        # the device, objects of load balancers in any other state are left
+        # alone so that running flows are not undone. The vdoms of a device
+        # are reconciled one after the other, the devices in parallel.
+        def reconcile_device(projects):
+            for project_id, lbs in projects.items():
+                active = [lb for lb in lbs if lb.provisioning_status == constants.ACTIVE]
+                if not active:
+                    continue
+                self._yield_to_provisioning()
+                # the graphs were loaded before this vdom's turn, a load
+                # balancer changed since is left to its flow like the others
+                try:
+                    current = bulk_loader.unchanged(db_apis.get_session(), active)
+                except Exception as e:
+                    LOG.error('sync_state: cannot recheck vdom %s. reason %s', project_id, e)
+                    continue
+                active = [lb for lb in active if lb.id in current]
+                if not active:
+                    continue
+                known_ids = set()
+                for lb in lbs:
+                    if lb.id not in current:
+                        known_ids.update(reconciler.object_ids(lb))
+                LOG.debug('sync_state: reconcile vdom %s, %d lbs', project_id, len(active))
+                try:
+                    o_reconciler = reconciler.Reconciler(
+                        FadcdeviceDriver(CONF, project_id),
+                        delete_orphans=CONF.fadc_sync_delete_orphans,
+                        confirm_orphan=self._is_orphan,
+                        still_current=self._is_unchanged)
+                    changes, failed = o_reconciler.reconcile(project_id, active, known_ids)
+                except Exception as e:
+                    LOG.error('sync_state: failed to reconcile vdom %s. reason %s', project_id, e)
+                    continue
+                if changes:
+                    LOG.info('sync_state: vdom %s, %d changes applied, %d failed',
+                             project_id, len(changes) - len(failed), len(failed))
+
+        devices = bulk_loader.group_by_device(lb_list, CONF.d_projects)
+        if devices:
+            with futures.ThreadPoolExecutor(max_workers=len(devices)) as executor:
+                list(executor.map(reconcile_device, devices.values()))
+        # failures are not retried by holding the mark back, the next
+        # full pass goes over them again
+        if changed:
+            watermark.advance(max(changed.values()))
+        metrics.SYNC_SWEEP_SECONDS.observe(time.time() - start, kind=kind)
+        LOG.debug('sync_state: %s pass, %d lbs on %d devices in %.1fs',
+                  kind, len(lb_list), len(devices), time.time() - start)
+
+    def _stored_listener_stats(self, listener_ids):
+        return bulk_loader.listener_stats(db_apis.get_session(), listener_ids)
 
     def sync_stats(self, name):
-        active_lb_list, _ = self._lb_repo.get_all(db_apis.get_session(), provisioning_status='ACTIVE', provider='fortiadc_driver')
-        total_listener_stats = []
-        for lb in active_lb_list:
-            if lb.listeners:
-                res = FadcdeviceDriver(CONF, lb.listeners[0].project_id).listener.get_stats(lb.listeners)
-                if res:
-                    LOG.debug('sync_state: res is %s', res)
-                    if isinstance(res, list):
-                        LOG.debug('sync_stats: len is %d', len(res))
-                        for stats in res:
-                            total_listener_stats.append(stats)
+        marks = stats_pipeline.get_marks(CONF)
+        with marks.exclusive() as mine:
+            if not mine:
+                # the marks stay where they are, the next sweep counts
+                # what this one would have
+                LOG.debug('sync_stats: another sweep is running, skipped')
+                return
+            self._sync_stats(marks)
+
+    def _sync_stats(self, marks):
+        start = time.time()
+        with_members = getattr(CONF, 'fadc_stats_members', False)
+        store = timeseries.get_store(CONF)
+        # device -> vdom -> listeners and members, read with a query per
+        # kind instead of a load balancer graph each: one session per device
+        # and one virtual server listing per vdom, the devices are polled in
+        # parallel
+        devices = {}
+        objects = bulk_loader.stats_objects(db_apis.get_session(), members=with_members)
+        for project_id, listeners_members in objects.items():
+            device = CONF.d_projects.get(project_id, {}).get('fadc_FQDN')
+            devices.setdefault(device, {})[project_id] = listeners_members
+
+        def collect(projects):
+            device_stats = ([], [])
+            for project_id, (listeners, members) in projects.items():
+                self._yield_to_provisioning()
+                try:
+                    driver = FadcdeviceDriver(CONF, project_id)
+                    res = driver.listener.get_stats(
+                        listeners, marks.get([listener.id for listener in listeners]), start)
+                except Exception as e:
+                    LOG.error('sync_stats: vdom %s failed. reason %s', project_id, e)
+                    continue
+                if isinstance(res, list):
+                    LOG.debug('sync_stats: vdom %s, len is %d', project_id, len(res))
+                    device_stats[0].extend(res)
+                if not members:
+                    continue
+                try:
+                    last = dict((member.id, store.series(timeseries.MEMBER, member.id).latest())
+                                for member in members)
+                    device_stats[1].extend(driver.member.get_stats(members, last, start))
+                except Exception as e:
+                    LOG.error('sync_stats: members of vdom %s failed. reason %s', project_id, e)
+            return device_stats
 
+        total_listener_stats = []
+        total_member_stats = []
+        if devices:
+            with tracing.ContextThreadPoolExecutor(max_workers=len(devices)) as executor:
+                for listener_stats, member_stats in executor.map(collect, devices.values()):
+                    total_listener_stats.extend(listener_stats)
+                    total_member_stats.extend(member_stats)
+
+        store.record(timeseries.LISTENER, total_listener_stats, start)
+        store.record(timeseries.MEMBER, total_member_stats, start)
+        # only objects gone from Octavia are forgotten, the ones of a load
+        # balancer that is not ACTIVE right now keep their history
+        try:
+            listener_ids = bulk_loader.listener_ids(db_apis.get_session())
+            member_ids = bulk_loader.member_ids(db_apis.get_session()) if with_members else ()
+        except Exception as e:
+            LOG.error('sync_stats: cannot list the listeners, nothing pruned. reason %s', e)
+        else:
+            stats_pipeline.get_aggregator().prune(listener_ids)
+            marks.prune(listener_ids)
+            store.prune(timeseries.LISTENER, listener_ids)
+            store.prune(timeseries.MEMBER, member_ids)
         if len(total_listener_stats) > 0:
             update_stats = {'listeners': total_listener_stats}
             self.driver_lib.update_listener_statistics(update_stats)
+            # the counters up to start are stored now, a report that failed
+            # raised above and leaves the marks for the next sweep
+            marks.advance([stats['id'] for stats in total_listener_stats], start)
+        metrics.STATS_SWEEP_SECONDS.observe(time.time() - start)
@@ -17,18 +17,58 @@
 
 """
 
+import functools
+import inspect
+
 from oslo_config import cfg
 from oslo_log import log as logging
 import oslo_messaging as messaging
 
 from octavia.common import constants
 from fadc_octavia_provider.fortiadc_agent import controller_worker
+from fadc_octavia_provider.fortiadc_agent import lb_dispatcher
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import tracing
 
 CONF = cfg.CONF
 
 LOG = logging.getLogger(__name__)
 
 
+def _rpc_method(name, func):
+    @functools.wraps(func)
+    def wrapper(self, context, *args, **kwargs):
+        trace_id = context.get(tracing.TRACE_ID) if isinstance(context, dict) else None
+        metrics.RPC_IN_PROGRESS.inc(method=name)
+
+        def run():
+            try:
+                with tracing.span('rpc.' + name, trace_id=trace_id):
+                    return func(self, context, *args, **kwargs)
+            finally:
+                metrics.RPC_IN_PROGRESS.dec(method=name)
+
+        if self.dispatcher is None:
+            return run()
+        # casts return nothing, the work continues in the queue of its
+        # load balancer
+        if not self.dispatcher.submit(name, kwargs, run):
+            # merged into a queued update of the same object
+            with tracing.span('rpc.' + name, trace_id=trace_id, coalesced=True):
+                pass
+            metrics.RPC_IN_PROGRESS.dec(method=name)
+    return wrapper
+
+
+def _track_rpc(cls):
+    """Count, trace and dispatch the calls of every RPC method of cls."""
+    for name, func in list(vars(cls).items()):
+        if inspect.isfunction(func) and not name.startswith('_'):
+            setattr(cls, name, _rpc_method(name, func))
+    return cls
+
+
+@_track_rpc
 class Endpoints(object):
 
     target = messaging.Target(
@@ -38,6 +78,10 @@ class Endpoints(object):
     def __init__(self):
         self.a = 1
         self.worker = controller_worker.ControllerWorker()
+        self.dispatcher = None
+        if CONF.fadc_dispatch_workers:
+            self.dispatcher = lb_dispatcher.Dispatcher(self.worker.load_balancer_of, CONF)
+            self.worker.dispatcher = self.dispatcher
 
     def create_load_balancer(self, context, loadbalancer,
                              flavor=None, availability_zone=None):
@@ -166,9 +210,9 @@ class Endpoints(object):
     def delete_amphora(self, context, amphora_id):
         LOG.info('Deleting amphora \'%s\'...', amphora_id)
 
-    def sync_state(self, context, name):
+    def sync_state(self, context, name, full=True):
         LOG.info('sync state \'%s\'...', name)
-        self.worker.sync_state(name)
+        self.worker.sync_state(name, full)
 
     def sync_stats(self, context, name):
         LOG.info('sync stats \'%s\'...', name)
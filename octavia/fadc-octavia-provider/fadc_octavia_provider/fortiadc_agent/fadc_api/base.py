@@ -18,7 +18,13 @@
 """
 
 import requests
+import time
 from six import string_types
+from urllib.parse import urlsplit
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import tracing
+from fadc_octavia_provider.fortiadc_agent.servicemanager.circuit_breaker import DeviceBusy
+from fadc_octavia_provider.fortiadc_agent.servicemanager.circuit_breaker import DeviceUnavailable
 from oslo_log import log as logging
 LOG = logging.getLogger(__name__)
 
@@ -27,6 +33,22 @@ vdom_route = "?vdom="
 http_connection_timeout = 3.05
 http_read_timeout = 20
 
+def poll(attempt, timeout, initial_delay=0.05, max_delay=1):
+    """Call attempt() until it returns a true value or timeout expires.
+
+    The delay between attempts starts at initial_delay and doubles up to
+    max_delay. Returns (result of the last attempt, seconds spent waiting).
+    """
+    start = time.time()
+    delay = initial_delay
+    while True:
+        result = attempt()
+        waited = time.time() - start
+        if result or waited >= timeout:
+            return result, waited
+        time.sleep(min(delay, max(timeout - waited, 0)))
+        delay = min(delay * 2, max_delay)
+
 class RequestAction(object):
     CREATE = "create"
     DELETE = "delete"
@@ -63,71 +85,101 @@ class FADC(object):
         self.connector = connector
         self.session = connector.session
         self.verbose = verbose
-        self.headers = None
         if not self.verbose:
             #level = LOG.logger.getLevelName('WARNING')
             LOG.logger.setLevel(logging.WARNING)
-        if connector.token:
-            self.headers = {'Authorization': 'Bearer ' + connector.token}
 
-    def get(self, url_postfix, params=None, data=None):
+    @property
+    def headers(self):
+        # always read the token from the connector, it may have been
+        # refreshed by another task sharing the session
+        if self.connector.token:
+            return {'Authorization': 'Bearer ' + self.connector.token}
+        return None
+
+    def _request(self, method, url_postfix, params=None, data=None, cache=True):
+        with tracing.span('fadc.' + method, host=self.host,
+                          resource=urlsplit(url_postfix).path) as span:
+            res = self._do_request(method, url_postfix, params, data, cache)
+            if span is not None:
+                span.set('status', res.status_code)
+            return res
+
+    def _do_request(self, method, url_postfix, params, data, cache):
         url = self.url_prefix + url_postfix
-        res = requests.Response()
-        try:
-            res = self.session.get(url, headers=self.headers, params=params, data=data, timeout=(http_connection_timeout, http_read_timeout))
-            if res.status_code != 200:
-                LOG.debug( 'GET: fail')
-            else:
-                LOG.debug("res= %s" % (res))
-            return self.check_response(res)
-        except requests.ConnectionError as e:
-            return self.check_response(res)
+        response_cache = self.connector.cache
+        if method == 'GET':
+            cache = cache and params is None
+            if cache:
+                res = response_cache.get(url_postfix)
+                self.count_cache(res, url_postfix)
+                if res is not None:
+                    LOG.debug('GET %s served from cache' % (url_postfix))
+                    return res
+        start = time.time()
+        with self.connector.using():
+            res = self._send(method, url, url_postfix, params, data)
+        self.observe_request(method, url_postfix, start)
+        if method != 'GET':
+            response_cache.invalidate(url_postfix)
+        elif cache and res.status_code == HTTPStatus.OK:
+            response_cache.put(url_postfix, res)
+        return res
+
+    def count_cache(self, res, url_postfix):
+        if self.connector.cache.cacheable(url_postfix):
+            metrics.CACHE_REQUESTS.inc(host=self.host, result='miss' if res is None else 'hit')
+
+    def observe_request(self, method, url_postfix, start):
+        metrics.REST_REQUEST_SECONDS.observe(time.time() - start, host=self.host,
+                                             resource=urlsplit(url_postfix).path,
+                                             method=method)
+
+    def _send(self, method, url, url_postfix, params=None, data=None):
+        replayed = False
+        while True:
+            token = self.connector.token
+            res = requests.Response()
+            try:
+                with self.connector.breaker.attempt(), self.connector.limiter.slot():
+                    if method == 'GET':
+                        res = self.session.request(method, url, headers=self.headers, params=params, data=data, timeout=(http_connection_timeout, http_read_timeout))
+                    else:
+                        res = self.session.request(method, url, headers=self.headers, params=params, json=data, timeout=(http_connection_timeout, http_read_timeout))
+                if res.status_code != 200:
+                    LOG.debug( '%s: fail' % (method))
+                else:
+                    LOG.debug( '%s: res %s cookies %s' % (method, res, self.session.cookies))
+            except (DeviceUnavailable, DeviceBusy):
+                # fail fast, the device is known to be unreachable or the
+                # limiter found no slot: the session itself is fine
+                raise
+            except requests.ConnectionError as e:
+                # one failed socket does not break the session other tasks
+                # share, the breaker counts the failures of the device
+                LOG.debug( "e %s" %(e))
+            res = self.check_response(res)
+            if not getattr(res, 'auth_expired', False) or replayed:
+                return res
+            # token expired or session timed out: authenticate again and
+            # replay this request once
+            replayed = True
+            if not self.connector.reauthenticate(token):
+                LOG.error('Re-authentication to %s failed' % (self.host))
+                return res
+            LOG.debug('%s %s replayed with a new token' % (method, url_postfix))
 
+    def get(self, url_postfix, params=None, data=None, cache=True):
+        return self._request('GET', url_postfix, params, data, cache)
 
     def post(self, url_postfix, params=None, data=None):
-        url = self.url_prefix + url_postfix
-        res = requests.Response()
-        try:
-            res = self.session.post(url, headers=self.headers, params=params, json=data, timeout=(http_connection_timeout, http_read_timeout))
-            #if res.text.find('error') != -1:
-            if res.status_code != 200:
-                LOG.debug( 'POST: fail')
-            else:
-                #print("POST:wdai+++%s" %(str(params)))
-                #print("POST:wdai:text "+str(res.text))
-                LOG.debug( 'POST: res %s cookies %s' % (res, self.session.cookies))
-            return self.check_response(res)
-        except requests.ConnectionError as e:
-            LOG.debug( "e %s" %(e))
-            return self.check_response(res)
+        return self._request('POST', url_postfix, params, data)
 
     def put(self, url_postfix, params=None, data=None):
-        url = self.url_prefix + url_postfix
-        res = requests.Response()
-        try:
-            res = self.session.put(url, headers=self.headers, params=params, json=data, timeout=(http_connection_timeout, http_read_timeout))
-            if res.status_code != 200:
-                LOG.debug( 'PUT: fail')
-            else:
-                LOG.debug( 'PUT: res %s cookies %s' % (res, self.session.cookies))
-            return self.check_response(res)
-        except requests.ConnectionError as e:
-            LOG.debug( "e %s" %(e))
-            return self.check_response(res)
+        return self._request('PUT', url_postfix, params, data)
 
     def _delete(self, url_postfix, params=None, data=None):
-        url = self.url_prefix + url_postfix
-        res = requests.Response()
-        try:
-            res = self.session.delete(url, headers=self.headers, params=params, json=data, timeout=(http_connection_timeout, http_read_timeout))
-            if res.status_code != 200:
-                LOG.debug( 'DELETE: fail')
-            else:
-                LOG.debug( 'DELETE: res %s cookies %s' % (res, self.session.cookies))
-            return self.check_response(res)
-        except requests.ConnectionError as e:
-            LOG.debug( "e %s" %(e))
-            return self.check_response(res)
+        return self._request('DELETE', url_postfix, params, data)
 
     def doAction(self, method):
         return {
@@ -249,6 +301,7 @@ class FADC(object):
                             if self.verbose:
                                 LOG.error('Session timeout')
                             response.status_code = 401
+                            response.auth_expired = True
                 # Check vdom
 
                 # Check path
@@ -274,6 +327,7 @@ class FADC(object):
                     if isinstance (res['message'], string_types):
                         if 'Token is expired' ==  res['message']:
                             LOG.error('%s' %(res['message']))
+                            response.auth_expired = True
                     #print response.json()
             finally:
                 if self.verbose:
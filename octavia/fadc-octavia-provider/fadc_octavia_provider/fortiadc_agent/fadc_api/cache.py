@@ -0,0 +1,90 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Short lived read-through cache of FortiADC GET responses.
+
+One cache belongs to one device session. Entries are grouped by resource
+prefix and vdom; any write through the same session to a prefix/vdom drops
+the cached reads of that group, so a flow never reads back stale data it
+wrote itself.
+"""
+
+import threading
+import time
+
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+# status and statistics are never served from the cache
+uncached_prefixes = ("/status_history",)
+# writes to these change what every other resource looks like
+global_prefixes = ("/vdom", "/system_global")
+
+
+def cache_group(url_postfix):
+    parts = urlsplit(url_postfix)
+    vdom = parse_qs(parts.query).get('vdom', [''])[0]
+    return (parts.path, vdom)
+
+
+class ResponseCache(object):
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._groups = {}
+        self.hits = 0
+        self.misses = 0
+
+    def enabled(self):
+        return self.ttl > 0
+
+    def cacheable(self, url_postfix):
+        return self.enabled() and not url_postfix.startswith(uncached_prefixes)
+
+    def get(self, url_postfix):
+        if not self.cacheable(url_postfix):
+            return None
+        with self._lock:
+            entries = self._groups.get(cache_group(url_postfix), {})
+            entry = entries.get(url_postfix)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+            entries.pop(url_postfix, None)
+            self.misses += 1
+            return None
+
+    def put(self, url_postfix, response):
+        if not self.cacheable(url_postfix):
+            return
+        with self._lock:
+            entries = self._groups.setdefault(cache_group(url_postfix), {})
+            entries[url_postfix] = (time.time() + self.ttl, response)
+
+    def invalidate(self, url_postfix):
+        if not self.enabled():
+            return
+        group = cache_group(url_postfix)
+        with self._lock:
+            if group[0] in global_prefixes:
+                self._groups.clear()
+            else:
+                self._groups.pop(group, None)
+
+    def clear(self):
+        with self._lock:
+            self._groups.clear()
@@ -0,0 +1,73 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Index of pool child members, (vdom, pool_id, real_server_id) -> element.
+
+Pool members are addressed on the device by a child mkey the device picks,
+not by the real server id Octavia knows. A pool is listed once to fill the
+index, after that member update/delete go straight to the child mkey.
+Members created through the index are known to exist before their mkey is,
+the next lookup that needs the mkey lists the pool again. The index is not
+trusted to skip a create: a member it knows is read back from the device
+first, a miss drops the pool from the index.
+"""
+
+import threading
+
+
+class MemberIndex(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = {}
+
+    def loaded(self, vdom, pool_id):
+        with self._lock:
+            return (vdom, pool_id) in self._pools
+
+    def load(self, vdom, pool_id, elements):
+        members = dict((ele['real_server_id'], dict(ele)) for ele in elements)
+        with self._lock:
+            self._pools[(vdom, pool_id)] = members
+
+    def get(self, vdom, pool_id, real_server_id):
+        with self._lock:
+            ele = self._pools.get((vdom, pool_id), {}).get(real_server_id)
+            return dict(ele) if ele else None
+
+    def put(self, vdom, pool_id, element):
+        # a pool that was never listed stays unloaded, a partial index
+        # would hide the members it does not know about
+        with self._lock:
+            members = self._pools.get((vdom, pool_id))
+            if members is not None:
+                members[element['real_server_id']] = dict(element)
+
+    def remove(self, vdom, pool_id, real_server_id):
+        with self._lock:
+            self._pools.get((vdom, pool_id), {}).pop(real_server_id, None)
+
+    def drop(self, vdom, pool_id=None):
+        with self._lock:
+            if pool_id is not None:
+                self._pools.pop((vdom, pool_id), None)
+                return
+            for key in [k for k in self._pools if k[0] == vdom]:
+                del self._pools[key]
+
+    def clear(self):
+        with self._lock:
+            self._pools.clear()
@@ -19,16 +19,49 @@
 """
 
 from fadc_octavia_provider.fortiadc_agent.fadc_api.base import FADC
+from fadc_octavia_provider.fortiadc_agent.fadc_api.base import HTTPStatus
 from fadc_octavia_provider.fortiadc_agent.fadc_api.base import RequestAction
+from fadc_octavia_provider.fortiadc_agent.fadc_api.base import poll
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.virtual_server import stats_concurrency
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.virtual_server import stats_executor
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.virtual_server import stats_payload
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import stats_pipeline
 from oslo_log import log as logging
 #from fortinet_openstack_agent import exceptions as f_exceptions
-import time
 import sys
 LOG = logging.getLogger(__name__)
 
 
 vdom_route = "?vdom="
 pkey_route = "&pkey="
+# a new real server is not always usable as pool member right away, retry
+# the member write with a backoff from ready_initial_delay up to
+# ready_max_delay until ready_timeout seconds have passed
+ready_initial_delay = 0.05
+ready_max_delay = 1
+ready_timeout = 10
+# payload error codes of a pool member create whose real server the device
+# does not know yet
+not_ready_errcodes = {-1}
+
+
+class MemberNotReady(Exception):
+    """The real server of a new pool member is not usable yet."""
+
+
+def _payload_code(response):
+    """Error code of a write the device answered, None for an HTTP error
+    such as 424 for a missing pool."""
+    if getattr(response, 'status_code', None) != HTTPStatus.OK:
+        return None
+    try:
+        payload = response.json()['payload']
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+    return payload if isinstance(payload, int) else None
+
+
 class RS(FADC):
 
     def __init__(self, host, connector, verbose):
@@ -42,10 +75,7 @@ class RS(FADC):
             raise Exception('Create real server failed')
         else:
             #do member child create
-            time.sleep(1)
-            child = RSpool_member(self.host, self.connector, self.verbose)
-            if not child.is_exist(rs):
-                child.create(rs)
+            self.sync_child(rs, sys._getframe().f_code.co_name)
     def delete(self, rs):
         # delete pool member first
         errcodes = {-1}
@@ -57,6 +87,13 @@ class RS(FADC):
             #raise f_exceptions.NotFoundException('Delete real server failed')
             raise Exception('Delete real server failed')
 
+    def delete_direct(self, rs):
+        # real server that is no member of any pool
+        errcodes = {-1}
+        ok = self.action_handler('delete', errcodes, rs)
+        if not ok:
+            raise Exception('Directly delete real server failed')
+
     def update(self, rs):
         errcodes = {}
         ok = self.action_handler(sys._getframe().f_code.co_name, errcodes, rs)
@@ -64,10 +101,35 @@ class RS(FADC):
             raise Exception('Update server failed')
         else:
             #do member child update
-            time.sleep(1)
-            child = RSpool_member(self.host, self.connector, self.verbose)
-            if child.is_exist(rs):
-                child.update(rs)
+            self.sync_child(rs, sys._getframe().f_code.co_name)
+
+    def sync_child(self, rs, method):
+        """Create or update the pool member of rs once the device accepts it.
+
+        Only MemberNotReady is retried, any other error is raised at once.
+        """
+        child = RSpool_member(self.host, self.connector, self.verbose)
+        errors = []
+
+        def attempt():
+            try:
+                if method == RequestAction.CREATE:
+                    if not child.is_exist(rs, confirm=True):
+                        child.create(rs)
+                elif child.is_exist(rs):
+                    child.update(rs)
+                return True
+            except MemberNotReady as e:
+                LOG.debug('pool member of %s not ready: %s', rs.id, e)
+                errors.append(e)
+                return False
+
+        ok, waited = poll(attempt, ready_timeout, ready_initial_delay, ready_max_delay)
+        metrics.RS_READY_WAIT.observe(waited, method=method)
+        if not ok:
+            raise errors[-1]
+        if waited:
+            LOG.debug('pool member of %s written after %.3fs', rs.id, waited)
 
     def getone(self, rs):
         errcodes = {}
@@ -85,13 +147,45 @@ class RS(FADC):
         }
     def get_availability(self, member):
         child = RSpool_member(self.host, self.connector, self.verbose)
-        _all = child.getall(member)
-        if not all:
+        if not child.lookup(member, need_mkey=True):
+            if not self.connector.member_index.loaded(member.project_id, member.pool_id):
+                raise Exception("Get availability failed")
+            return ""
+        ele = child.getone(member)
+        if not ele:
             raise Exception("Get availability failed")
-        for ele in _all:
-            if ele['real_server_id'] == member.id:
-                return ele['availability']
-        return ""
+        return ele.get('availability', "")
+
+    def get_rs_stats(self, member, ptype):
+        param = "&range=" + ptype + "&mkey=" + member.id
+        url = "/status_history/rs" + vdom_route + member.project_id + param
+        return stats_payload(self.get(url))
+
+    def get_all_rs_stats(self, members, ptype, concurrency=stats_concurrency, last=None, now=None):
+        """Stats of members, the members of one vdom.
+
+        The status_history of the real server of each member is requested
+        on the stats pool of the device, like the virtual server ones. The counters of a
+        member are its sample in last, {member_id: (time, counters)}, grown
+        by the samples that ended since.
+        """
+        if not members:
+            return []
+        last = last or {}
+        executor = stats_executor(self.host, concurrency)
+        payloads = list(executor.map(lambda member: self.get_rs_stats(member, ptype), members))
+        rs_stats_list = []
+        for member, payload in zip(members, payloads):
+            if not payload:
+                continue
+            try:
+                stats = stats_pipeline.accumulate(payload, ptype, last.get(member.id), now)
+            except (KeyError, TypeError, ValueError) as e:
+                LOG.warning('bad status_history of member %s: %s', member.id, e)
+                continue
+            stats['id'] = member.id
+            rs_stats_list.append(stats)
+        return rs_stats_list
 class RSpool_member(FADC):
 
     def __init__(self, host, connector, verbose):
@@ -115,15 +209,48 @@ class RSpool_member(FADC):
         if not ok:
             raise Exception('Update member from pool failed')
 
-    def getall(self, member):
+    def getone(self, member):
         errcodes = {}
         return self.action_handler(member, sys._getframe().f_code.co_name, errcodes)
-    def is_exist(self, member):
-        _all = self.getall(member)
-        for ele in _all:
-            if member.id == ele['real_server_id'] and str(member.protocol_port) == ele['port']:
-                return True
-        return False
+
+    def getall(self, member):
+        errcodes = {}
+        _all = self.action_handler(member, sys._getframe().f_code.co_name, errcodes)
+        if isinstance(_all, list):
+            self.connector.member_index.load(member.project_id, member.pool_id, _all)
+        return _all
+
+    def lookup(self, member, need_mkey=False):
+        """Pool child element of member from the index, None if absent.
+
+        The pool is only listed when it is not indexed yet, or when the
+        child mkey is needed but the member was created after the listing
+        or is not indexed at all: another consumer process or the
+        reconciler may have created it.
+        """
+        index = self.connector.member_index
+        vdom_name = member.project_id
+        pkey = member.pool_id
+        ele = index.get(vdom_name, pkey, member.id)
+        if index.loaded(vdom_name, pkey):
+            if ele and not (need_mkey and 'mkey' not in ele):
+                return ele
+            if not ele and not need_mkey:
+                return None
+            index.drop(vdom_name, pkey)
+        self.getall(member)
+        return index.get(vdom_name, pkey, member.id)
+
+    def is_exist(self, member, confirm=False):
+        """confirm reads a member found in the index back from the device,
+        a member removed on the device behind the agent's back is then
+        created again instead of skipped."""
+        ele = self.lookup(member)
+        if ele and confirm:
+            ele = self.getone(member)
+            if not ele:
+                self.connector.member_index.drop(member.project_id, member.pool_id)
+        return bool(ele) and str(member.protocol_port) == ele['port']
     def mapping(self, member):
         return {
             'real_server_id': member.id,
@@ -159,29 +286,43 @@ class RSpool_member(FADC):
         pkey = member.pool_id
         url = self.prefix + vdom_route + vdom_name + pkey_route + pkey
         ok = True
-        if method in [RequestAction.DELETE, RequestAction.UPDATE]:
-            found = 0
-            all = self.getall(member)
-            if not all:
-                return not ok
-            for ele in all:
-                if ele['real_server_id'] == member.id:
-                    url = self.prefix + vdom_route + vdom_name + pkey_route + pkey + "&mkey=" + ele['mkey']
-                    if method == RequestAction.UPDATE:
-                        ele.update(config)
-                        config = ele
-                    found = 1
-                    break
-            if not found:
+        if method in [RequestAction.DELETE, RequestAction.UPDATE, RequestAction.GETONE]:
+            ele = self.lookup(member, need_mkey=True)
+            if not ele:
                 return not ok
+            url += "&mkey=" + ele['mkey']
+            if method == RequestAction.UPDATE:
+                ele.update(config)
+                config = ele
         else:
             config.update(self.attrs_set_on_device())
 
-        response = self.doAction(method)(url, None, config)
+        if method == RequestAction.GETONE:
+            # availability is live state, never serve it from the cache
+            response = self.get(url, cache=False)
+        else:
+            response = self.doAction(method)(url, None, config)
 
         ok = self.response_handler(response, errcodes)
-        if ok and method == RequestAction.GETALL:
+        self.update_index(member, method, ok, config)
+        if (not ok and method == RequestAction.CREATE and
+                _payload_code(response) in not_ready_errcodes):
+            raise MemberNotReady('real server %s is not known to pool %s yet'
+                                 % (member.id, member.pool_id))
+        if ok and method in [RequestAction.GETALL, RequestAction.GETONE]:
             return response.json()['payload']
         return ok
 
-
+    def update_index(self, member, method, ok, config):
+        index = self.connector.member_index
+        vdom_name = member.project_id
+        pkey = member.pool_id
+        if method in [RequestAction.GETALL, RequestAction.GETONE]:
+            return
+        if not ok:
+            # the index no longer matches the device, list the pool again
+            index.drop(vdom_name, pkey)
+        elif method == RequestAction.DELETE:
+            index.remove(vdom_name, pkey, member.id)
+        else:
+            index.put(vdom_name, pkey, config)
@@ -43,6 +43,7 @@ class RSpool(FADC):
         errcodes = {-1}
         #errcodes = {}
         ok = self.action_handler(sys._getframe().f_code.co_name, errcodes, pool)
+        self.connector.member_index.drop(pool.project_id, pool.id)
         if not ok:
             raise Exception('Delete pool %s failed' %(pool.id))
             #raise f_exceptions.NotFoundException('Delete pool %s failed' %(pool.id))
@@ -18,13 +18,51 @@
 """
 
 from fadc_octavia_provider.fortiadc_agent.fadc_api.base import FADC
+from fadc_octavia_provider.fortiadc_agent.fadc_api.base import HTTPStatus
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import stats_pipeline
+from fadc_octavia_provider.fortiadc_agent import tracing
 import sys
+import threading
+import time
 from oslo_log import log as logging
 #from fortinet_openstack_agent import exceptions as f_exceptions
 LOG = logging.getLogger(__name__)
 
 vdom_route = "?vdom="
 pkey_route = "&pkey="
+# status_history requests of one device in flight at the same time
+stats_concurrency = 8
+
+_stats_executors = {}
+_stats_executors_lock = threading.Lock()
+
+
+def stats_executor(host, concurrency=stats_concurrency):
+    """Thread pool of the status_history requests of device host.
+
+    One pool per device for the life of the process, shared by every vdom
+    and sweep, so the requests of a device are bounded by concurrency
+    whoever makes them and no threads are started per call. The jobs run
+    in the caller's context, their spans stay in its trace.
+    """
+    with _stats_executors_lock:
+        executor = _stats_executors.get(host)
+        if executor is None:
+            executor = tracing.ContextThreadPoolExecutor(
+                max_workers=max(1, concurrency), thread_name_prefix='fadc-stats-%s' % host)
+            _stats_executors[host] = executor
+        return executor
+
+
+def stats_payload(response):
+    """Decoded status_history payload, None if the request failed."""
+    if response.status_code != HTTPStatus.OK:
+        return None
+    payload = response.json()['payload']
+    return payload if isinstance(payload, dict) else None
+
+
 class VirtualServer(FADC):
 
     def __init__(self, host, connector, verbose):
@@ -109,42 +147,41 @@ class VirtualServer(FADC):
             'pagespeed':""
         }
 
-    def get_all_vs_stats(self, all_vs, ptype):
-
-        vs_stats_list = []
-        if all_vs:
-            _all=self.getall(all_vs[0])
-            vs_on_device = [ele['mkey'] for ele in _all]
-
-        for vs in all_vs:
-            if vs.id not in vs_on_device:
-                raise Exception('Cannot get vs stat')
-
-            #ptype = "0"
-            count = "60"
-            param = "&range=" + ptype + "&mkey=" + vs.id
-            #url = "/status_history/openstack_vs" + vdom_route + vs.project_id + param
-            url = "/status_history/vs" + vdom_route + vs.project_id + param
-
-            response = self.get(url)
-            ok = self.response_handler(response, {})
-
-            if ok:
-                vs_stats = {
-                            'id': vs.id,
-                            'bytes_in':0,
-                            'bytes_out':0,
-                            'active_connections':0,
-                            'total_connections':0,
-                            'request_errors':0
-                           }
-
-                vs_stats['bytes_in'] = sum(int(e) for e in response.json()['payload']['in_bytes'])
-                vs_stats['bytes_out'] = sum (int(e) for e in response.json()['payload']['out_bytes'])
-                vs_stats['active_connections'] = sum (int(e) for e in response.json()['payload']['current_sessions'])
-                vs_stats['total_connections'] = sum (int(e) for e in (response.json()['payload']['total_sessions']))
-                vs_stats_list.append(vs_stats)
-
+    def get_vs_stats(self, vs, ptype):
+        #ptype = "0"
+        param = "&range=" + ptype + "&mkey=" + vs.id
+        #url = "/status_history/openstack_vs" + vdom_route + vs.project_id + param
+        url = "/status_history/vs" + vdom_route + vs.project_id + param
+
+        return stats_payload(self.get(url))
+
+    def get_all_vs_stats(self, all_vs, ptype, concurrency=stats_concurrency, marks=None, now=None):
+        """Stats of all_vs, the virtual servers of one vdom.
+
+        The per virtual server status_history requests run on the stats
+        pool of the device, at most concurrency of them at the same time,
+        sharing the device session. The samples
+        of each window after the mark of its listener, from marks, and up
+        to now, the time of the sync_stats sweep, are added to the counters
+        by the stats pipeline.
+        """
+        if not all_vs:
+            return []
+        start = time.time()
+        _all = self.getall(all_vs[0])
+        vs_on_device = [ele['mkey'] for ele in _all] if _all else []
+
+        # a missing virtual server must not cost the stats of the whole vdom
+        missing = [vs.id for vs in all_vs if vs.id not in vs_on_device]
+        if missing:
+            LOG.warning('Cannot get vs stat of %s, not on the device', ', '.join(missing))
+            all_vs = [vs for vs in all_vs if vs.id in vs_on_device]
+
+        executor = stats_executor(self.host, concurrency)
+        results = list(executor.map(lambda vs: self.get_vs_stats(vs, ptype), all_vs))
+        payloads = dict((vs.id, payload) for vs, payload in zip(all_vs, results) if payload)
+        vs_stats_list = stats_pipeline.get_aggregator().aggregate(payloads, ptype, marks, now)
+
+        metrics.STATS_COLLECT_SECONDS.observe(time.time() - start, host=self.host)
+        metrics.STATS_LISTENERS.inc(len(vs_stats_list), host=self.host)
         return vs_stats_list
-
-
@@ -34,7 +34,12 @@ class Vdom(FADC):
     def __init__(self, host, connector, verbose):
         self.prefix = "/vdom"
         super(Vdom, self).__init__(host, connector, verbose)
-        res = self.get(sys_global_prefix)
+        # the global setting only has to be checked once per login
+        if not connector.vdom_admin_enabled:
+            self.enable_vdom_admin()
+
+    def enable_vdom_admin(self):
+        res = self.get(sys_global_prefix, cache=False)
         if res.status_code == HTTPStatus.OK:
             global_config = res.json()['payload']
             vdom_status = global_config['vdom-admin']
@@ -44,8 +49,11 @@ class Vdom(FADC):
                 res = self.put(sys_global_prefix, data=global_config)
                 if res.status_code == HTTPStatus.OK:
                     LOG.debug("enable_vdom succeedED")
+                    self.connector.vdom_admin_enabled = True
                 else:
                     LOG.debug("enable_vdom failed")
+            else:
+                self.connector.vdom_admin_enabled = True
         else:
             message = 'Vdom init failed'
             'status_code = '+str(res.status_code)
@@ -61,6 +69,7 @@ class Vdom(FADC):
     def delete(self, vdom_name):
         errcodes = {}
         ok = self.action_handler(sys._getframe().f_code.co_name, errcodes, vdom_name)
+        self.connector.member_index.drop(vdom_name)
         if not ok:
             #raise f_exceptions.NotFoundException('Delete vdom failed')
             #modify 2024 
@@ -22,7 +22,7 @@ from oslo_config import cfg
 from oslo_log import log as logging
 
 from fadc_octavia_provider.fortiadc_agent.servicemanager.lb import LoadBalancer
-from fadc_octavia_provider.fortiadc_agent.servicemanager.connector import Connector
+from fadc_octavia_provider.fortiadc_agent.servicemanager.session_pool import get_session_pool
 from fadc_octavia_provider.fortiadc_agent.servicemanager.listener import Listener
 from fadc_octavia_provider.fortiadc_agent.servicemanager.pool import Pool
 from fadc_octavia_provider.fortiadc_agent.servicemanager.member import Member
@@ -56,21 +56,18 @@ class FadcdeviceDriver(object):
         return self.__class__.__name__
 
     def disconnect(self):
-        self.connector.logout()
+        get_session_pool(self.conf).discard(self.connector)
 
     def conn(self):
-        if hasattr(self, "connector"):
-            self.disconnect()
-        self.connector = Connector(self.host, self.o_device.certificate_verify, self.o_device.ca_file)
-        try:
-            self.connector.login(self.o_device.fadc_username, self.o_device.fadc_password)
-            #self.connector.check_version()
-        except Exception as e:
-            LOG.error('login %s failed. reason %s\n' %(self.host, e))
+        self.connector = get_session_pool(self.conf).acquire(self.o_device)
+
     def refresh(self):
         try:
-            #self.connector.refresh()
-            self.conn()
+            # the session is shared with other tasks: get it a new token
+            # rather than breaking it, only a session that cannot
+            # authenticate any more is replaced
+            if not self.connector.reauthenticate(self.connector.token):
+                self.conn()
         except Exception as e:
             LOG.error('refresh %s failed. reason %s\n' %(self.host, e))
 
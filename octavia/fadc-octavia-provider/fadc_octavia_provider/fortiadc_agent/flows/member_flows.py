@@ -120,13 +120,15 @@ class MemberFlows(object):
         """
         batch_update_members_flow = linear_flow.Flow(
             constants.BATCH_UPDATE_MEMBERS_FLOW)
+        unordered_members_revert_flow = unordered_flow.Flow(
+            constants.UNORDERED_MEMBER_UPDATES_FLOW + '-revert')
         unordered_members_flow = unordered_flow.Flow(
             constants.UNORDERED_MEMBER_UPDATES_FLOW)
         unordered_members_active_flow = unordered_flow.Flow(
             constants.UNORDERED_MEMBER_ACTIVE_FLOW)
 
         # Delete old members
-        unordered_members_flow.add(
+        unordered_members_revert_flow.add(
             fadc_lifecycle_tasks.MembersToErrorOnRevertTask(
                 inject={constants.MEMBERS: old_members},
                 name='{flow}-deleted'.format(
@@ -144,7 +146,7 @@ class MemberFlows(object):
                     flow=constants.DECREMENT_MEMBER_QUOTA_FLOW)))
 
         # Create new members
-        unordered_members_flow.add(
+        unordered_members_revert_flow.add(
             fadc_lifecycle_tasks.MembersToErrorOnRevertTask(
                 inject={constants.MEMBERS: new_members},
                 name='{flow}-created'.format(
@@ -158,7 +160,7 @@ class MemberFlows(object):
                         flow=constants.MARK_MEMBER_ACTIVE_INDB)))
 
         # Update existing members
-        unordered_members_flow.add(
+        unordered_members_revert_flow.add(
             fadc_lifecycle_tasks.MembersToErrorOnRevertTask(
                 # updated_members is a list of (obj, dict), only pass `obj`
                 inject={constants.MEMBERS: [m[0] for m in updated_members]},
@@ -166,6 +168,11 @@ class MemberFlows(object):
                     flow=constants.MEMBER_TO_ERROR_ON_REVERT_FLOW)))
         for m, um in updated_members:
             um.pop(constants.ID, None)
+            unordered_members_flow.add(fadc_database_tasks.UpdateMemberInDB(
+                inject={constants.MEMBER: m, constants.UPDATE_DICT: um},
+                name='{flow}-{id}'.format(
+                    id=m[constants.MEMBER_ID],
+                    flow=constants.UPDATE_MEMBER_INDB)))
             unordered_members_active_flow.add(
                 fadc_database_tasks.MarkMemberActiveInDB(
                     inject={constants.MEMBER: m},
@@ -173,6 +180,16 @@ class MemberFlows(object):
                         id=m[constants.MEMBER_ID],
                         flow=constants.MARK_MEMBER_ACTIVE_INDB)))
 
+        batch_update_members_flow.add(unordered_members_revert_flow)
+
+        # Push the whole batch to the device while the old members are
+        # still in the database, a failure reverts every member to ERROR
+        batch_update_members_flow.add(fortiadc_driver_tasks.MembersBatchUpdate(
+            inject={'old_members': old_members,
+                    'new_members': new_members,
+                    'updated_members': updated_members},
+            requires=constants.PROJECT_ID))
+
         batch_update_members_flow.add(unordered_members_flow)
 
         # Mark all the members ACTIVE here, then pool then LB/Listeners
@@ -28,6 +28,7 @@ from oslo_log import log as logging
 
 from octavia.common import service as octavia_service
 from fadc_octavia_provider.fortiadc_agent import consumer as consumer_v2
+from fadc_octavia_provider.fortiadc_agent import metrics_service
 from fadc_octavia_provider.fortiadc_agent import monitor_service
 from fadc_octavia_provider.fortiadc_agent import update_service
 from fadc_octavia_provider.fortiadc_agent import stats_service
@@ -108,6 +109,198 @@ OPTS = [
     cfg.StrOpt(
         'fadc_devices', default='',
         help='fortiadc devices'
+    ),
+    cfg.IntOpt(
+        'fadc_session_idle_timeout', default=300,
+        help='Seconds a pooled Fortiadc session may stay unused before it is logged out'
+    ),
+    cfg.IntOpt(
+        'fadc_session_pool_maxsize', default=10,
+        help='Maximum keep-alive connections kept per Fortiadc device session'
+    ),
+    cfg.IntOpt(
+        'fadc_token_refresh_interval', default=600,
+        help='Refresh the bearer token of a pooled Fortiadc session once it is '
+             'older than this many seconds. 0 disables the proactive refresh'
+    ),
+    cfg.FloatOpt(
+        'fadc_get_cache_ttl', default=2,
+        help='Seconds a Fortiadc GET response is reused by later reads of the '
+             'same session. Writes through the session invalidate it. 0 disables the cache'
+    ),
+    cfg.IntOpt(
+        'fadc_max_concurrent_requests', default=16,
+        help='Requests and logins in flight to one Fortiadc device, more wait '
+             'in the agent. 0 for no limit. A fadc_devices entry may set its own'
+    ),
+    cfg.FloatOpt(
+        'fadc_max_requests_per_second', default=0,
+        help='Requests and logins started per second on one Fortiadc device, '
+             '0 for no limit. A fadc_devices entry may set its own'
+    ),
+    cfg.FloatOpt(
+        'fadc_max_logins_per_minute', default=0,
+        help='Logins per minute to one Fortiadc device, 0 for no limit. '
+             'A fadc_devices entry may set its own'
+    ),
+    cfg.IntOpt(
+        'fadc_breaker_failure_threshold', default=5,
+        help='Requests in a row that cannot reach a Fortiadc device before its '
+             'requests fail at once instead of waiting for the timeouts. '
+             '0 disables the circuit breaker. A fadc_devices entry may set its own'
+    ),
+    cfg.FloatOpt(
+        'fadc_breaker_reset_timeout', default=30,
+        help='Seconds the circuit breaker of an unreachable Fortiadc device '
+             'stays open before one request probes the device again. '
+             'A fadc_devices entry may set its own'
+    ),
+    cfg.IntOpt(
+        'fadc_batch_concurrency', default=8,
+        help='Maximum member operations of one batch member update running '
+             'at the same time. The load on a device across all batches is '
+             'bounded by fadc_max_concurrent_requests'
+    ),
+    cfg.StrOpt(
+        'fadc_flow_executor', default='shared', choices=['shared', 'per_device'],
+        help='Thread pool running the tasks of the provisioning flows. '
+             'shared is the one pool of [task_flow] max_workers threads, '
+             'per_device gives every Fortiadc device a pool of its own. '
+             'The engine is always [task_flow] engine'
+    ),
+    cfg.IntOpt(
+        'fadc_flow_workers', default=8,
+        help='Threads per Fortiadc device running flow tasks with the '
+             'per_device flow executor'
+    ),
+    cfg.IntOpt(
+        'fadc_dispatch_workers', default=32,
+        help='Threads of a consumer running casts. Casts of one load balancer '
+             'run one after the other, in order. The order only holds within '
+             'one consumer process, the agent then runs a single one whatever '
+             '[controller_worker] workers says. 0 runs every cast in the RPC '
+             'server thread that received it'
+    ),
+    cfg.IntOpt(
+        'fadc_dispatch_device_concurrency', default=8,
+        help='Load balancers of one Fortiadc device with a cast running at '
+             'the same time, 0 for no limit'
+    ),
+    cfg.IntOpt(
+        'fadc_background_workers', default=2,
+        help='Threads of a consumer running sync_state and sync_stats, apart '
+             'from the threads of the provisioning casts'
+    ),
+    cfg.IntOpt(
+        'fadc_background_yield_backlog', default=16,
+        help='sync_state and sync_stats pause between two vdoms while more '
+             'provisioning casts than this are waiting. 0 never pauses them'
+    ),
+    cfg.FloatOpt(
+        'fadc_coalesce_window', default=0,
+        help='Seconds a queued update waits for later updates of the same '
+             'object to merge into it. 0 starts it at once, updates then '
+             'only merge while they wait behind other work of their load '
+             'balancer'
+    ),
+    cfg.IntOpt(
+        'fadc_sync_interval', default=60,
+        help='Seconds between two sync_state passes. A pass only reconciles '
+             'the vdoms with Octavia objects changed since the previous one'
+    ),
+    cfg.IntOpt(
+        'fadc_sync_full_interval', default=3600,
+        help='Seconds between two sync_state passes over every vdom, '
+             'whatever changed'
+    ),
+    cfg.StrOpt(
+        'fadc_sync_watermark_file', default='/var/lib/octavia/fadc_sync_watermark.json',
+        help='File keeping the newest Octavia change sync_state has checked. '
+             'It is shared by the consumer processes, whose sync_state passes '
+             'it serializes. Empty makes every pass a full one'
+    ),
+    cfg.BoolOpt(
+        'fadc_sync_bulk_load', default=True,
+        help='Load the load balancers of sync_state page by page with their '
+             'whole object graph eagerly loaded, instead of object by object'
+    ),
+    cfg.IntOpt(
+        'fadc_sync_page_size', default=500,
+        help='Load balancers read per database page by the bulk load of sync_state'
+    ),
+    cfg.BoolOpt(
+        'fadc_sync_delete_orphans', default=False,
+        help='Delete the device objects with an Octavia id that Octavia does '
+             'not know. By default sync_state only reports them'
+    ),
+    cfg.IntOpt(
+        'fadc_sync_orphan_grace', default=300,
+        help='Seconds after its creation an Octavia object deleted since is '
+             'still not treated as an orphan by fadc_sync_delete_orphans'
+    ),
+    cfg.IntOpt(
+        'fadc_stats_concurrency', default=8,
+        help='Statistics requests of one FortiADC device in flight at the same '
+             'time, on a thread pool per device'
+    ),
+    cfg.StrOpt(
+        'fadc_stats_marks_file', default='/var/lib/octavia/fadc_stats_marks.json',
+        help='File keeping per listener the time up to which its statistics '
+             'are stored in Octavia. It is shared by the consumer processes, '
+             'whose sync_stats sweeps it serializes. Empty keeps it in '
+             'memory, only right with a single consumer process'
+    ),
+    cfg.StrOpt(
+        'fadc_stats_history_dir', default='/var/lib/octavia/fadc_stats',
+        help='Directory of the listener and member statistics history files, '
+             'read by the metrics endpoint. Empty keeps the history in '
+             'memory only, where the metrics endpoint cannot see it'
+    ),
+    cfg.IntOpt(
+        'fadc_stats_history_size', default=1024,
+        help='Statistics samples kept per listener and member'
+    ),
+    cfg.IntOpt(
+        'fadc_stats_history_window', default=3600,
+        help='Seconds of history the statistics rates and percentiles of the '
+             'metrics endpoint cover'
+    ),
+    cfg.BoolOpt(
+        'fadc_stats_members', default=False,
+        help='Also record the statistics of every member in the history, one '
+             'more status_history request per member and sync_stats sweep'
+    ),
+    cfg.PortOpt(
+        'fadc_metrics_port', default=0,
+        help='Port of the Prometheus metrics endpoint, 0 disables it'
+    ),
+    cfg.StrOpt(
+        'fadc_metrics_host', default='127.0.0.1',
+        help='Address the metrics endpoint listens on'
+    ),
+    cfg.StrOpt(
+        'fadc_metrics_dir', default='/var/lib/octavia/fadc_metrics',
+        help='Directory where the agent processes leave their metrics for '
+             'the endpoint. It is created with mode 0700 and must belong to '
+             'the agent user'
+    ),
+    cfg.IntOpt(
+        'fadc_metrics_snapshot_interval', default=15,
+        help='Seconds between two metrics snapshots of an agent process'
+    ),
+    cfg.StrOpt(
+        'fadc_trace_exporter', default='none',
+        choices=['none', 'file', 'otlp'],
+        help='Where to export request traces: nowhere, a JSON lines file '
+             'or an OTLP/HTTP collector'
+    ),
+    cfg.StrOpt(
+        'fadc_trace_file', default='/var/log/octavia/fadc_traces.jsonl',
+        help='File the file trace exporter appends spans to'
+    ),
+    cfg.StrOpt(
+        'fadc_trace_otlp_endpoint', default='http://127.0.0.1:4318/v1/traces',
+        help='OTLP/HTTP traces URL of the collector'
     )
 ]
 
@@ -201,6 +394,31 @@ def init_device_conf(json_devices):
                 else:
                     new_project['ca_file'] = ''
 
+                if 'fadc_max_concurrent_requests' in device:
+                    new_project['fadc_max_concurrent_requests'] = device['fadc_max_concurrent_requests']
+                else:
+                    new_project['fadc_max_concurrent_requests'] = CONF.fadc_max_concurrent_requests
+
+                if 'fadc_max_requests_per_second' in device:
+                    new_project['fadc_max_requests_per_second'] = device['fadc_max_requests_per_second']
+                else:
+                    new_project['fadc_max_requests_per_second'] = CONF.fadc_max_requests_per_second
+
+                if 'fadc_max_logins_per_minute' in device:
+                    new_project['fadc_max_logins_per_minute'] = device['fadc_max_logins_per_minute']
+                else:
+                    new_project['fadc_max_logins_per_minute'] = CONF.fadc_max_logins_per_minute
+
+                if 'fadc_breaker_failure_threshold' in device:
+                    new_project['fadc_breaker_failure_threshold'] = device['fadc_breaker_failure_threshold']
+                else:
+                    new_project['fadc_breaker_failure_threshold'] = CONF.fadc_breaker_failure_threshold
+
+                if 'fadc_breaker_reset_timeout' in device:
+                    new_project['fadc_breaker_reset_timeout'] = device['fadc_breaker_reset_timeout']
+                else:
+                    new_project['fadc_breaker_reset_timeout'] = CONF.fadc_breaker_reset_timeout
+
                 #dict_projects[project['project_id']] = new_project
                 dict_projects[project] = new_project
 
@@ -222,8 +440,19 @@ def main():
     #       args=(CONF,))
     sm.add(stats_service.StatsService, workers=1,
            args=(CONF,))
+    consumer_workers = CONF.controller_worker.workers
+    if CONF.fadc_dispatch_workers and consumer_workers > 1:
+        # the consumers share one topic queue, the casts of a load balancer
+        # would be spread over processes that do not order them
+        LOG.warning('fadc_dispatch_workers orders the casts of a load balancer '
+                    'within one consumer process, running 1 consumer instead of %d',
+                    consumer_workers)
+        consumer_workers = 1
     sm.add(consumer_v2.ConsumerService,
-           workers=CONF.controller_worker.workers, args=(CONF,))
+           workers=consumer_workers, args=(CONF,))
+    if CONF.fadc_metrics_port:
+        sm.add(metrics_service.MetricsService, workers=1,
+               args=(CONF,))
     oslo_config_glue.setup(sm, CONF, reload_method="mutate")
     sm.run()
 
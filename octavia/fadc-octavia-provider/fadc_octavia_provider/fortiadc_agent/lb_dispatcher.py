@@ -0,0 +1,382 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Per load balancer ordering of the casts the consumer receives.
+
+Every cast is queued under the load balancer it works on. A queue runs one
+operation at a time, in arrival order, so a create_member cannot overtake
+the create_pool of its pool. Queues of different load balancers run in
+parallel on a shared pool of threads, at most fadc_dispatch_device_concurrency
+of them per FortiADC device. Members and health monitors only name their
+pool, its load balancer is looked up once, by a dispatch thread rather
+than the one taking the casts in, and remembered. Casts that are not about
+a load balancer (sync_state, sync_stats) are queued by method.
+
+While a lookup is pending, every later provisioning cast goes through the
+lookup queue too, so a cast that already names its load balancer cannot
+overtake one still being looked up. The lookup queue only routes the casts,
+they still run in the queue of their load balancer.
+
+The order only holds within one consumer process: the consumers share the
+topic queue, so the agent runs a single consumer while the dispatcher is on.
+
+Updates are coalesced: an update that arrives while an update of the same
+object is the last cast of its queue and has not started is merged into
+it, later attribute values win. The flow leaves the object ACTIVE, which
+also answers the updates merged into it. An update starts as soon as its
+queue reaches it, only updates that pile up behind other work of their
+load balancer merge. With fadc_coalesce_window set, an update also waits
+that many seconds after its arrival, so a burst of updates to an idle load
+balancer becomes one flow.
+
+sync_state and sync_stats are background work: they run on threads of
+their own (fadc_background_workers), so provisioning keeps every dispatch
+thread, and they pause between vdoms while more than
+fadc_background_yield_backlog provisioning casts are waiting.
+"""
+
+import collections
+from concurrent import futures
+import functools
+import threading
+import time
+
+from oslo_log import log as logging
+
+from octavia.common import constants
+from fadc_octavia_provider.fortiadc_agent import metrics
+
+LOG = logging.getLogger(__name__)
+
+default_workers = 32
+default_device_concurrency = 8
+default_coalesce_window = 0
+default_background_workers = 2
+default_yield_backlog = 16
+# longest pause of background work for one yield
+max_yield = 60
+max_remembered = 10000
+
+background_methods = ('sync_state', 'sync_stats')
+resolve_key = ('resolve',)
+
+# update cast -> (argument with the changed attributes, id key of the object)
+coalesced = {
+    'update_load_balancer': ('load_balancer_updates', constants.LOADBALANCER_ID),
+    'update_listener': ('listener_updates', constants.LISTENER_ID),
+    'update_pool': ('pool_updates', constants.POOL_ID),
+    'update_member': ('member_updates', constants.MEMBER_ID),
+    'update_health_monitor': ('health_monitor_updates', constants.HEALTHMONITOR_ID),
+}
+
+
+class KeyedExecutor(object):
+    """Runs the jobs of a key one after the other in submission order.
+
+    Jobs of different keys run in parallel, with at most device_limit keys
+    of one device running at a time (0 for no limit). Keys of a device that
+    is at its limit wait their turn, round robin. Background keys run on
+    threads of their own, they never hold up the others.
+    """
+
+    def __init__(self, max_workers=default_workers, device_limit=0,
+                 background_workers=default_background_workers):
+        self.device_limit = device_limit
+        self._executors = {
+            False: futures.ThreadPoolExecutor(max_workers=max(1, max_workers),
+                                              thread_name_prefix='fadc-dispatch'),
+            True: futures.ThreadPoolExecutor(max_workers=max(1, background_workers),
+                                             thread_name_prefix='fadc-background'),
+        }
+        self._cond = threading.Condition()
+        self._jobs = {}
+        # keys running or waiting for their device, never both
+        self._scheduled = set()
+        self._background = set()
+        self._running = collections.Counter()
+        self._waiting = {}
+        self._pending = collections.Counter()
+
+    def pending(self, background=False):
+        """Jobs of the lane submitted and not started yet."""
+        return self._pending[background]
+
+    def wait_backlog(self, threshold, timeout):
+        """Block until at most threshold foreground jobs are pending, or
+        timeout seconds passed. Returns the seconds waited."""
+        start = time.time()
+        with self._cond:
+            while self._pending[False] > threshold:
+                remaining = start + timeout - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+        return time.time() - start
+
+    def submit(self, key, device, fn, background=False):
+        with self._cond:
+            self._jobs.setdefault(key, collections.deque()).append((time.time(), fn))
+            self._pending[background] += 1
+            metrics.DISPATCH_QUEUED.inc(lane=_lane(background))
+            if key not in self._scheduled:
+                self._scheduled.add(key)
+                if background:
+                    self._background.add(key)
+                self._waiting.setdefault(device, collections.deque()).append(key)
+                self._start(device)
+
+    def _start(self, device):
+        waiting = self._waiting.get(device)
+        while waiting and (device is None or not self.device_limit or
+                           self._running[device] < self.device_limit):
+            key = waiting.popleft()
+            self._running[device] += 1
+            self._executors[key in self._background].submit(self._run, key, device)
+        if not waiting:
+            self._waiting.pop(device, None)
+
+    def _run(self, key, device):
+        background = key in self._background
+        with self._cond:
+            submitted, fn = self._jobs[key].popleft()
+            self._pending[background] -= 1
+            self._cond.notify_all()
+        metrics.DISPATCH_QUEUED.dec(lane=_lane(background))
+        metrics.DISPATCH_WAIT_SECONDS.observe(time.time() - submitted, lane=_lane(background))
+        try:
+            fn()
+        except Exception:
+            LOG.exception('dispatched operation of %s failed', key)
+        finally:
+            with self._cond:
+                self._running[device] -= 1
+                if self._jobs[key]:
+                    # the other keys of the device get their turn first
+                    self._waiting.setdefault(device, collections.deque()).append(key)
+                else:
+                    del self._jobs[key]
+                    self._scheduled.discard(key)
+                    self._background.discard(key)
+                self._start(device)
+                if not self._jobs:
+                    self._cond.notify_all()
+
+    def shutdown(self, wait=True):
+        """Run the jobs already submitted, then stop the threads."""
+        if wait:
+            with self._cond:
+                while self._jobs:
+                    self._cond.wait()
+        for executor in self._executors.values():
+            executor.shutdown(wait=wait)
+
+
+def _lane(background):
+    return 'background' if background else 'provisioning'
+
+
+def update_target(method, kwargs):
+    """(method, object id) of an update that can be coalesced, else None."""
+    if method not in coalesced:
+        return None
+    updates_key, id_key = coalesced[method]
+    if not isinstance(kwargs.get(updates_key), dict):
+        return None
+    for name, value in kwargs.items():
+        if name == constants.LOAD_BALANCER_ID and value:
+            return method, value
+        if name != updates_key and isinstance(value, dict) and value.get(id_key):
+            return method, value[id_key]
+    return None
+
+
+class _Update(object):
+    """An update cast that later updates of its object can be merged into."""
+
+    def __init__(self, target, kwargs):
+        self.target = target
+        self.kwargs = kwargs
+        self.arrived = time.time()
+        self.started = False
+
+    def merge(self, kwargs):
+        updates_key = coalesced[self.target[0]][0]
+        merged = dict(self.kwargs[updates_key])
+        merged.update(kwargs[updates_key])
+        # the queued job calls the endpoint with this very dict
+        self.kwargs[updates_key] = merged
+
+
+class Dispatcher(object):
+    """Routes the casts of the endpoints to the queue of their load balancer.
+
+    resolver(pool_id=None, listener_id=None) returns the (load balancer id,
+    project id) of a pool or listener, (None, None) when unknown.
+    """
+
+    def __init__(self, resolver, conf=None):
+        self.resolver = resolver
+        self.d_projects = getattr(conf, 'd_projects', None) or {}
+        self.executor = KeyedExecutor(
+            getattr(conf, 'fadc_dispatch_workers', default_workers),
+            getattr(conf, 'fadc_dispatch_device_concurrency', default_device_concurrency),
+            getattr(conf, 'fadc_background_workers', default_background_workers))
+        self.yield_backlog = getattr(conf, 'fadc_background_yield_backlog', default_yield_backlog)
+        self.window = getattr(conf, 'fadc_coalesce_window', default_coalesce_window)
+        self._lock = threading.Lock()
+        self._parents = {}
+        # queue key -> its last cast, when it is an update not started yet
+        self._tails = {}
+        # casts in the lookup queue
+        self._resolving = 0
+
+    def _remember(self, object_id, parent):
+        with self._lock:
+            if len(self._parents) >= max_remembered:
+                self._parents.clear()
+            self._parents[object_id] = parent
+
+    def _parent(self, kind, object_id):
+        parent = self._parents.get(object_id)
+        if parent is None:
+            try:
+                parent = self.resolver(**{kind: object_id})
+            except Exception as e:
+                LOG.warning('cannot find the load balancer of %s %s: %s', kind, object_id, e)
+                return None, None
+            if parent[0]:
+                self._remember(object_id, parent)
+        return parent
+
+    def _owner(self, obj, resolve=True):
+        """(load balancer id, project id, unresolved id) of obj. Without
+        resolve, a pool or listener whose load balancer is not remembered
+        is returned as unresolved instead of looked up."""
+        lb_id = obj.get(constants.LOADBALANCER_ID)
+        project_id = obj.get(constants.PROJECT_ID)
+        if lb_id:
+            for key in (constants.POOL_ID, constants.LISTENER_ID):
+                if obj.get(key):
+                    self._remember(obj[key], (lb_id, project_id))
+            return lb_id, project_id, None
+        for kind, key in (('pool_id', constants.POOL_ID), ('listener_id', constants.LISTENER_ID)):
+            if obj.get(key):
+                if not resolve and obj[key] not in self._parents:
+                    return None, project_id, obj[key]
+                parent_lb, parent_project = self._parent(kind, obj[key])
+                return parent_lb, project_id or parent_project, None
+        return None, project_id, None
+
+    def _objects(self, kwargs):
+        for value in kwargs.values():
+            for obj in value if isinstance(value, list) else [value]:
+                if isinstance(obj, dict):
+                    yield obj
+
+    def route(self, method, kwargs, resolve=True):
+        """(queue key, device FQDN, unresolved id) of a cast, see _owner."""
+        lb_id = kwargs.get(constants.LOAD_BALANCER_ID)
+        project_id = None
+        unresolved = None
+        for obj in self._objects(kwargs):
+            owner, project, pending = self._owner(obj, resolve)
+            lb_id = lb_id or owner
+            project_id = project_id or project
+            unresolved = unresolved or pending
+            if lb_id and project_id:
+                break
+        device = self.d_projects.get(project_id, {}).get('fadc_FQDN') if project_id else None
+        if lb_id:
+            unresolved = None
+        return lb_id or method, device, unresolved
+
+    def submit(self, method, kwargs, fn):
+        """Queue fn, False when the cast was merged into a queued update.
+
+        The intake thread never waits on the database: a cast whose load
+        balancer has to be looked up is queued in the lookup queue, and the
+        worker of that queue routes it once the lookup is done. Later casts
+        queue behind it until then, the ones that name their load balancer
+        too, so they keep their order.
+        """
+        key, device, unresolved = self.route(method, kwargs, resolve=False)
+        with self._lock:
+            # the lookup may end at any load balancer
+            wait = unresolved is not None or (
+                self._resolving and method not in background_methods)
+            if wait:
+                self._resolving += 1
+        if not wait:
+            return self._queue(key, device, method, kwargs, fn)
+        LOG.debug('dispatch %s to the lookup queue', method)
+        # the lookup queue holds no device slot, it only routes
+        self.executor.submit(resolve_key, None,
+                             functools.partial(self._resolved, method, kwargs, fn))
+        return True
+
+    def _resolved(self, method, kwargs, fn):
+        try:
+            key, device, _ = self.route(method, kwargs)
+            # too late to tell the endpoint it was merged, queue it as is
+            self._queue(key, device, method, kwargs, fn, coalesce=False)
+        finally:
+            with self._lock:
+                self._resolving -= 1
+
+    def _queue(self, key, device, method, kwargs, fn, coalesce=True):
+        target = update_target(method, kwargs) if coalesce else None
+        with self._lock:
+            tail = self._tails.get(key)
+            if target and tail and tail.target == target and not tail.started:
+                tail.merge(kwargs)
+                LOG.debug('coalesced %s of %s into the queued one', method, target[1])
+                metrics.COALESCED_CASTS.inc(method=method)
+                return False
+            if target:
+                update = _Update(target, kwargs)
+                self._tails[key] = update
+                fn = functools.partial(self._debounced, key, update, fn)
+            else:
+                self._tails.pop(key, None)
+            LOG.debug('dispatch %s to queue %s of device %s', method, key, device)
+            self.executor.submit(key, device, fn, background=method in background_methods)
+        return True
+
+    def yield_to_provisioning(self):
+        """Called by background work between two steps, pauses it while
+        too many provisioning casts are waiting."""
+        if not self.yield_backlog:
+            return
+        waited = self.executor.wait_backlog(self.yield_backlog, max_yield)
+        if waited > 0.001:
+            LOG.debug('background work paused %.1fs for provisioning', waited)
+            metrics.BACKGROUND_YIELD_SECONDS.observe(waited)
+
+    def _debounced(self, key, update, fn):
+        if self.window > 0:
+            with self._lock:
+                # nothing can be merged once another cast is queued behind it
+                wait = update.arrived + self.window - time.time() if self._tails.get(key) is update else 0
+            if wait > 0:
+                time.sleep(wait)
+        with self._lock:
+            update.started = True
+            if self._tails.get(key) is update:
+                del self._tails[key]
+        return fn()
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
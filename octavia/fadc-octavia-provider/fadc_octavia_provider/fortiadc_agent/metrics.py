@@ -0,0 +1,401 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+In-process counters, gauges and histograms of the agent hot paths.
+
+The agent runs several worker processes, each with its own registry. When
+metrics are served every process writes its samples as JSON to the snapshot
+directory once in a while; the metrics service merges the snapshots of all
+live processes and serves them in the Prometheus text format. The snapshot
+directory is private to the agent user: it is created with mode 0700, and
+one owned by another user or open to others is not used.
+"""
+
+import bisect
+import json
+import math
+import os
+import stat
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+default_snapshot_dir = '/var/lib/octavia/fadc_metrics'
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _label_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+class Counter(object):
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Gauge(object):
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_label_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self):
+        with self._lock:
+            return dict(self._values)
+
+
+class Histogram(object):
+
+    def __init__(self, name, documentation, buckets=default_buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            i = bisect.bisect_left(self.buckets, value)
+            if i < len(counts):
+                counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def samples(self):
+        with self._lock:
+            return dict((k, (list(v[0]), v[1], v[2])) for k, v in self._values.items())
+
+
+class Registry(object):
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def _get(self, cls, name, documentation, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(name, documentation, **kwargs)
+                self._metrics[name] = metric
+            return metric
+
+    def counter(self, name, documentation=''):
+        return self._get(Counter, name, documentation)
+
+    def gauge(self, name, documentation=''):
+        return self._get(Gauge, name, documentation)
+
+    def histogram(self, name, documentation='', buckets=default_buckets):
+        return self._get(Histogram, name, documentation, buckets=buckets)
+
+    def metrics(self):
+        with self._lock:
+            return list(self._metrics.values())
+
+    def snapshot(self):
+        """JSON serializable samples of every metric."""
+        result = {}
+        for metric in self.metrics():
+            entry = {'type': type(metric).__name__.lower(),
+                     'help': metric.documentation,
+                     'samples': [[dict(k), v] for k, v in metric.samples().items()]}
+            if isinstance(metric, Histogram):
+                entry['buckets'] = list(metric.buckets)
+            result[metric.name] = entry
+        return result
+
+
+def merge(snapshots):
+    """Add up the snapshots of several processes, label sets stay apart."""
+    result = {}
+    for snapshot in snapshots:
+        for name, entry in snapshot.items():
+            merged = result.setdefault(name, dict(entry, samples={}))
+            for labels, value in entry['samples']:
+                key = _label_key(labels)
+                old = merged['samples'].get(key)
+                if old is None:
+                    merged['samples'][key] = value
+                elif entry['type'] == 'histogram':
+                    merged['samples'][key] = ([a + b for a, b in zip(old[0], value[0])],
+                                              old[1] + value[1], old[2] + value[2])
+                else:
+                    merged['samples'][key] = old + value
+    for entry in result.values():
+        entry['samples'] = [[dict(k), v] for k, v in entry['samples'].items()]
+    return result
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(labels, extra=None):
+    items = sorted(labels.items()) + (extra or [])
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, _escape(v)) for k, v in items)
+
+
+def _number(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render(snapshot):
+    """Prometheus text exposition format of a snapshot."""
+    lines = []
+    for name in sorted(snapshot):
+        entry = snapshot[name]
+        lines.append('# HELP %s %s' % (name, _escape(entry['help'])))
+        lines.append('# TYPE %s %s' % (name, entry['type']))
+        for labels, value in entry['samples']:
+            if entry['type'] != 'histogram':
+                lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+                continue
+            counts, total, count = value
+            cumulative = 0
+            for bound, n in zip(entry['buckets'], counts):
+                cumulative += n
+                lines.append('%s_bucket%s %d' % (name, _labels(labels, [('le', _number(float(bound)))]), cumulative))
+            lines.append('%s_bucket%s %d' % (name, _labels(labels, [('le', '+Inf')]), count))
+            lines.append('%s_sum%s %s' % (name, _labels(labels), _number(float(total))))
+            lines.append('%s_count%s %d' % (name, _labels(labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def write_snapshot(directory, registry=None):
+    """Write the samples of this process to directory, atomically."""
+    registry = registry or REGISTRY
+    path = os.path.join(directory, 'metrics-%d.json' % os.getpid())
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(registry.snapshot(), f)
+    os.replace(tmp, path)
+
+
+def read_snapshots(directory):
+    """Snapshots of the live processes in directory, stale files removed."""
+    snapshots = []
+    for name in os.listdir(directory):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            pid = int(name[len('metrics-'):-len('.json')])
+        except ValueError:
+            continue
+        if not _alive(pid):
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            continue
+        try:
+            with open(path) as f:
+                snapshots.append(json.load(f))
+        except (OSError, ValueError):
+            # being replaced right now, the next scrape gets it
+            continue
+    return snapshots
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def snapshot_dir(conf=None):
+    return getattr(conf, 'fadc_metrics_dir', None) or default_snapshot_dir
+
+
+def private_dir(directory):
+    """Create directory with mode 0700, or check an existing one is a
+    directory of this user that no one else can write to."""
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+        raise Exception('metrics directory %s is not a directory of this user' % directory)
+    if st.st_mode & 0o077:
+        os.chmod(directory, 0o700)
+    return directory
+
+
+def start_snapshots(conf=None):
+    """Start writing snapshots of this process when metrics are served."""
+    global _writer
+    if not getattr(conf, 'fadc_metrics_port', 0):
+        return
+    directory = snapshot_dir(conf)
+    interval = getattr(conf, 'fadc_metrics_snapshot_interval', 15)
+    with _writer_lock:
+        if _writer is not None and _writer[0] == os.getpid():
+            return
+        try:
+            private_dir(directory)
+        except Exception as e:
+            LOG.error('metrics snapshots not written: %s', e)
+            return
+
+        def loop():
+            while True:
+                try:
+                    write_snapshot(directory)
+                except OSError as e:
+                    LOG.warning('cannot write metrics snapshot to %s: %s', directory, e)
+                time.sleep(interval)
+
+        thread = threading.Thread(target=loop, name='fadc-metrics-snapshot', daemon=True)
+        thread.start()
+        _writer = (os.getpid(), thread)
+
+
+REGISTRY = Registry()
+
+RS_READY_WAIT = REGISTRY.histogram(
+    'fadc_real_server_ready_wait_seconds',
+    'Time spent waiting for a new real server before its pool member could be written')
+
+STATS_COLLECT_SECONDS = REGISTRY.histogram(
+    'fadc_stats_collect_seconds',
+    'Time to collect the listener statistics of one vdom')
+
+STATS_LISTENERS = REGISTRY.counter(
+    'fadc_stats_listeners_total',
+    'Listener statistics collected from the device')
+
+STATS_SWEEP_SECONDS = REGISTRY.histogram(
+    'fadc_stats_sweep_seconds',
+    'Time of a full sync_stats sweep over all load balancers')
+
+SYNC_SWEEP_SECONDS = REGISTRY.histogram(
+    'fadc_sync_sweep_seconds',
+    'Time of a sync_state pass by kind, full or incremental')
+
+STATS_COUNTER_RESETS = REGISTRY.counter(
+    'fadc_stats_counter_resets_total',
+    'Listener status_history windows that did not continue the previous one')
+
+REST_REQUEST_SECONDS = REGISTRY.histogram(
+    'fadc_rest_request_seconds',
+    'FortiADC REST request latency by device, resource and method')
+
+LOGINS = REGISTRY.counter(
+    'fadc_logins_total',
+    'Logins to a FortiADC device by result')
+
+TOKEN_REFRESHES = REGISTRY.counter(
+    'fadc_token_refreshes_total',
+    'Token refreshes on a FortiADC device by result')
+
+CACHE_REQUESTS = REGISTRY.counter(
+    'fadc_cache_requests_total',
+    'Cacheable GET requests by device and result, hit or miss')
+
+TASK_SECONDS = REGISTRY.histogram(
+    'fadc_task_duration_seconds',
+    'Duration of fortiadc_driver_tasks executions by task and result')
+
+FLOW_SECONDS = REGISTRY.histogram(
+    'fadc_flow_duration_seconds',
+    'Duration of taskflow flows by flow and result')
+
+RPC_IN_PROGRESS = REGISTRY.gauge(
+    'fadc_rpc_in_progress',
+    'RPC requests accepted by the consumer and not finished yet, by method')
+
+DISPATCH_QUEUED = REGISTRY.gauge(
+    'fadc_dispatch_queued',
+    'Casts waiting in the queues of the consumer, by lane')
+
+DISPATCH_WAIT_SECONDS = REGISTRY.histogram(
+    'fadc_dispatch_wait_seconds',
+    'Time a cast waited in its queue before it started, by lane')
+
+COALESCED_CASTS = REGISTRY.counter(
+    'fadc_coalesced_casts_total',
+    'Update casts merged into a queued update of the same object, by method')
+
+BACKGROUND_YIELD_SECONDS = REGISTRY.histogram(
+    'fadc_background_yield_seconds',
+    'Pauses of sync_state and sync_stats while provisioning casts were waiting')
+
+DEVICE_WAIT_SECONDS = REGISTRY.histogram(
+    'fadc_device_admission_wait_seconds',
+    'Time a request or login waited for the limiter of its FortiADC device')
+
+DEVICE_IN_FLIGHT = REGISTRY.gauge(
+    'fadc_device_requests_in_flight',
+    'Requests and logins admitted by the limiter of a FortiADC device and not finished')
+
+BREAKER_OPEN = REGISTRY.gauge(
+    'fadc_device_circuit_open',
+    'Whether the circuit breaker of a FortiADC device is open or probing (1) or closed (0)')
+
+BREAKER_TRIPS = REGISTRY.counter(
+    'fadc_device_circuit_trips_total',
+    'Times the circuit breaker of a FortiADC device opened')
+
+BREAKER_REJECTED = REGISTRY.counter(
+    'fadc_device_circuit_rejected_total',
+    'Requests and logins failed fast by the open circuit breaker of a FortiADC device')
+
+RECONCILE_ORPHANS = REGISTRY.counter(
+    'fadc_reconcile_orphans_total',
+    'Device objects sync_state found unknown to Octavia, by kind and result '
+    '(reported, kept after the recheck, deleted)')
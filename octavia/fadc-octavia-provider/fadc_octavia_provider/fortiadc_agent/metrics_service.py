@@ -0,0 +1,101 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Prometheus endpoint of the agent metrics, and of the listener and member
+statistics rates the statistics history files give.
+"""
+
+import cotyledon
+from http import server
+from oslo_config import cfg
+from oslo_log import log as logging
+
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import timeseries
+
+LOG = logging.getLogger(__name__)
+
+CONF = cfg.CONF
+
+content_type = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class MetricsHandler(server.BaseHTTPRequestHandler):
+
+    directory = None
+    # statistics history store and the seconds of it to cover
+    history = None
+    window = timeseries.default_window
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        try:
+            snapshot = metrics.merge(metrics.read_snapshots(self.directory))
+            if self.history is not None:
+                snapshot.update(self.history.snapshot(self.window))
+            body = metrics.render(snapshot).encode('utf-8')
+        except Exception as e:
+            LOG.error('cannot render metrics: %s', e)
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        LOG.debug('metrics %s - %s', self.address_string(), format % args)
+
+
+class MetricsService(cotyledon.Service):
+
+    def __init__(self, worker_id, conf):
+        super().__init__(worker_id)
+        self.conf = conf
+        self.httpd = None
+        LOG.debug('MetricsService init')
+
+    def run(self):
+        try:
+            directory = metrics.private_dir(metrics.snapshot_dir(self.conf))
+        except Exception as e:
+            LOG.error('metrics not served: %s', e)
+            return
+        history = None
+        if self.conf.fadc_stats_history_dir:
+            try:
+                history = timeseries.TimeSeriesStore(self.conf.fadc_stats_history_dir,
+                                                     self.conf.fadc_stats_history_size)
+            except OSError as e:
+                LOG.error('statistics history not served: %s', e)
+        handler = type('Handler', (MetricsHandler,), {
+            'directory': directory, 'history': history,
+            'window': self.conf.fadc_stats_history_window})
+        self.httpd = server.ThreadingHTTPServer(
+            (self.conf.fadc_metrics_host, self.conf.fadc_metrics_port), handler)
+        LOG.info('Serving metrics on %s:%s', self.conf.fadc_metrics_host,
+                 self.conf.fadc_metrics_port)
+        self.httpd.serve_forever()
+
+    def terminate(self):
+        LOG.debug('Stopping MetricsService...')
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        super().terminate()
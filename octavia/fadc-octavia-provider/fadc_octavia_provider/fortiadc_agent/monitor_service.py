@@ -28,6 +28,7 @@ from oslo_utils import uuidutils
 from octavia.common import constants
 from octavia.common import rpc
 from fadc_octavia_provider.fortiadc_agent import endpoints
+from fadc_octavia_provider.fortiadc_agent import tracing
 
 LOG = logging.getLogger(__name__)
 
@@ -48,16 +49,24 @@ class MonitorService(cotyledon.Service):
         self.client = rpc.get_client(self.target)
 
     def run(self):
+        interval = self.conf.fadc_sync_interval
+        full_interval = self.conf.fadc_sync_full_interval
+        last_full = None
         while self.running:
-            self.periodic_task()
-            time.sleep(1800)
+            now = time.time()
+            # incremental passes in between full ones, the first is full
+            full = last_full is None or now - last_full >= full_interval
+            self.periodic_task(full)
+            if full:
+                last_full = now
+            time.sleep(interval)
 
     def terminate(self):
         LOG.debug('Stopping monitorservice...')
         self.running = False 
         super().terminate()
 
-    def periodic_task(self):
-        LOG.debug("Monitor service sync state")
-        payload = {'name': 'sync_state'}
-        self.client.cast({}, 'sync_state', **payload)
+    def periodic_task(self, full=True):
+        LOG.debug("Monitor service sync state, full %s", full)
+        payload = {'name': 'sync_state', 'full': full}
+        self.client.cast(tracing.rpc_context(), 'sync_state', **payload)
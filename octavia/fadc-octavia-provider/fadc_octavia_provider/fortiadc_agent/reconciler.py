@@ -0,0 +1,409 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Desired state reconciliation of one vdom.
+
+The device side is read with one listing per resource type, plus one per
+pool for its members. The expected side is built from the Octavia objects
+with the same check_parameter() and mapping() the flows write with. Only
+the differences between the two are applied.
+
+Device objects with an Octavia id that Octavia does not know (orphans) are
+only reported. With delete_orphans they are deleted, each one after
+confirm_orphan(id) checked again that Octavia still does not know it: the
+Octavia objects compared were read before the device, an object created in
+between looks like an orphan.
+
+Reconciliation runs beside the provisioning flows. The changes are applied
+load balancer by load balancer, each group only after still_current(lb)
+checked right before it that no flow has changed that load balancer since
+it was read.
+"""
+
+import collections
+
+from oslo_log import log as logging
+from oslo_utils import uuidutils
+
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent.fadc_api.base import RequestAction
+from fadc_octavia_provider.fortiadc_agent.fadc_api.healthcheck import HealthCheck
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.real_server import RS
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.real_server import RSpool_member
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.real_server_pool import RSpool
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.virtual_server import VirtualServer
+from fadc_octavia_provider.fortiadc_agent.fadc_api.vdom import Vdom
+
+LOG = logging.getLogger(__name__)
+
+vdom_route = "?vdom="
+pkey_route = "&pkey="
+
+LOADBALANCER = 'loadbalancer'
+LISTENER = 'listener'
+POOL = 'pool'
+MEMBER = 'member'
+POOL_MEMBER = 'pool_member'
+REAL_SERVER = 'real_server'
+HEALTHMONITOR = 'healthmonitor'
+
+# parents are created before their children and deleted after them
+apply_order = [
+    (RequestAction.CREATE, LOADBALANCER),
+    (RequestAction.CREATE, POOL),
+    (RequestAction.CREATE, MEMBER),
+    (RequestAction.CREATE, POOL_MEMBER),
+    (RequestAction.CREATE, HEALTHMONITOR),
+    (RequestAction.CREATE, LISTENER),
+    (RequestAction.UPDATE, POOL),
+    (RequestAction.UPDATE, MEMBER),
+    (RequestAction.UPDATE, POOL_MEMBER),
+    (RequestAction.UPDATE, HEALTHMONITOR),
+    (RequestAction.UPDATE, LISTENER),
+    (RequestAction.DELETE, LISTENER),
+    (RequestAction.DELETE, POOL_MEMBER),
+    (RequestAction.DELETE, REAL_SERVER),
+    (RequestAction.DELETE, POOL),
+    (RequestAction.DELETE, HEALTHMONITOR),
+]
+
+# fields lists the mapping() keys that differ, empty for create and delete,
+# loadbalancer is the one obj belongs to, None for an orphan
+Change = collections.namedtuple('Change', ['action', 'kind', 'obj', 'fields', 'loadbalancer'],
+                                defaults=(None,))
+# stand-in for a device object Octavia does not know about
+Orphan = collections.namedtuple('Orphan', ['id', 'project_id', 'pool_id', 'protocol_port', 'weight'])
+
+
+def object_ids(lb):
+    """Ids of lb and every object under it, they are the device mkeys."""
+    ids = {lb.id}
+    for listener in lb.listeners or []:
+        ids.add(listener.id)
+    for pool in lb.pools or []:
+        ids.add(pool.id)
+        if pool.health_monitor:
+            ids.add(pool.health_monitor.id)
+        for member in pool.members:
+            ids.add(member.id)
+    return ids
+
+
+def _norm(value):
+    if value is None:
+        return ''
+    if isinstance(value, (list, tuple)):
+        return ' '.join(str(v) for v in value)
+    return str(value).strip()
+
+
+def differing_fields(expected, actual):
+    return sorted(k for k, v in expected.items() if _norm(v) != _norm(actual.get(k)))
+
+
+def _by_key(elements, key='mkey'):
+    return dict((ele[key], ele) for ele in elements)
+
+
+class DeviceConfig(object):
+    """Configuration of one vdom as read from the device, by mkey."""
+
+    def __init__(self, vdom_name):
+        self.vdom = vdom_name
+        self.exists = False
+        self.virtual_servers = {}
+        self.pools = {}
+        self.real_servers = {}
+        self.health_checks = {}
+        # pool mkey -> {real_server_id: pool child element}
+        self.pool_members = {}
+
+
+class Reconciler(object):
+
+    def __init__(self, fadc_driver, delete_orphans=False, confirm_orphan=None,
+                 still_current=None):
+        self.fadc = fadc_driver
+        self.delete_orphans = delete_orphans
+        self.confirm_orphan = confirm_orphan
+        self.still_current = still_current
+        host = fadc_driver.host
+        connector = fadc_driver.connector
+        verbose = fadc_driver.conf.debug_mode
+        self.vdom = Vdom(host, connector, verbose)
+        self.vs = VirtualServer(host, connector, verbose)
+        self.rspool = RSpool(host, connector, verbose)
+        self.rs = RS(host, connector, verbose)
+        self.child = RSpool_member(host, connector, verbose)
+        self.hc = HealthCheck(host, connector, verbose)
+        self.listener = fadc_driver.listener
+        self.pool = fadc_driver.pool
+        self.member = fadc_driver.member
+        self.health_monitor = fadc_driver.healthmonitor
+
+    def _list(self, api, url):
+        response = api.get(url, cache=False)
+        if not api.response_handler(response, {}):
+            raise Exception('Cannot list %s' %(url))
+        payload = response.json()['payload']
+        return payload if isinstance(payload, list) else []
+
+    def read(self, vdom_name):
+        device = DeviceConfig(vdom_name)
+        device.exists = self.vdom.is_exist(vdom_name)
+        if not device.exists:
+            return device
+        route = vdom_route + vdom_name
+        device.virtual_servers = _by_key(self._list(self.vs, self.vs.prefix + route))
+        device.pools = _by_key(self._list(self.rspool, self.rspool.prefix + route))
+        device.real_servers = _by_key(self._list(self.rs, self.rs.prefix + route))
+        device.health_checks = _by_key(self._list(self.hc, self.hc.prefix + route))
+        for pool_id in device.pools:
+            if not uuidutils.is_uuid_like(pool_id):
+                continue
+            children = self._list(self.child, self.child.prefix + route + pkey_route + pool_id)
+            self.fadc.connector.member_index.load(vdom_name, pool_id, children)
+            device.pool_members[pool_id] = _by_key(children, 'real_server_id')
+        return device
+
+    def diff(self, vdom_name, loadbalancers, known_ids=(), device=None):
+        """Changes that bring the vdom to the state of loadbalancers.
+
+        Device objects whose mkey is in known_ids belong to load balancers
+        that are not ACTIVE and are left alone, as is everything the agent
+        did not create (any mkey that is not an Octavia id).
+        """
+        if device is None:
+            device = self.read(vdom_name)
+        changes = []
+        expected = set()
+        expected_children = set()
+        if not device.exists:
+            for lb in loadbalancers:
+                changes.append(Change(RequestAction.CREATE, LOADBALANCER, lb, [], lb))
+        for lb in loadbalancers:
+            expected.add(lb.id)
+            lb_changes = []
+            for pool in lb.pools or []:
+                self._diff_pool(pool, device, lb_changes, expected, expected_children)
+            for listener in lb.listeners or []:
+                expected.add(listener.id)
+                self._diff_listener(listener, device, lb_changes)
+            changes.extend(change._replace(loadbalancer=lb) for change in lb_changes)
+        self._diff_orphans(device, expected | set(known_ids), expected_children, changes)
+        return self.order(changes)
+
+    def _diff_pool(self, pool, device, changes, expected, expected_children):
+        expected.add(pool.id)
+        if pool.id not in device.pools:
+            changes.append(Change(RequestAction.CREATE, POOL, pool, []))
+        children = device.pool_members.get(pool.id, {})
+        for member in pool.members:
+            expected.add(member.id)
+            expected_children.add((pool.id, member.id))
+            rs = device.real_servers.get(member.id)
+            if rs is None:
+                # creating the real server also adds it to the pool
+                changes.append(Change(RequestAction.CREATE, MEMBER, member, []))
+                continue
+            fields = differing_fields(self.rs.mapping(member), rs)
+            if fields:
+                # updating the real server also updates its pool member
+                changes.append(Change(RequestAction.UPDATE, MEMBER, member, fields))
+            child = children.get(member.id)
+            if child is None:
+                changes.append(Change(RequestAction.CREATE, POOL_MEMBER, member, []))
+            elif not fields:
+                fields = differing_fields(self.child.mapping(member), child)
+                if fields:
+                    changes.append(Change(RequestAction.UPDATE, POOL_MEMBER, member, fields))
+
+        hm = pool.health_monitor
+        if hm:
+            expected.add(hm.id)
+            try:
+                self.health_monitor.check_parameter(hm)
+            except Exception as e:
+                LOG.warning('reconcile: skip health monitor %s, %s', hm.id, e)
+                hm = None
+        if hm:
+            check = device.health_checks.get(hm.id)
+            if check is None:
+                # creating the health check also attaches it to the pool
+                changes.append(Change(RequestAction.CREATE, HEALTHMONITOR, hm, []))
+                return
+            fields = differing_fields(self.hc.mapping(hm), check)
+            if fields:
+                changes.append(Change(RequestAction.UPDATE, HEALTHMONITOR, hm, fields))
+
+        if pool.id in device.pools:
+            attached = set(device.pools[pool.id].get('health_check_list', '').split())
+            wanted = {hm.id} if hm else set()
+            if attached != wanted:
+                pool.health_check = "enable" if wanted else "disable"
+                pool.health_check_list = ' '.join(wanted)
+                changes.append(Change(RequestAction.UPDATE, POOL, pool, ['health_check_list']))
+
+    def _diff_listener(self, listener, device, changes):
+        if not listener.default_pool:
+            # Listener.create does not deploy it either
+            return
+        self.listener.check_parameter(listener)
+        if listener.fadc_pktfwd != '' and listener.fadc_nat_pool and listener.protocol == 'TCP':
+            listener.fadc_nat_pool_name = "openstack_lbaas"
+        vs = device.virtual_servers.get(listener.id)
+        if vs is None:
+            changes.append(Change(RequestAction.CREATE, LISTENER, listener, []))
+            return
+        fields = differing_fields(self.vs.mapping(listener), vs)
+        if fields:
+            changes.append(Change(RequestAction.UPDATE, LISTENER, listener, fields))
+
+    def _diff_orphans(self, device, known, expected_children, changes):
+        def orphan(mkey):
+            return uuidutils.is_uuid_like(mkey) and mkey not in known
+
+        vdom_name = device.vdom
+        for mkey in device.virtual_servers:
+            if orphan(mkey):
+                changes.append(Change(RequestAction.DELETE, LISTENER,
+                                      Orphan(mkey, vdom_name, None, None, None), []))
+        for pool_id, children in device.pool_members.items():
+            for rs_id, child in children.items():
+                if (pool_id, rs_id) in expected_children or not uuidutils.is_uuid_like(rs_id):
+                    continue
+                if rs_id in known and pool_id in known:
+                    continue
+                changes.append(Change(RequestAction.DELETE, POOL_MEMBER,
+                                      Orphan(rs_id, vdom_name, pool_id, child.get('port'),
+                                             child.get('weight')), []))
+        for mkey in device.real_servers:
+            if orphan(mkey):
+                changes.append(Change(RequestAction.DELETE, REAL_SERVER,
+                                      Orphan(mkey, vdom_name, None, None, None), []))
+        for mkey in device.pools:
+            if orphan(mkey):
+                changes.append(Change(RequestAction.DELETE, POOL,
+                                      Orphan(mkey, vdom_name, None, None, None), []))
+        for mkey in device.health_checks:
+            if orphan(mkey):
+                changes.append(Change(RequestAction.DELETE, HEALTHMONITOR,
+                                      Orphan(mkey, vdom_name, None, None, None), []))
+
+    @staticmethod
+    def order(changes):
+        rank = dict((step, i) for i, step in enumerate(apply_order))
+        return sorted(changes, key=lambda c: rank[(c.action, c.kind)])
+
+    def handler(self, change):
+        return {
+            (RequestAction.CREATE, LOADBALANCER): lambda lb: self.fadc.loadbalancer.create(lb),
+            (RequestAction.CREATE, POOL): self.pool.create,
+            (RequestAction.UPDATE, POOL): self.pool.update,
+            (RequestAction.DELETE, POOL): self.pool.delete,
+            (RequestAction.CREATE, MEMBER): self.member.create,
+            (RequestAction.UPDATE, MEMBER): self.member.update,
+            (RequestAction.CREATE, POOL_MEMBER): self.child.create,
+            (RequestAction.UPDATE, POOL_MEMBER): self.child.update,
+            (RequestAction.DELETE, POOL_MEMBER): self.child.delete,
+            (RequestAction.DELETE, REAL_SERVER): self.rs.delete_direct,
+            (RequestAction.CREATE, HEALTHMONITOR): self.health_monitor.create,
+            (RequestAction.UPDATE, HEALTHMONITOR): self.health_monitor.update,
+            (RequestAction.DELETE, HEALTHMONITOR): self.health_monitor.delete_direct,
+            (RequestAction.CREATE, LISTENER): self.listener.create,
+            (RequestAction.UPDATE, LISTENER): self.listener.update,
+            (RequestAction.DELETE, LISTENER): self.listener.delete,
+        }[(change.action, change.kind)]
+
+    @staticmethod
+    def by_loadbalancer(changes):
+        """[(load balancer, its changes)] in the order of changes, the
+        orphans last under None."""
+        groups = collections.OrderedDict()
+        for change in changes:
+            lb_id = change.loadbalancer.id if change.loadbalancer is not None else None
+            groups.setdefault(lb_id, (change.loadbalancer, []))[1].append(change)
+        orphans = groups.pop(None, None)
+        return list(groups.values()) + ([orphans] if orphans else [])
+
+    def _current(self, lb):
+        """Checked right before the changes of lb are applied."""
+        if lb is None or self.still_current is None:
+            return True
+        try:
+            if self.still_current(lb):
+                return True
+        except Exception as e:
+            LOG.error('reconcile: cannot recheck lb %s. reason %s', lb.id, e)
+            return False
+        LOG.info('reconcile: lb %s changed since it was read, left to its flow', lb.id)
+        return False
+
+    def apply(self, changes):
+        """Apply changes in order, returns (the ones made, the ones that failed)."""
+        applied = []
+        failed = []
+        for lb, group in self.by_loadbalancer(changes):
+            if self._current(lb):
+                self._apply(group, applied, failed)
+        return applied, failed
+
+    def _apply(self, changes, applied, failed):
+        for change in changes:
+            if isinstance(change.obj, Orphan) and not self._confirmed(change):
+                continue
+            applied.append(change)
+            LOG.info('reconcile: %s %s %s %s', change.action, change.kind,
+                     change.obj.id, ','.join(change.fields))
+            try:
+                self.handler(change)(change.obj)
+            except Exception as e:
+                LOG.error('reconcile: %s %s %s failed. reason %s',
+                          change.action, change.kind, change.obj.id, e)
+                failed.append(change)
+
+    def _report(self, change):
+        LOG.warning('reconcile: %s %s in vdom %s is not known to Octavia, left on the device',
+                    change.kind, change.obj.id, change.obj.project_id)
+        metrics.RECONCILE_ORPHANS.inc(kind=change.kind, result='reported')
+
+    def _confirmed(self, change):
+        """Checked right before an orphan is deleted."""
+        try:
+            confirmed = self.confirm_orphan is None or self.confirm_orphan(change.obj.id)
+        except Exception as e:
+            LOG.error('reconcile: cannot check orphan %s %s. reason %s',
+                      change.kind, change.obj.id, e)
+            confirmed = False
+        if not confirmed:
+            LOG.info('reconcile: %s %s not confirmed as orphan, not deleted',
+                     change.kind, change.obj.id)
+            metrics.RECONCILE_ORPHANS.inc(kind=change.kind, result='kept')
+            return False
+        metrics.RECONCILE_ORPHANS.inc(kind=change.kind, result='deleted')
+        return True
+
+    def reconcile(self, vdom_name, loadbalancers, known_ids=()):
+        changes = []
+        for change in self.diff(vdom_name, loadbalancers, known_ids):
+            if isinstance(change.obj, Orphan) and not self.delete_orphans:
+                self._report(change)
+            else:
+                changes.append(change)
+        if not changes:
+            LOG.debug('reconcile: vdom %s in sync', vdom_name)
+            return changes, []
+        return self.apply(changes)
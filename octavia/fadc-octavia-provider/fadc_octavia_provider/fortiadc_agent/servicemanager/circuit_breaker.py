@@ -0,0 +1,179 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Circuit breaker of the connections to one FortiADC.
+
+After fadc_breaker_failure_threshold requests in a row found the device
+unreachable (connection refused or timed out), the breaker opens: requests
+and logins to the device raise DeviceUnavailable at once instead of each
+waiting out the connect and read timeouts. fadc_breaker_reset_timeout
+seconds later the next request is let through as the probe, the others
+keep failing fast until it ends. A probe that reaches the device closes the
+breaker, one that does not opens it again. An HTTP error is an answer, only
+failures to reach the device count, DeviceBusy from the device limiter does
+not. The breakers are per agent process.
+"""
+
+import contextlib
+import threading
+import time
+
+import requests
+from oslo_log import log as logging
+
+from fadc_octavia_provider.fortiadc_agent import metrics
+
+LOG = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+default_failure_threshold = 5
+default_reset_timeout = 30
+
+# exceptions of the REST client that mean the device was not reached
+connection_failures = (requests.ConnectionError, requests.Timeout)
+
+
+class DeviceUnavailable(requests.ConnectionError):
+    """A request refused by the open circuit breaker of its device."""
+
+    def __init__(self, host, retry_in):
+        super(DeviceUnavailable, self).__init__(
+            'Fortiadc %s unreachable, circuit open for %.0fs more' % (host, retry_in))
+        self.host = host
+        self.retry_in = retry_in
+
+
+class DeviceBusy(requests.ConnectionError):
+    """A request that waited too long for a slot of its device limiter."""
+
+    def __init__(self, host, kind, waited):
+        super(DeviceBusy, self).__init__(
+            'Fortiadc %s busy, no %s slot after %.0fs' % (host, kind, waited))
+        self.host = host
+        self.kind = kind
+        self.waited = waited
+
+
+class CircuitBreaker(object):
+    """failure_threshold 0 never opens."""
+
+    def __init__(self, host, failure_threshold=default_failure_threshold,
+                 reset_timeout=default_reset_timeout):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = CLOSED
+        self.failures = 0
+        self._opened = 0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def admit(self):
+        """Let a request through, True when it is the probe. Raises
+        DeviceUnavailable while the breaker is open."""
+        if self.state == CLOSED:
+            return False
+        with self._lock:
+            if self.state == CLOSED:
+                return False
+            retry_in = self._opened + self.reset_timeout - time.monotonic()
+            if retry_in <= 0 and not self._probing:
+                self._set_state(HALF_OPEN)
+                self._probing = True
+                LOG.info('probing Fortiadc %s', self.host)
+                return True
+        metrics.BREAKER_REJECTED.inc(host=self.host)
+        raise DeviceUnavailable(self.host, max(retry_in, 0))
+
+    def success(self, probe=False):
+        if self.state == CLOSED and not self.failures:
+            return
+        with self._lock:
+            self.failures = 0
+            if probe:
+                self._probing = False
+            if self.state != CLOSED:
+                LOG.info('Fortiadc %s reachable again, circuit closed', self.host)
+                self._set_state(CLOSED)
+
+    def failure(self, probe=False):
+        with self._lock:
+            self.failures += 1
+            if probe:
+                self._probing = False
+            if self.state == OPEN or not self.failure_threshold:
+                return
+            if probe or self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                LOG.warning('Fortiadc %s unreachable %d times in a row, circuit open for %ss',
+                            self.host, self.failures, self.reset_timeout)
+                self._opened = time.monotonic()
+                self._set_state(OPEN)
+                metrics.BREAKER_TRIPS.inc(host=self.host)
+
+    def abandon(self, probe=False):
+        """The request ended without telling whether the device is reachable."""
+        if probe:
+            with self._lock:
+                self._probing = False
+
+    def _set_state(self, state):
+        self.state = state
+        metrics.BREAKER_OPEN.set(0 if state == CLOSED else 1, host=self.host)
+
+    @contextlib.contextmanager
+    def attempt(self, failures=connection_failures):
+        """Guards one request to the device. Leaving the block normally
+        counts as a success, raising one of failures as a failure."""
+        probe = self.admit()
+        try:
+            yield
+        except DeviceBusy:
+            # refused by our own limiter, the device was not tried
+            self.abandon(probe)
+            raise
+        except failures:
+            self.failure(probe)
+            raise
+        except BaseException:
+            self.abandon(probe)
+            raise
+        else:
+            self.success(probe)
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(o_device):
+    """The breaker of a device, made with the settings of its first entry."""
+    host = o_device.fadc_FQDN
+    with _breakers_lock:
+        breaker = _breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                host,
+                getattr(o_device, 'fadc_breaker_failure_threshold', default_failure_threshold),
+                getattr(o_device, 'fadc_breaker_reset_timeout', default_reset_timeout))
+            _breakers[host] = breaker
+        return breaker
+
+
+def disabled(host):
+    return CircuitBreaker(host, failure_threshold=0)
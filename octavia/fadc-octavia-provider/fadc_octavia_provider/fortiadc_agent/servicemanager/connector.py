@@ -14,35 +14,146 @@
 #    under the License.
 
 from fadc_octavia_provider.fortiadc_agent import fadc_api
+from fadc_octavia_provider.fortiadc_agent.fadc_api import base as fadc_base
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent.fadc_api.cache import ResponseCache
+from fadc_octavia_provider.fortiadc_agent.fadc_api.member_index import MemberIndex
+from fadc_octavia_provider.fortiadc_agent.servicemanager import circuit_breaker
+from fadc_octavia_provider.fortiadc_agent.servicemanager import device_limiter
 import requests
+from requests.adapters import HTTPAdapter
+import contextlib
+import threading
+import time
 from oslo_log import log as logging
 LOG = logging.getLogger(__name__)
 
-
 class Connector(object):
-    def __init__(self, host, certificate_verify, ca_file):
+    def __init__(self, host, certificate_verify, ca_file, pool_maxsize=None, cache_ttl=0,
+                 limiter=None, breaker=None, adapter=None):
         self.host = host
+        # every request and login to the device goes through its breaker
+        # and its limiter
+        self.breaker = breaker or circuit_breaker.disabled(host)
+        self.limiter = limiter or device_limiter.unlimited(host)
         self.url_prefix = 'https://' + self.host
         self.session = requests.session()
+        if pool_maxsize:
+            # the session is shared by every task talking to this device,
+            # keep enough keep-alive connections around for all of them
+            self.session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize))
+        if adapter is not None:
+            # replaces the network to the device, see tests/simulator.py
+            self.session.mount(self.url_prefix + '/', adapter)
         if certificate_verify:
             self.session.verify = ca_file
         else:
             self.session.verify = False
         self.major = 5
         self.token = ''
+        self.token_issued = 0
+        self.broken = False
+        self.last_used = time.time()
+        # requests running on the session, it is not idle while any is
+        self.in_use = 0
+        self._use_lock = threading.Lock()
+        # set once the pool dropped the session, logs out its login when
+        # no request runs on it
+        self._retired = None
+        self._credentials = None
+        self._auth_lock = threading.Lock()
+        self.cache = ResponseCache(cache_ttl)
+        self.member_index = MemberIndex()
+        # facts about the device learnt during this login, forgotten on the
+        # next login since a re-login may follow a device reboot
+        self.vdom_admin_enabled = False
+
+    def touch(self):
+        self.last_used = time.time()
+
+    @contextlib.contextmanager
+    def using(self):
+        with self._use_lock:
+            self.in_use += 1
+        self.touch()
+        try:
+            yield
+        finally:
+            self.touch()
+            with self._use_lock:
+                self.in_use -= 1
+                logout = self._retired if not self.in_use and self.token else None
+            if logout:
+                logout(self)
+
+    def retire(self, logout):
+        """The pool dropped the session: call logout(self) now when no
+        request runs on it, else once the last one ends. A task still
+        holding the session may log in again, that login is logged out
+        the same way."""
+        with self._use_lock:
+            self._retired = logout
+            busy = self.in_use
+        if not busy:
+            logout(self)
+
+    def idle_for(self, now=None):
+        """Seconds since the session was last used, 0 while it is in use."""
+        if self.in_use:
+            return 0
+        return (now or time.time()) - self.last_used
+
+    def mark_broken(self):
+        if not self.broken:
+            LOG.debug('session to %s marked broken', self.host)
+        self.broken = True
+        self.cache.clear()
+        self.member_index.clear()
+
+    def usable(self):
+        return bool(self.token) and not self.broken
+
+    def token_age(self):
+        return time.time() - self.token_issued
+
+    def reauthenticate(self, stale_token=None):
+        """Get a new token after the device rejected stale_token.
+
+        Concurrent callers that hit the same expired token share one
+        refresh/login: whoever comes second finds the token already
+        replaced and returns at once.
+        """
+        with self._auth_lock:
+            if stale_token is not None and self.token != stale_token:
+                return bool(self.token)
+            if self.token and self.refresh():
+                return True
+            if not self._credentials:
+                return False
+            self.token = ''
+            self.login(*self._credentials)
+            if self.token:
+                self.broken = False
+                return True
+            self.mark_broken()
+            return False
 
     def login(self, name, key):
         url = self.url_prefix + '/api/user/login'
         url_referer = self.url_prefix + '/ui/'
         res = requests.Response()
+        ok = False
         payload = {'username':name,'password':key}
+        self._credentials = (name, key)
+        self.vdom_admin_enabled = False
         headers = {'Content-Type': 'application/json',
                     'User-Agent': 'Mozilla/5.0',
                     'Accept': 'application/json, text/javascript, */*;',
                     'Content-Type': 'application/json; charset=UTF-8',
                     'Referer': url_referer}
         try:
-            res = self.session.post(url, headers=headers, json=payload, timeout=(fadc_api.base.http_connection_timeout, fadc_api.base.http_read_timeout))
+            with self.breaker.attempt(), self.limiter.slot(device_limiter.LOGIN):
+                res = self.session.post(url, headers=headers, json=payload, timeout=(fadc_base.http_connection_timeout, fadc_base.http_read_timeout))
             LOG.debug('LOGIN:post end, %s', res.text)
 
             if False:
@@ -68,10 +179,13 @@ class Connector(object):
                     raise requests.ConnectionError("Can't get login token")
                 if 'token' in response:
                     self.token = response['token']
+                    self.token_issued = time.time()
+                    ok = True
                 else:
                     raise requests.ConnectionError("Can't get login token")
         except requests.ConnectionError as e:
             LOG.error("login error:%s" %(e))
+        metrics.LOGINS.inc(host=self.host, result='ok' if ok else 'failed')
             #return res
 
     def logout(self):
@@ -81,7 +195,8 @@ class Connector(object):
             headers = {'Authorization': 'Bearer ' + self.token}
         res = requests.Response()
         try:
-            res = self.session.get(url, headers=headers, timeout=(fadc_api.base.http_connection_timeout, fadc_api.base.http_read_timeout))
+            with self.breaker.attempt(), self.limiter.slot():
+                res = self.session.get(url, headers=headers, timeout=(fadc_base.http_connection_timeout, fadc_base.http_read_timeout))
             if res.status_code != 200:
                 LOG.debug( 'LOGOUT: fail')
             else:
@@ -94,12 +209,14 @@ class Connector(object):
         return res
     def refresh(self):
         if int(fadc_api.__version__[0]) < self.major:
-            return
+            return False
         url = self.url_prefix + '/api/refresh_token'
         headers = {'Authorization': 'Bearer ' + self.token}
         res = requests.Response()
+        ok = False
         try:
-            res = self.session.get(url, headers=headers)
+            with self.breaker.attempt(), self.limiter.slot():
+                res = self.session.get(url, headers=headers, timeout=(fadc_base.http_connection_timeout, fadc_base.http_read_timeout))
             if res.status_code != 200:
                 LOG.debug( 'refresh: fail')
             else:
@@ -108,19 +225,24 @@ class Connector(object):
                     raise requests.ConnectionError("Can't get refresh token")
                 if 'token' in response:
                     self.token = response['token']
+                    self.token_issued = time.time()
+                    ok = True
                 else:
                     raise requests.ConnectionError("Can't get refresh token")
-                LOG.info("refresh token %s" %(self.token))
-        except requests.ConnectionError as e:
+                LOG.info("refresh token of %s" %(self.host))
+        except (requests.ConnectionError, ValueError) as e:
             LOG.debug( "%s" %(e))
 
+        metrics.TOKEN_REFRESHES.inc(host=self.host, result='ok' if ok else 'failed')
         LOG.debug( ("response.text = %s" % (res.text)))
         LOG.debug( 'exit refresh')
+        return ok
     def check_version(self):
         url = self.url_prefix + '/api/platform/version'
         res = requests.Response()
         try:
-            res = self.session.get(url, timeout=(fadc_api.base.http_connection_timeout, fadc_api.base.http_read_timeout))
+            with self.breaker.attempt(), self.limiter.slot():
+                res = self.session.get(url, timeout=(fadc_base.http_connection_timeout, fadc_base.http_read_timeout))
             if res.status_code != 200:
                 LOG.error( 'GetVersion: fail')
             else:
@@ -0,0 +1,135 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Admission control of the REST requests and logins sent to one FortiADC.
+
+Every request of every session to a device takes a slot of the device
+limiter first: at most fadc_max_concurrent_requests in flight and at most
+fadc_max_requests_per_second started, logins also at most
+fadc_max_logins_per_minute. Work over the limits waits here, inside the
+agent, instead of being refused by the device or locking the admin account
+out. A request still without a slot after max_wait raises DeviceBusy. The
+limits are per agent process, set per fadc_devices entry.
+"""
+
+import contextlib
+import threading
+import time
+
+from oslo_log import log as logging
+
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent.servicemanager.circuit_breaker import DeviceBusy
+
+LOG = logging.getLogger(__name__)
+
+REQUEST = 'request'
+LOGIN = 'login'
+
+default_max_concurrent = 16
+# longest wait for a slot before the request fails
+max_wait = 120
+
+
+class TokenBucket(object):
+    """rate tokens per second, at most burst of them saved up."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or max(1, rate))
+        self._tokens = self.burst
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, deadline):
+        """Take a token, waiting for it until deadline (monotonic)."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+class DeviceLimiter(object):
+
+    def __init__(self, host, max_concurrent=0, requests_per_second=0, logins_per_minute=0):
+        self.host = host
+        self._slots = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._requests = TokenBucket(requests_per_second) if requests_per_second else None
+        self._logins = TokenBucket(logins_per_minute / 60.0, 1) if logins_per_minute else None
+
+    def acquire(self, kind=REQUEST, timeout=max_wait):
+        start = time.monotonic()
+        deadline = start + timeout
+        if self._slots is not None and not self._slots.acquire(timeout=timeout):
+            raise DeviceBusy(self.host, kind, timeout)
+        try:
+            buckets = [self._requests] + ([self._logins] if kind == LOGIN else [])
+            for bucket in buckets:
+                if bucket is not None and not bucket.take(deadline):
+                    raise DeviceBusy(self.host, kind, time.monotonic() - start)
+        except DeviceBusy:
+            if self._slots is not None:
+                self._slots.release()
+            raise
+        waited = time.monotonic() - start
+        metrics.DEVICE_WAIT_SECONDS.observe(waited, host=self.host, kind=kind)
+        metrics.DEVICE_IN_FLIGHT.inc(host=self.host)
+        if waited > 1:
+            LOG.debug('%s to %s admitted after %.1fs', kind, self.host, waited)
+
+    def release(self):
+        metrics.DEVICE_IN_FLIGHT.dec(host=self.host)
+        if self._slots is not None:
+            self._slots.release()
+
+    @contextlib.contextmanager
+    def slot(self, kind=REQUEST):
+        self.acquire(kind)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(o_device):
+    """The limiter of a device, made with the limits of its first entry."""
+    host = o_device.fadc_FQDN
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            limiter = DeviceLimiter(
+                host,
+                getattr(o_device, 'fadc_max_concurrent_requests', default_max_concurrent),
+                getattr(o_device, 'fadc_max_requests_per_second', 0),
+                getattr(o_device, 'fadc_max_logins_per_minute', 0))
+            _limiters[host] = limiter
+        return limiter
+
+
+def unlimited(host):
+    return DeviceLimiter(host)
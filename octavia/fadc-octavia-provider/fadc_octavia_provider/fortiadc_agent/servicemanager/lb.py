@@ -36,6 +36,10 @@ class LoadBalancer(object):
         self.connector = self.fadc.connector
         self.vdom = Vdom(self.fadc.host, self.connector,self.fadc.conf.debug_mode)
 
+    def network_driver(self):
+        # a driver may bring its own, the benchmark runs without Neutron
+        return getattr(self.fadc, 'network_driver', None) or FadcNetworkDriver()
+
     def create(self, lb):
         LOG.debug("create Vdom, %s", lb)
         self.vdom.create(lb.project_id)
@@ -45,7 +49,7 @@ class LoadBalancer(object):
         intf.set_allowaccess(self.fadc.o_device.fadc_vdom_network_allowAccess)
         route = Routing(self.fadc.host, self.connector, self.fadc.conf.debug_mode)
         route.create(self.fadc.o_device.fadc_vdom_default_gw, lb.project_id)
-        network_driver = FadcNetworkDriver()
+        network_driver = self.network_driver()
         network_driver.plug_vip_to_port(lb.vip.ip_address, self.fadc.o_device.fadc_bind_vip_port_id)
 
     def delete(self, lb):
@@ -61,7 +65,7 @@ class LoadBalancer(object):
 
     def unplug(self, lb):
         LOG.debug("unplug %s", lb)
-        network_driver = FadcNetworkDriver()
+        network_driver = self.network_driver()
         try:
             network_driver.unplug_vip_from_port(lb['vip_address'], self.fadc.o_device.fadc_bind_vip_port_id)
         except Exception as e:
@@ -18,6 +18,7 @@
 """
 
 from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.virtual_server import VirtualServer
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.virtual_server import stats_concurrency
 from fadc_octavia_provider.fortiadc_agent.fadc_api.network import Nat_pool
 from oslo_log import log as logging
 
@@ -81,8 +82,10 @@ class Listener(object):
         LOG.debug("delete listener")
         self.vs.delete(listener)
 
-    def get_stats(self, listeners):
-        return self.vs.get_all_vs_stats(listeners, self.o_device.fadc_get_stats_interval)
+    def get_stats(self, listeners, marks=None, now=None):
+        concurrency = getattr(self.conf, 'fadc_stats_concurrency', stats_concurrency)
+        return self.vs.get_all_vs_stats(listeners, self.o_device.fadc_get_stats_interval,
+                                        concurrency, marks, now)
 
     def get_status(self, listener):
         return self.vs.getstatus(listener)
@@ -17,14 +17,23 @@
 
 """
 
+from concurrent import futures
+
 from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.real_server import RS
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb.virtual_server import stats_concurrency
 from oslo_log import log as logging
 
 LOG = logging.getLogger(__name__)
 
+default_batch_concurrency = 8
+
+
 class Member(object):
 
     def __init__(self, fadc_driver):
+        self.host = fadc_driver.host
+        self.conf = fadc_driver.conf
+        self.o_device = fadc_driver.o_device
         self.rs = RS(fadc_driver.host, fadc_driver.connector, fadc_driver.conf.debug_mode)
 
     def create(self, member):
@@ -42,4 +51,37 @@ class Member(object):
     def get_member_availability(self, member):
         return self.rs.get_availability(member)
 
+    def get_stats(self, members, last=None, now=None):
+        concurrency = getattr(self.conf, 'fadc_stats_concurrency', stats_concurrency)
+        return self.rs.get_all_rs_stats(members, self.o_device.fadc_get_stats_interval,
+                                        concurrency, last, now)
+
+    def batch_update(self, add, remove, update):
+        """Push the member changes of one pool to the device.
+
+        Removals run first, then additions and updates. Within a phase the
+        operations run concurrently, at most fadc_batch_concurrency of them
+        for this batch. Every request still takes a slot of the device
+        limiter, which bounds the load on the device across all batches.
+        Returns the members whose operation failed.
+        """
+        concurrency = getattr(self.conf, 'fadc_batch_concurrency', default_batch_concurrency)
+
+        def run(job):
+            action, member = job
+            try:
+                action(member)
+                return None
+            except Exception as e:
+                LOG.error('batch %s member %s failed. reason %s' %(action.__name__, member.id, e))
+                return member
 
+        failed = []
+        phases = [
+            [(self.rs.delete, m) for m in remove],
+            [(self.rs.create, m) for m in add] + [(self.rs.update, m) for m in update],
+        ]
+        with futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for jobs in phases:
+                failed.extend(m for m in executor.map(run, jobs) if m is not None)
+        return failed
@@ -0,0 +1,184 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Process wide registry of authenticated FortiADC sessions.
+
+Every driver task used to build its own Connector and log in again. The pool
+hands out one already authenticated Connector per device and credential set,
+so all tasks of a worker process share the login and the keep-alive
+connections of its requests session.
+"""
+
+import threading
+import time
+
+from oslo_log import log as logging
+
+from fadc_octavia_provider.fortiadc_agent.servicemanager import circuit_breaker
+from fadc_octavia_provider.fortiadc_agent.servicemanager.connector import Connector
+from fadc_octavia_provider.fortiadc_agent.servicemanager import device_limiter
+from fadc_octavia_provider.fortiadc_agent.servicemanager import token_manager
+
+LOG = logging.getLogger(__name__)
+
+default_idle_timeout = 300
+default_pool_maxsize = 10
+default_cache_ttl = 2
+
+
+class SessionPool(object):
+
+    def __init__(self, idle_timeout=default_idle_timeout, pool_maxsize=default_pool_maxsize,
+                 token_refresh_interval=token_manager.default_refresh_interval,
+                 cache_ttl=default_cache_ttl, adapters=None):
+        self.idle_timeout = idle_timeout
+        self.pool_maxsize = pool_maxsize
+        self.cache_ttl = cache_ttl
+        # host -> requests transport adapter the sessions to that host use
+        # instead of the network, tests mount the simulator this way
+        self.adapters = dict(adapters or {})
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._login_locks = {}
+        self.token_manager = token_manager.TokenManager(self, token_refresh_interval)
+
+    @staticmethod
+    def key(o_device):
+        return (o_device.fadc_FQDN, o_device.fadc_username,
+                o_device.fadc_password, bool(o_device.certificate_verify),
+                o_device.ca_file)
+
+    def acquire(self, o_device):
+        """Return an authenticated Connector for the device.
+
+        A new login is only made when no usable session is pooled for the
+        device. Concurrent callers for the same device wait for a single
+        login instead of each logging in.
+        """
+        key = self.key(o_device)
+        self.evict_idle()
+        connector = self._lookup(key)
+        if connector:
+            if self.token_manager.is_due(connector):
+                connector.reauthenticate(connector.token)
+            return connector
+
+        with self._lock:
+            login_lock = self._login_locks.setdefault(key, threading.Lock())
+        with login_lock:
+            connector = self._lookup(key)
+            if connector:
+                return connector
+            connector = Connector(o_device.fadc_FQDN, o_device.certificate_verify,
+                                  o_device.ca_file, pool_maxsize=self.pool_maxsize,
+                                  cache_ttl=self.cache_ttl,
+                                  limiter=device_limiter.get_limiter(o_device),
+                                  breaker=circuit_breaker.get_breaker(o_device),
+                                  adapter=self.adapters.get(o_device.fadc_FQDN))
+            try:
+                connector.login(o_device.fadc_username, o_device.fadc_password)
+            except Exception as e:
+                LOG.error('login %s failed. reason %s' % (o_device.fadc_FQDN, e))
+            if connector.token:
+                with self._lock:
+                    self._sessions[key] = connector
+                LOG.debug('session pool: new session to %s', o_device.fadc_FQDN)
+                self.token_manager.start()
+            return connector
+
+    def sessions(self):
+        with self._lock:
+            return list(self._sessions.values())
+
+    def _lookup(self, key):
+        with self._lock:
+            connector = self._sessions.get(key)
+            if connector is None:
+                return None
+            if connector.usable():
+                connector.touch()
+                return connector
+            # broken sessions are dropped, the next acquire logs in again
+            del self._sessions[key]
+        connector.retire(self._logout_later)
+        return None
+
+    def discard(self, connector):
+        """Remove a session from the pool and log it out."""
+        with self._lock:
+            for key, pooled in list(self._sessions.items()):
+                if pooled is connector:
+                    del self._sessions[key]
+        connector.retire(self._logout)
+
+    def evict_idle(self):
+        now = time.time()
+        evicted = []
+        with self._lock:
+            for key, connector in list(self._sessions.items()):
+                if connector.idle_for(now) > self.idle_timeout:
+                    del self._sessions[key]
+                    evicted.append(connector)
+        for connector in evicted:
+            LOG.debug('session pool: evict idle session to %s', connector.host)
+            # a request may have started since the idle check
+            connector.retire(self._logout)
+
+    def close_all(self):
+        self.token_manager.stop()
+        with self._lock:
+            connectors = list(self._sessions.values())
+            self._sessions.clear()
+        for connector in connectors:
+            self._logout(connector)
+
+    def _logout_later(self, connector):
+        """Log a dropped session out without holding up the caller, the
+        device may be slow to answer or not answer at all."""
+        thread = threading.Thread(target=self._logout, args=(connector,),
+                                  name='fadc-session-logout')
+        thread.daemon = True
+        thread.start()
+
+    def _logout(self, connector):
+        try:
+            # a broken session may still hold an admin login on the device,
+            # the circuit breaker fails the logout at once when the device
+            # is known to be unreachable
+            if connector.token:
+                connector.logout()
+                connector.token = ''
+            connector.session.close()
+        except Exception as e:
+            LOG.debug('logout %s failed. reason %s' % (connector.host, e))
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_session_pool(conf=None):
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                idle_timeout = getattr(conf, 'fadc_session_idle_timeout', default_idle_timeout)
+                pool_maxsize = getattr(conf, 'fadc_session_pool_maxsize', default_pool_maxsize)
+                refresh_interval = getattr(conf, 'fadc_token_refresh_interval',
+                                           token_manager.default_refresh_interval)
+                cache_ttl = getattr(conf, 'fadc_get_cache_ttl', default_cache_ttl)
+                _pool = SessionPool(idle_timeout, pool_maxsize, refresh_interval, cache_ttl)
+    return _pool
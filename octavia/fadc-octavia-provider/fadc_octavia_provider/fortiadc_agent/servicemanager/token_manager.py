@@ -0,0 +1,68 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Background refresh of the bearer tokens held by pooled sessions.
+"""
+
+import threading
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+default_refresh_interval = 600
+default_check_interval = 30
+
+
+class TokenManager(object):
+
+    def __init__(self, pool, refresh_interval=default_refresh_interval,
+                 check_interval=default_check_interval):
+        self.pool = pool
+        self.refresh_interval = refresh_interval
+        self.check_interval = min(check_interval, max(refresh_interval // 2, 1))
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if not self.refresh_interval or self._thread:
+            return
+        self._thread = threading.Thread(target=self._run,
+                                        name='fadc-token-manager')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.refresh_due()
+            except Exception as e:
+                LOG.error('token refresh failed. reason %s' % (e))
+
+    def refresh_due(self):
+        """Refresh every pooled token older than refresh_interval."""
+        for connector in self.pool.sessions():
+            if self.is_due(connector):
+                LOG.debug('token of %s is %ds old, refresh it',
+                          connector.host, connector.token_age())
+                connector.reauthenticate(connector.token)
+
+    def is_due(self, connector):
+        return (bool(self.refresh_interval) and connector.usable() and
+                connector.token_age() > self.refresh_interval)
@@ -0,0 +1,369 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Cumulative listener statistics from FortiADC status_history windows.
+
+status_history returns a sliding window of per interval samples. Octavia
+expects bytes and connection counters that only grow. Each listener has a
+high-water mark, the time up to which its samples are in the counters
+Octavia stores. A sync_stats sweep adds the samples that ended after the
+mark to the stored counters, and the mark only moves to the time of the
+sweep once Octavia has taken the new counters. A failed vdom or a report
+Octavia did not take leaves the marks where they were, the next sweep
+counts the same stretch again. The samples are placed in time by the sample
+interval, the span of the requested range divided by the window length, on
+a grid aligned to the epoch. active_connections is a gauge, the last sample.
+
+The marks are kept in a file shared by the consumer processes, whose sweeps
+are serialized by a lock on that file, so every sample is counted once
+whichever process runs the sweep.
+
+A window that does not continue the previous one seen by this process at
+its time shift (the device restarted and lost its history) is counted in
+fadc_stats_counter_resets_total. The samples after the mark that only the
+previous window still holds are taken from it.
+
+Members have no counters in Octavia, accumulate() grows the last sample of
+their local history by the samples of the window after it.
+
+All listeners of a vdom are summed in one vectorized pass when NumPy is
+installed, the pure Python path gives the same results.
+"""
+
+import contextlib
+import fcntl
+import json
+import math
+import os
+import threading
+import time
+
+from oslo_log import log as logging
+
+from fadc_octavia_provider.fortiadc_agent import metrics
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LOG = logging.getLogger(__name__)
+
+# status_history arrays that count per interval, and the Octavia counters
+# they add up to
+counter_fields = ('in_bytes', 'out_bytes', 'total_sessions')
+counter_names = ('bytes_in', 'bytes_out', 'total_connections')
+gauge_field = 'current_sessions'
+
+# seconds a status_history window spans, by its range parameter
+# (1hr/6hr/1day/1wk/1m/1y)
+range_seconds = {
+    '0': 3600,
+    '1': 6 * 3600,
+    '2': 24 * 3600,
+    '3': 7 * 24 * 3600,
+    '4': 30 * 24 * 3600,
+    '5': 365 * 24 * 3600,
+}
+default_range = '2'
+
+
+def _window(payload):
+    return [[int(e) for e in payload[field]] for field in counter_fields]
+
+
+def sample_interval(ptype, n):
+    """Seconds per sample of a window of n samples of range ptype."""
+    span = range_seconds.get(str(ptype), range_seconds[default_range])
+    return float(span) / max(1, n)
+
+
+def _newer(n, interval, now, t):
+    """How many of the last samples of a window of n end after time t.
+
+    The last sample ends at the last multiple of interval before now.
+    None for t means before the window.
+    """
+    if t is None:
+        return n
+    last_end = math.floor(now / interval) * interval
+    if t >= last_end:
+        return 0
+    return min(n, int(math.ceil((last_end - t) / interval - 1e-9)))
+
+
+def _continues(prev, cur, shift):
+    """Whether cur is prev moved by shift samples, give or take one."""
+    n = len(cur[0])
+    for k in (shift, shift - 1, shift + 1):
+        if 0 <= k < n and all(c[:n - k] == p[k:] for c, p in zip(cur, prev)):
+            return True
+    return shift >= n
+
+
+def accumulate(payload, ptype=default_range, last=None, now=None):
+    """Counters of an object Octavia keeps none for.
+
+    last is the (time, {name: value}) of its previous sample, None for a
+    new object. Its counters grow by the samples of the status_history
+    payload that ended after that time and up to now.
+    """
+    now = time.time() if now is None else now
+    window = _window(payload)
+    n = len(window[0])
+    new = _newer(n, sample_interval(ptype, n), now, last[0] if last else None)
+    before = last[1] if last else {}
+    stats = dict((name, int(before.get(name, 0)) + sum(samples[n - new:]))
+                 for name, samples in zip(counter_names, window))
+    samples = payload[gauge_field]
+    stats['active_connections'] = int(samples[-1]) if samples else 0
+    return stats
+
+
+class StatsMarks(object):
+    """Per listener time up to which Octavia stores its statistics.
+
+    With a file the marks are shared by the consumer processes. They are
+    only read and written by a sweep holding exclusive().
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._marks = {}
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def _load(self):
+        if not self.path:
+            return dict(self._marks)
+        try:
+            with open(self.path) as f:
+                return json.load(f).get('listeners') or {}
+        except (IOError, ValueError) as e:
+            if os.path.exists(self.path):
+                LOG.warning('cannot read stats marks %s: %s', self.path, e)
+            return {}
+
+    def _save(self, marks):
+        if not self.path:
+            self._marks = marks
+            return
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'listeners': marks}, f)
+        os.rename(tmp, self.path)
+
+    def get(self, listener_ids):
+        """{listener_id: mark} of the listeners of listener_ids with one."""
+        marks = self._load()
+        return dict((i, marks[i]) for i in listener_ids if i in marks)
+
+    def advance(self, listener_ids, value):
+        """Move the marks of listener_ids forward to value."""
+        marks = self._load()
+        for i in listener_ids:
+            if marks.get(i) is None or marks[i] < value:
+                marks[i] = value
+        self._save(marks)
+
+    def prune(self, listener_ids):
+        """Forget every listener not in listener_ids."""
+        keep = set(listener_ids)
+        marks = self._load()
+        gone = [i for i in marks if i not in keep]
+        if gone:
+            for i in gone:
+                marks.pop(i)
+            self._save(marks)
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Yields whether this caller may run a sweep now."""
+        if not self._lock.acquire(blocking=False):
+            yield False
+            return
+        lockfile = None
+        try:
+            if self.path:
+                lockfile = open(self.path + '.lock', 'a')
+                try:
+                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    yield False
+                    return
+            yield True
+        finally:
+            if lockfile:
+                lockfile.close()
+            self._lock.release()
+
+
+class StatsAggregator(object):
+
+    def __init__(self, baseline=None):
+        # baseline(listener_ids) returns {listener_id: counters} Octavia
+        # holds, whichever consumer process reported them
+        self.baseline = baseline
+        self._lock = threading.Lock()
+        # listener -> (window, time), to detect history resets and to
+        # recover the samples a reset lost
+        self._last = {}
+
+    def aggregate(self, payloads, ptype=default_range, marks=None, now=None):
+        """Listener stats of {listener_id: status_history payload}.
+
+        The samples that ended after the mark of their listener, from
+        {listener_id: mark}, and up to now are added to the stored
+        counters. The caller moves the marks to now once Octavia has
+        taken the result.
+        """
+        now = time.time() if now is None else now
+        marks = marks or {}
+        windows = {}
+        gauges = {}
+        for listener_id, payload in payloads.items():
+            try:
+                windows[listener_id] = _window(payload)
+                samples = payload[gauge_field]
+                gauges[listener_id] = int(samples[-1]) if samples else 0
+            except (KeyError, TypeError, ValueError) as e:
+                LOG.warning('bad status_history of listener %s: %s', listener_id, e)
+        if not windows:
+            return []
+
+        stored = self._stored(list(windows))
+        if stored is None:
+            return []
+        deltas = self._deltas(windows, ptype, marks, now)
+        for i, last in self._check_resets(windows, ptype, now).items():
+            deltas[i] = self._recovered(windows[i], last, ptype, marks.get(i), now)
+
+        result = []
+        for i in windows:
+            known = stored.get(i) or [0] * len(counter_fields)
+            if marks.get(i) is None and any(known):
+                # without a mark nothing tells which samples Octavia
+                # already holds, the stored counters are kept as they are
+                delta = [0] * len(counter_fields)
+            else:
+                delta = deltas[i]
+            stats = dict(zip(counter_names, [k + d for k, d in zip(known, delta)]))
+            stats.update({'id': i,
+                          'active_connections': gauges[i],
+                          'request_errors': 0})
+            result.append(stats)
+        return result
+
+    def _stored(self, listener_ids):
+        if not self.baseline:
+            return {}
+        try:
+            return self.baseline(listener_ids)
+        except Exception as e:
+            # reporting without the stored counters would move them back
+            LOG.error('cannot read the stored stats of %d listeners, not reported: %s',
+                      len(listener_ids), e)
+            return None
+
+    def _deltas(self, windows, ptype, marks, now):
+        """Sum of the samples after the mark per listener."""
+        # windows of one length share the sample times, summed in one pass
+        groups = {}
+        for i, window in windows.items():
+            groups.setdefault(len(window[0]), []).append(i)
+        deltas = {}
+        for n, group in groups.items():
+            interval = sample_interval(ptype, n)
+            first = [n - _newer(n, interval, now, marks.get(i)) for i in group]
+            if np is not None:
+                cur = np.array([windows[i] for i in group], dtype=np.int64)
+                after = np.arange(n)[None, :] >= np.array(first)[:, None]
+                sums = (cur * after[:, None, :]).sum(axis=2)
+                for row, i in enumerate(group):
+                    deltas[i] = [int(v) for v in sums[row]]
+            else:
+                for i, lo in zip(group, first):
+                    deltas[i] = [sum(samples[lo:]) for samples in windows[i]]
+        return deltas
+
+    def _recovered(self, window, last, ptype, mark, now):
+        """Samples after mark of a listener whose history restarted.
+
+        The previous window holds the samples up to the time it was read,
+        the current one only the samples after that.
+        """
+        prev, seen = last
+        n = len(window[0])
+        interval = sample_interval(ptype, n)
+        old = _newer(n, interval, seen, mark) if mark is None or mark < seen else 0
+        new = _newer(n, interval, now, seen if old else mark)
+        return [sum(p[n - old:]) + sum(c[n - new:]) for p, c in zip(prev, window)]
+
+    def _check_resets(self, windows, ptype, now):
+        """{listener_id: (window, time)} of the previous window of the
+        listeners whose history restarted."""
+        resets = {}
+        with self._lock:
+            for i, window in windows.items():
+                last = self._last.get(i)
+                self._last[i] = (window, now)
+                if last is None or len(last[0][0]) != len(window[0]) or now <= last[1]:
+                    continue
+                n = len(window[0])
+                interval = sample_interval(ptype, n)
+                shift = int(math.floor(now / interval) - math.floor(last[1] / interval))
+                if not _continues(last[0], window, shift):
+                    LOG.warning('status_history of listener %s restarted', i)
+                    resets[i] = last
+        if resets:
+            metrics.STATS_COUNTER_RESETS.inc(len(resets))
+        return resets
+
+    def prune(self, listener_ids):
+        """Forget every listener not in listener_ids."""
+        keep = set(listener_ids)
+        with self._lock:
+            for i in [i for i in self._last if i not in keep]:
+                self._last.pop(i, None)
+
+
+_aggregator = None
+_aggregator_lock = threading.Lock()
+
+
+def get_aggregator():
+    global _aggregator
+    if _aggregator is None:
+        with _aggregator_lock:
+            if _aggregator is None:
+                _aggregator = StatsAggregator()
+    return _aggregator
+
+
+_marks = None
+_marks_lock = threading.Lock()
+
+
+def get_marks(conf=None):
+    global _marks
+    if _marks is None:
+        with _marks_lock:
+            if _marks is None:
+                _marks = StatsMarks(getattr(conf, 'fadc_stats_marks_file', '') or None)
+    return _marks
@@ -28,6 +28,7 @@ from oslo_utils import uuidutils
 from octavia.common import constants
 from octavia.common import rpc
 from fadc_octavia_provider.fortiadc_agent import endpoints
+from fadc_octavia_provider.fortiadc_agent import tracing
 
 LOG = logging.getLogger(__name__)
 
@@ -60,4 +61,4 @@ class StatsService(cotyledon.Service):
     def periodic_task(self):
         LOG.debug("Stats service sync stats")
         payload = {'name': 'sync_stats'}
-        self.client.cast({}, 'sync_stats', **payload)
+        self.client.cast(tracing.rpc_context(), 'sync_stats', **payload)
@@ -0,0 +1,117 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+High-water mark of the Octavia changes sync_state has already checked.
+
+An incremental sync_state only reconciles the vdoms with an object created
+or updated after the mark. The mark is a database timestamp, so the clocks
+of the agent hosts do not matter. With a file configured it survives agent
+restarts and is shared by the consumer processes, whose sync passes are
+serialized by a lock on that file. Without a file every pass is a full one:
+a mark in memory would neither be shared nor serialize the passes of the
+other processes.
+"""
+
+import contextlib
+import datetime
+import fcntl
+import json
+import os
+import threading
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+# changes committed late can carry a timestamp a little older than the mark
+overlap = datetime.timedelta(seconds=30)
+
+
+class Watermark(object):
+
+    def __init__(self, path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self._value = None
+        if path:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+    def get(self):
+        """The mark, None when no pass has recorded one yet."""
+        if not self.path:
+            return self._value
+        try:
+            with open(self.path) as f:
+                value = json.load(f).get('watermark')
+        except (IOError, ValueError) as e:
+            if os.path.exists(self.path):
+                LOG.warning('cannot read sync watermark %s: %s', self.path, e)
+            return None
+        return datetime.datetime.fromisoformat(value) if value else None
+
+    def since(self):
+        """Changes after this time are to be checked, None for all of them."""
+        value = self.get()
+        return value - overlap if value is not None else None
+
+    def advance(self, value):
+        """Move the mark forward to value, it never goes back."""
+        current = self.get()
+        if value is None or (current is not None and value <= current):
+            return
+        if not self.path:
+            self._value = value
+            return
+        tmp = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump({'watermark': value.isoformat()}, f)
+        os.rename(tmp, self.path)
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """Yields whether this caller may run a sync pass now."""
+        if not self._lock.acquire(blocking=False):
+            yield False
+            return
+        lockfile = None
+        try:
+            if self.path:
+                lockfile = open(self.path + '.lock', 'a')
+                try:
+                    fcntl.flock(lockfile.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    yield False
+                    return
+            yield True
+        finally:
+            if lockfile:
+                lockfile.close()
+            self._lock.release()
+
+
+_watermark = None
+_watermark_lock = threading.Lock()
+
+
+def get_watermark(conf=None):
+    global _watermark
+    if _watermark is None:
+        with _watermark_lock:
+            if _watermark is None:
+                _watermark = Watermark(getattr(conf, 'fadc_sync_watermark_file', '') or None)
+    return _watermark
@@ -0,0 +1,170 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Taskflow engine of the provisioning flows, with per device executors.
+
+The flows are loaded on the engine CONF.task_flow.engine names, like
+Octavia does; its default, parallel, already runs the branches of
+unordered flows at the same time. fadc_flow_executor picks the thread pool
+the tasks run on: shared is one pool of CONF.task_flow.max_workers threads
+for every flow, per_device gives each FortiADC device a pool of its own of
+fadc_flow_workers threads, so one busy device cannot take every worker
+thread. Both pools copy the caller's context into the task threads, the
+spans of the tasks and of their FortiADC requests stay in the trace of the
+flow.
+
+MetricsListener records how long every flow and every provider task of an
+engine took.
+"""
+
+import concurrent.futures
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from taskflow import engines as tf_engines
+from taskflow import states
+from taskflow.listeners import base as tf_listeners
+
+from octavia.common import base_taskflow
+from octavia.common import constants
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import tracing
+
+CONF = cfg.CONF
+LOG = logging.getLogger(__name__)
+
+SHARED = 'shared'
+PER_DEVICE = 'per_device'
+
+default_flow_workers = 8
+# only the provider's own tasks are timed, by class
+driver_tasks_module = 'fadc_octavia_provider.fortiadc_agent.tasks.fortiadc_driver_tasks'
+
+
+def flow_device(store):
+    """FQDN of the device the flow of store works on, None if unknown."""
+    if not store:
+        return None
+    project_id = store.get(constants.PROJECT_ID)
+    if not project_id:
+        loadbalancer = store.get(constants.LOADBALANCER)
+        if isinstance(loadbalancer, dict):
+            project_id = loadbalancer.get(constants.PROJECT_ID)
+    device = getattr(CONF, 'd_projects', {}).get(project_id)
+    return device.get('fadc_FQDN') if device else None
+
+
+ContextThreadPoolExecutor = tracing.ContextThreadPoolExecutor
+
+
+class FadcTaskFlowEngine(base_taskflow.BaseTaskFlowEngine):
+
+    def __init__(self):
+        super(FadcTaskFlowEngine, self).__init__()
+        # Octavia's plain executor runs the tasks of its default parallel
+        # engine without the caller's context, their spans would start new
+        # traces
+        base_executor = getattr(self, 'executor', None)
+        if isinstance(base_executor, concurrent.futures.Executor):
+            base_executor.shutdown(wait=False)
+        self.executor = ContextThreadPoolExecutor(
+            max_workers=CONF.task_flow.max_workers)
+        self.per_device = getattr(CONF, 'fadc_flow_executor', SHARED) == PER_DEVICE
+        self.max_workers = getattr(CONF, 'fadc_flow_workers', default_flow_workers)
+        self._lock = threading.Lock()
+        self._executors = {}
+
+    def device_executor(self, host):
+        with self._lock:
+            executor = self._executors.get(host)
+            if executor is None:
+                LOG.debug('flow executor for %s, %d workers', host, self.max_workers)
+                executor = ContextThreadPoolExecutor(
+                    max_workers=self.max_workers)
+                self._executors[host] = executor
+            return executor
+
+    def taskflow_load(self, flow, **kwargs):
+        if not self.per_device:
+            return super(FadcTaskFlowEngine, self).taskflow_load(flow, **kwargs)
+        executor = self.device_executor(flow_device(kwargs.get('store')))
+        eng = tf_engines.load(
+            flow,
+            engine=CONF.task_flow.engine,
+            executor=executor,
+            never_resolve=getattr(CONF.task_flow, 'disable_revert', False),
+            **kwargs)
+        eng.compile()
+        eng.prepare()
+        return eng
+
+
+class MetricsListener(tf_listeners.Listener):
+    """Observes flow and task execution times into the agent metrics."""
+
+    finished = (states.SUCCESS, states.FAILURE, states.REVERTED)
+
+    def __init__(self, engine, flow_name=None):
+        super(MetricsListener, self).__init__(engine)
+        self.flow_name = flow_name
+        self._lock = threading.Lock()
+        self._started = {}
+        self._classes = None
+
+    def _task_class(self, name):
+        """Class name of the provider task called name, None for others.
+
+        Flows name tasks after the objects they work on, the class keeps
+        the metric labels bounded.
+        """
+        if self._classes is None:
+            classes = {}
+            try:
+                atoms = list(self._engine.compilation.execution_graph.nodes)
+            except Exception as e:
+                LOG.debug('cannot list the tasks of the flow: %s', e)
+                atoms = []
+            for atom in atoms:
+                if type(atom).__module__ == driver_tasks_module:
+                    classes[atom.name] = type(atom).__name__
+            self._classes = classes
+        return self._classes.get(name)
+
+    def _timed(self, key, state):
+        with self._lock:
+            if state == states.RUNNING:
+                self._started[key] = time.time()
+                return None
+            if state not in self.finished:
+                return None
+            start = self._started.pop(key, None)
+        return None if start is None else time.time() - start
+
+    def _task_receiver(self, state, details):
+        task_class = self._task_class(details['task_name'])
+        if task_class is None:
+            return
+        elapsed = self._timed(('task', details['task_name'], details.get('task_uuid')), state)
+        if elapsed is not None:
+            metrics.TASK_SECONDS.observe(elapsed, task=task_class, result=state.lower())
+
+    def _flow_receiver(self, state, details):
+        name = self.flow_name or details['flow_name']
+        elapsed = self._timed(('flow', name), state)
+        if elapsed is not None:
+            metrics.FLOW_SECONDS.observe(elapsed, flow=name, result=state.lower())
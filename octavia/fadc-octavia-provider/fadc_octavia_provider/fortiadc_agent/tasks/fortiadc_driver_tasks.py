@@ -21,6 +21,9 @@ from octavia_lib.api.drivers import driver_lib
 from octavia_lib.api.drivers import exceptions as driver_exceptions
 from octavia_lib.common import constants as lib_consts
 from fadc_octavia_provider.fortiadc_agent.fadc_device_driver import FadcdeviceDriver
+from fadc_octavia_provider.fortiadc_agent.servicemanager.circuit_breaker import DeviceBusy
+from fadc_octavia_provider.fortiadc_agent.servicemanager.circuit_breaker import DeviceUnavailable
+from fadc_octavia_provider.fortiadc_agent import tracing
 
 CONF = cfg.CONF
 LOG = logging.getLogger(__name__)
@@ -29,6 +32,12 @@ LOG = logging.getLogger(__name__)
 class BaseFortiadcTask(task.Task):
     """Base task to load drivers common to the tasks."""
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # every task execution is a span of the flow it runs in
+        if 'execute' in vars(cls):
+            cls.execute = tracing.traced('task.' + cls.__name__)(cls.execute)
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
         self.listener_repo = repo.ListenerRepository()
@@ -39,6 +48,14 @@ class BaseFortiadcTask(task.Task):
         self.task_utils = task_utilities.TaskUtils()
         #self.fadc_device_driver = FadcdeviceDriver(CONF)
 
+    def log_revert(self, result=None):
+        exc = result.exception if isinstance(result, failure.Failure) else None
+        if isinstance(exc, (DeviceUnavailable, DeviceBusy)):
+            # the request was never sent, the device has nothing to undo
+            LOG.warning("task:%s: revert, %s", type(self).__name__, exc)
+        else:
+            LOG.warning("task:%s: revert", type(self).__name__)
+
     def update_status(self, loadbalancer_id):
         o_driver_lib = driver_lib.DriverLibrary(
             status_socket=CONF.driver_agent.status_socket_path,
@@ -98,7 +115,7 @@ class LoadBalancerCreate(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = loadbalancer['project_id']).loadbalancer.create(db_lb)
 
     def revert(self, loadbalancer, *args, **kwargs):
-        LOG.warning("task:LoadBalancerCreate: revert")
+        self.log_revert(kwargs.get('result'))
 
 
 class LoadBalancerDelete(BaseFortiadcTask):
@@ -108,7 +125,7 @@ class LoadBalancerDelete(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = loadbalancer['project_id']).loadbalancer.delete(loadbalancer)
 
     def revert(self, loadbalancer, *args, **kwargs):
-        LOG.warning("task:LoadBalancerDelete: revert")
+        self.log_revert(kwargs.get('result'))
 
 class LoadBalancerUnplug(BaseFortiadcTask):
 
@@ -117,7 +134,7 @@ class LoadBalancerUnplug(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = loadbalancer['project_id']).loadbalancer.unplug(loadbalancer)
 
     def revert(self, loadbalancer, *args, **kwargs):
-        LOG.warning("task:LoadBalancerUnplug: revert")
+        self.log_revert(kwargs.get('result'))
 
 class ListenerCreate(BaseFortiadcTask):
 
@@ -130,7 +147,7 @@ class ListenerCreate(BaseFortiadcTask):
             FadcdeviceDriver(CONF, project_id = db_listener.project_id).listener.create(db_listener)
 
     def revert(self, listeners, *args, **kwargs):
-        LOG.warning("task:ListenerCreate: revert")
+        self.log_revert(kwargs.get('result'))
 
 
 class ListenerDelete(BaseFortiadcTask):
@@ -141,7 +158,7 @@ class ListenerDelete(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = db_listener.project_id).listener.delete(db_listener)
 
     def revert(self, listener, *args, **kwargs):
-        LOG.warning("task:ListenerDelete: revert")
+        self.log_revert(kwargs.get('result'))
 
 class ListenersUpdate(BaseFortiadcTask):
 
@@ -183,7 +200,7 @@ class PoolCreate(BaseFortiadcTask):
                 FadcdeviceDriver(CONF, project_id = db_listener.project_id).listener.create(db_listener)
 
     def revert(self, pool_id, listeners, *args, **kwargs):
-        LOG.warning("task:PoolCreate: revert")
+        self.log_revert(kwargs.get('result'))
 
 
 class PoolDelete(BaseFortiadcTask):
@@ -194,7 +211,7 @@ class PoolDelete(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = db_pool.project_id).pool.delete(db_pool)
 
     def revert(self, pool_id, *args, **kwargs):
-        LOG.warning("task:PoolDelete: revert")
+        self.log_revert(kwargs.get('result'))
 
 class PoolUpdate(BaseFortiadcTask):
 
@@ -208,7 +225,7 @@ class PoolUpdate(BaseFortiadcTask):
             FadcdeviceDriver(CONF, project_id = db_listener.project_id).listener.update(db_listener)
 
     def revert(self, listeners, pool_id, *args, **kwargs):
-        LOG.warning("task:PoolUpdate: revert")
+        self.log_revert(kwargs.get('result'))
 
 
 class MemberCreate(BaseFortiadcTask):
@@ -220,7 +237,7 @@ class MemberCreate(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = db_member.project_id).member.create(db_member)
 
     def revert(self, member, *args, **kwargs):
-        LOG.warning("task:MemberCreate: revert")
+        self.log_revert(kwargs.get('result'))
 
 
 class MemberDelete(BaseFortiadcTask):
@@ -231,7 +248,7 @@ class MemberDelete(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = db_member.project_id).member.delete(db_member)
 
     def revert(self, member, *args, **kwargs):
-        LOG.warning("task:MemberDelete: revert")
+        self.log_revert(kwargs.get('result'))
 
 class MemberDeleteObj(BaseFortiadcTask):
 
@@ -240,7 +257,7 @@ class MemberDeleteObj(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = member.project_id).member.delete(member)
 
     def revert(self, member, *args, **kwargs):
-        LOG.warning("task:MemberDeleteObj: revert")
+        self.log_revert(kwargs.get('result'))
 
 class MemberUpdate(BaseFortiadcTask):
 
@@ -250,7 +267,46 @@ class MemberUpdate(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = db_member.project_id).member.update(db_member)
 
     def revert(self, member, *args, **kwargs):
-        LOG.warning("task:MemberUpdate: revert")
+        self.log_revert(kwargs.get('result'))
+
+class MembersBatchUpdate(BaseFortiadcTask):
+
+    def execute(self, old_members, new_members, updated_members, project_id):
+        LOG.debug("task:MembersBatchUpdate: execute, remove %d, add %d, update %d",
+                  len(old_members), len(new_members), len(updated_members))
+        session = db_apis.get_session()
+        remove = [self.member_repo.get(session, id = m[constants.MEMBER_ID]) for m in old_members]
+        add = [self.member_repo.get(session, id = m[constants.MEMBER_ID]) for m in new_members]
+        update = []
+        for m, um in updated_members:
+            db_member = self.member_repo.get(session, id = m[constants.MEMBER_ID])
+            # the database is only updated once the device took the change
+            for key, value in um.items():
+                key = {'admin_state_up': 'enabled', 'address': 'ip_address'}.get(key, key)
+                if hasattr(db_member, key):
+                    setattr(db_member, key, value)
+            update.append(db_member)
+        failed = FadcdeviceDriver(CONF, project_id = project_id).member.batch_update(add, remove, update)
+        if failed:
+            raise Exception('Batch update of members %s failed' %(', '.join(m.id for m in failed)))
+        return [m.id for m in add]
+
+    def revert(self, result, old_members, new_members, updated_members, project_id, *args, **kwargs):
+        self.log_revert(result)
+        if isinstance(result, failure.Failure):
+            # which additions reached the device is not known, deleting a
+            # real server the device does not have is not an error
+            pushed = [m[constants.MEMBER_ID] for m in new_members]
+        else:
+            pushed = result or []
+        session = db_apis.get_session()
+        members = [m for m in (self.member_repo.get(session, id = i) for i in pushed) if m]
+        if not members:
+            return
+        failed = FadcdeviceDriver(CONF, project_id = project_id).member.batch_update([], members, [])
+        if failed:
+            LOG.error("task:MembersBatchUpdate: revert could not delete members %s",
+                      ', '.join(m.id for m in failed))
 
 class HealthMonitorCreate(BaseFortiadcTask):
     def execute(self, health_mon, loadbalancer):
@@ -262,7 +318,7 @@ class HealthMonitorCreate(BaseFortiadcTask):
         self.update_status(loadbalancer['loadbalancer_id'])
 
     def revert(self, health_mon, loadbalancer, *args, **kwargs):
-        LOG.warning("task:HealthMonitorCreate: revert")
+        self.log_revert(kwargs.get('result'))
 
 class HealthMonitorDelete(BaseFortiadcTask):
 
@@ -272,7 +328,7 @@ class HealthMonitorDelete(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = db_health_mon.project_id).healthmonitor.delete(db_health_mon)
 
     def revert(self, health_mon, *args, **kwargs):
-        LOG.warning("task:HealthMonitorDelete: revert")
+        self.log_revert(kwargs.get('result'))
 
 class HealthMonitorDeleteObj(BaseFortiadcTask):
 
@@ -281,7 +337,7 @@ class HealthMonitorDeleteObj(BaseFortiadcTask):
         FadcdeviceDriver(CONF, project_id = health_mon.project_id).healthmonitor.delete_direct(health_mon)
 
     def revert(self, health_mon, *args, **kwargs):
-        LOG.warning("task:HealthMonitorDelete: revert")
+        self.log_revert(kwargs.get('result'))
 
 class HealthMonitorUpdate(BaseFortiadcTask):
 
@@ -293,5 +349,5 @@ class HealthMonitorUpdate(BaseFortiadcTask):
         self.update_status(loadbalancer['loadbalancer_id'])
 
     def revert(self, health_mon, loadbalancer, *args, **kwargs):
-        LOG.warning("task:HealthMonitorUpdate: revert")
+        self.log_revert(kwargs.get('result'))
 
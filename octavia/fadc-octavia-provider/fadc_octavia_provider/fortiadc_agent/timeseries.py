@@ -0,0 +1,341 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Local history of listener and member statistics.
+
+Every listener or member has a fixed size ring buffer of samples, a sample
+is a timestamp followed by one double per field. Buffers live in memory, or
+when a directory is configured in one file per object, which keeps the
+history over agent restarts and is shared by the worker processes of the
+agent. A file is only open, under a file lock, while a sample is appended or
+the history is read, so thousands of objects do not hold thousands of file
+descriptors.
+
+sync_stats records a sample of every listener it reports and, with
+fadc_stats_members, of every member. The metrics endpoint reads the files
+and serves per object rates of the counters and a percentile of the active
+connections over the last fadc_stats_history_window seconds.
+
+File layout: a header (magic, capacity, field count, next slot, sample
+count) followed by capacity * (1 + fields) native doubles.
+"""
+
+import bisect
+import contextlib
+import fcntl
+import os
+import re
+import struct
+import threading
+import time
+
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+magic = b'FADCTS01'
+header = struct.Struct('<8sIIQQ')
+default_capacity = 1024
+default_window = 3600
+
+LISTENER = 'listener'
+MEMBER = 'member'
+fields = {
+    LISTENER: ('bytes_in', 'bytes_out', 'active_connections', 'total_connections', 'request_errors'),
+    MEMBER: ('bytes_in', 'bytes_out', 'active_connections', 'total_connections'),
+}
+# served by the metrics endpoint: per second rates of the counters and a
+# percentile of the gauge
+rate_fields = ('bytes_in', 'bytes_out', 'total_connections')
+gauge_percentile = ('active_connections', 95)
+
+
+def _rate(points):
+    if len(points) < 2 or points[-1][0] <= points[0][0]:
+        return 0.0
+    increase = 0.0
+    for (_, before), (_, after) in zip(points, points[1:]):
+        # a counter that went down was reset, it grew by its new value
+        increase += after - before if after >= before else after
+    return increase / (points[-1][0] - points[0][0])
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class _MemoryIO(object):
+
+    def __init__(self, buf):
+        self.buf = buf
+
+    def read(self, offset, size):
+        return bytes(self.buf[offset:offset + size])
+
+    def write(self, offset, data):
+        self.buf[offset:offset + len(data)] = data
+
+
+class _FileIO(object):
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def read(self, offset, size):
+        return os.pread(self.fd, size, offset)
+
+    def write(self, offset, data):
+        os.pwrite(self.fd, data, offset)
+
+
+class RingBuffer(object):
+
+    def __init__(self, fields, capacity=default_capacity, path=None, create=True):
+        self.fields = tuple(fields)
+        self.width = 1 + len(self.fields)
+        self.capacity = capacity
+        self.path = path
+        self.create = create
+        self.size = header.size + capacity * self.width * 8
+        self._slot = struct.Struct('<%dd' % self.width)
+        self._lock = threading.Lock()
+        self._buf = None if path else bytearray(self.size)
+        with self._io():
+            pass
+
+    @contextlib.contextmanager
+    def _io(self):
+        """Locked access to the buffer, a new or mismatched one is reset."""
+        with self._lock:
+            if self._buf is not None:
+                io = _MemoryIO(self._buf)
+                self._check(io, self.size)
+                yield io
+                return
+            flags = os.O_RDWR | (os.O_CREAT if self.create else 0)
+            fd = os.open(self.path, flags, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                io = _FileIO(fd)
+                self._check(io, os.fstat(fd).st_size)
+                yield io
+            finally:
+                # closing the file releases the lock
+                os.close(fd)
+
+    def _check(self, io, size):
+        tag, cap, width, _, _ = header.unpack(io.read(0, header.size).ljust(header.size, b'\0'))
+        if size != self.size or (tag, cap, width) != (magic, self.capacity, len(self.fields)):
+            # new file, or one written with another capacity
+            if isinstance(io, _FileIO):
+                os.ftruncate(io.fd, 0)
+                os.ftruncate(io.fd, self.size)
+            io.write(0, header.pack(magic, self.capacity, len(self.fields), 0, 0))
+
+    def append(self, values, ts=None):
+        ts = time.time() if ts is None else ts
+        row = [ts] + [float(values.get(field, 0) or 0) for field in self.fields]
+        with self._io() as io:
+            _, _, _, head, count = header.unpack(io.read(0, header.size))
+            io.write(header.size + head * self._slot.size, self._slot.pack(*row))
+            io.write(0, header.pack(magic, self.capacity, len(self.fields),
+                                    (head + 1) % self.capacity, min(count + 1, self.capacity)))
+
+    def __len__(self):
+        with self._io() as io:
+            return header.unpack(io.read(0, header.size))[4]
+
+    def samples(self, since=None):
+        """(timestamp, {field: value}) pairs, oldest first."""
+        with self._io() as io:
+            data = io.read(0, self.size)
+        _, _, _, head, count = header.unpack_from(data, 0)
+        rows = []
+        for n in range(count):
+            offset = header.size + ((head - count + n) % self.capacity) * self._slot.size
+            rows.append(self._slot.unpack_from(data, offset))
+        if since is not None:
+            rows = rows[bisect.bisect_left([row[0] for row in rows], since):]
+        return [(row[0], dict(zip(self.fields, row[1:]))) for row in rows]
+
+    def latest(self):
+        rows = self.samples()
+        return rows[-1] if rows else None
+
+    def values(self, field, window=None, now=None):
+        since = None if window is None else (now or time.time()) - window
+        return [(ts, sample[field]) for ts, sample in self.samples(since)]
+
+    def rate(self, field, window=None, now=None):
+        """Per second increase of a counter field, counter resets excluded."""
+        return _rate(self.values(field, window, now))
+
+    def percentile(self, field, q, window=None, now=None):
+        """q-th percentile (0-100) of a field, None without samples."""
+        return _percentile([v for _, v in self.values(field, window, now)], q)
+
+    def close(self):
+        # nothing stays open between calls
+        pass
+
+
+class TimeSeriesStore(object):
+
+    def __init__(self, directory=None, capacity=default_capacity):
+        self.directory = directory
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._series = {}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind, object_id):
+        if not self.directory:
+            return None
+        return os.path.join(self.directory, '%s-%s.ts' % (kind, re.sub(r'[^\w-]', '_', object_id)))
+
+    def _files(self, kind):
+        """{object_id: path} of the history files of kind."""
+        if not self.directory:
+            return {}
+        prefix = kind + '-'
+        return dict((name[len(prefix):-len('.ts')], os.path.join(self.directory, name))
+                    for name in os.listdir(self.directory)
+                    if name.startswith(prefix) and name.endswith('.ts'))
+
+    def series(self, kind, object_id):
+        key = (kind, object_id)
+        with self._lock:
+            ring = self._series.get(key)
+            if ring is None:
+                ring = RingBuffer(fields[kind], self.capacity, self._path(kind, object_id))
+                self._series[key] = ring
+            return ring
+
+    def record(self, kind, stats_list, ts=None):
+        """Append a sample per stats dict, the object id is stats['id']."""
+        ts = time.time() if ts is None else ts
+        for stats in stats_list:
+            try:
+                self.series(kind, stats['id']).append(stats, ts)
+            except Exception as e:
+                LOG.warning('cannot record %s stats of %s: %s', kind, stats.get('id'), e)
+
+    def rate(self, kind, object_id, field, window=None):
+        return self.series(kind, object_id).rate(field, window)
+
+    def percentile(self, kind, object_id, field, q, window=None):
+        return self.series(kind, object_id).percentile(field, q, window)
+
+    def prune(self, kind, object_ids):
+        """Drop the history of every object of kind not in object_ids."""
+        keep = set(object_ids)
+        with self._lock:
+            gone = [key for key in self._series if key[0] == kind and key[1] not in keep]
+            rings = [self._series.pop(key) for key in gone]
+        for ring in rings:
+            ring.close()
+            if ring.path:
+                try:
+                    os.unlink(ring.path)
+                except OSError:
+                    pass
+        for object_id, path in self._files(kind).items():
+            if object_id not in keep:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+
+    def _rings(self, kind):
+        """(object_id, ring) of every object of kind, by id."""
+        if not self.directory:
+            with self._lock:
+                return sorted((key[1], ring) for key, ring in self._series.items()
+                              if key[0] == kind)
+        rings = []
+        for object_id, path in sorted(self._files(kind).items()):
+            # new rings that do not create their file, an object pruned
+            # since the listing does not come back
+            try:
+                rings.append((object_id, RingBuffer(fields[kind], self.capacity, path,
+                                                    create=False)))
+            except OSError:
+                continue
+        return rings
+
+    def snapshot(self, window=default_window, now=None):
+        """Rates and percentiles of every object over the last window
+        seconds, as a metrics snapshot the metrics endpoint renders.
+
+        With a directory the files are read, whichever process wrote them.
+        """
+        now = time.time() if now is None else now
+        result = {}
+        field, q = gauge_percentile
+        for kind in (LISTENER, MEMBER):
+            rates = dict((name, []) for name in rate_fields)
+            percentiles = []
+            for object_id, ring in self._rings(kind):
+                labels = {kind: object_id}
+                try:
+                    points = ring.samples(now - window)
+                except Exception as e:
+                    LOG.warning('cannot read %s history of %s: %s', kind, object_id, e)
+                    continue
+                if not points:
+                    continue
+                for name in rate_fields:
+                    rates[name].append([labels, _rate([(ts, sample[name]) for ts, sample in points])])
+                percentiles.append([labels, _percentile([sample[field] for _, sample in points], q)])
+            for name in rate_fields:
+                result['fadc_%s_%s_per_second' % (kind, name)] = {
+                    'type': 'gauge', 'samples': rates[name],
+                    'help': 'Increase per second of the %s of a %s over the last %d seconds'
+                            % (name.replace('_', ' '), kind, window)}
+            result['fadc_%s_%s_p%d' % (kind, field, q)] = {
+                'type': 'gauge', 'samples': percentiles,
+                'help': '%dth percentile of the %s of a %s over the last %d seconds'
+                        % (q, field.replace('_', ' '), kind, window)}
+        return result
+
+    def close(self):
+        with self._lock:
+            rings = list(self._series.values())
+            self._series.clear()
+        for ring in rings:
+            ring.close()
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(conf=None):
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                directory = getattr(conf, 'fadc_stats_history_dir', None) or None
+                capacity = getattr(conf, 'fadc_stats_history_size', default_capacity)
+                _store = TimeSeriesStore(directory, capacity)
+    return _store
@@ -0,0 +1,264 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Lightweight spans of an RPC request through flows, tasks and REST calls.
+
+The provider driver puts a trace id in the RPC context, the endpoint opens
+the root span of that trace and every span opened below it (run_flow, task
+execute, FortiADC request) becomes its child. The current span is held in a
+context variable, executors that run flow tasks or FortiADC requests copy
+it into their threads (ContextThreadPoolExecutor).
+
+Finished spans are queued and written by a background thread, as JSON lines
+to a file or as OTLP/HTTP JSON to a collector. Tracing is off until
+configure() is called with fadc_trace_exporter set.
+"""
+
+import concurrent.futures
+import contextlib
+import contextvars
+import functools
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+
+import requests
+from oslo_log import log as logging
+
+LOG = logging.getLogger(__name__)
+
+TRACE_ID = 'fadc_trace_id'
+
+NONE = 'none'
+FILE = 'file'
+OTLP = 'otlp'
+
+default_trace_file = '/var/log/octavia/fadc_traces.jsonl'
+batch_size = 256
+flush_interval = 2
+
+_current = contextvars.ContextVar('fadc_span', default=None)
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+def rpc_context(context=None):
+    """RPC context carrying a new trace id, or the one of the current span."""
+    context = dict(context or {})
+    parent = _current.get()
+    context.setdefault(TRACE_ID, parent.trace_id if parent else new_trace_id())
+    return context
+
+
+class Span(object):
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.end = None
+        self.error = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {'name': self.name,
+                'trace_id': self.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+                'start': self.start,
+                'end': self.end,
+                'duration': self.end - self.start,
+                'error': self.error,
+                'attributes': self.attributes}
+
+
+class FileExporter(object):
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+
+    def export(self, spans):
+        lines = ''.join(json.dumps(span.to_dict()) + '\n' for span in spans)
+        # one write per batch, lines of several processes do not interleave
+        with open(self.path, 'a') as f:
+            f.write(lines)
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {'boolValue': value}
+    if isinstance(value, int):
+        return {'intValue': str(value)}
+    if isinstance(value, float):
+        return {'doubleValue': value}
+    return {'stringValue': str(value)}
+
+
+class OtlpExporter(object):
+    """OTLP/HTTP with the JSON encoding, no OpenTelemetry SDK needed."""
+
+    def __init__(self, endpoint, service_name='fortiadc-agent'):
+        self.endpoint = endpoint
+        self.service_name = service_name
+        self.session = requests.session()
+
+    def _span(self, span):
+        result = {'traceId': span.trace_id,
+                  'spanId': span.span_id,
+                  'name': span.name,
+                  'kind': 1,
+                  'startTimeUnixNano': str(int(span.start * 1e9)),
+                  'endTimeUnixNano': str(int(span.end * 1e9)),
+                  'attributes': [{'key': k, 'value': _otlp_value(v)}
+                                 for k, v in span.attributes.items()],
+                  'status': {'code': 2, 'message': span.error} if span.error else {'code': 1}}
+        if span.parent_id:
+            result['parentSpanId'] = span.parent_id
+        return result
+
+    def export(self, spans):
+        body = {'resourceSpans': [{
+            'resource': {'attributes': [
+                {'key': 'service.name', 'value': {'stringValue': self.service_name}},
+                {'key': 'process.pid', 'value': {'intValue': str(os.getpid())}}]},
+            'scopeSpans': [{'scope': {'name': __name__},
+                            'spans': [self._span(span) for span in spans]}]}]}
+        res = self.session.post(self.endpoint, json=body, timeout=5)
+        if res.status_code >= 300:
+            raise Exception('collector returned %s' % res.status_code)
+
+
+class Tracer(object):
+
+    def __init__(self, exporter):
+        self.exporter = exporter
+        self._queue = queue.Queue(maxsize=batch_size * 16)
+        self.dropped = 0
+        self._thread = threading.Thread(target=self._loop, name='fadc-trace-export', daemon=True)
+        self._thread.start()
+
+    def finish(self, span):
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            # never let a slow collector hold up the agent
+            self.dropped += 1
+
+    def _loop(self):
+        while True:
+            spans = [self._queue.get()]
+            deadline = time.time() + flush_interval
+            while len(spans) < batch_size:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                try:
+                    spans.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            try:
+                self.exporter.export(spans)
+            except Exception as e:
+                LOG.warning('cannot export %d spans: %s', len(spans), e)
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def configure(conf=None):
+    """Start exporting spans of this process as conf says."""
+    global _tracer
+    kind = getattr(conf, 'fadc_trace_exporter', NONE)
+    with _tracer_lock:
+        if _tracer is not None or kind == NONE:
+            return _tracer
+        if kind == FILE:
+            exporter = FileExporter(getattr(conf, 'fadc_trace_file', '') or default_trace_file)
+        elif kind == OTLP:
+            exporter = OtlpExporter(getattr(conf, 'fadc_trace_otlp_endpoint', ''))
+        else:
+            raise Exception('Unknown trace exporter %s' % kind)
+        _tracer = Tracer(exporter)
+        LOG.info('Exporting traces with the %s exporter', kind)
+        return _tracer
+
+
+def enabled():
+    return _tracer is not None
+
+
+def current():
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name, trace_id=None, **attributes):
+    """Child span of the current span, or the root of trace_id.
+
+    Yields None while tracing is off.
+    """
+    tracer = _tracer
+    if tracer is None:
+        yield None
+        return
+    parent = _current.get()
+    if parent is not None and trace_id in (None, parent.trace_id):
+        current_span = Span(name, parent.trace_id, parent.span_id, attributes)
+    else:
+        current_span = Span(name, trace_id or new_trace_id(), None, attributes)
+    token = _current.set(current_span)
+    try:
+        yield current_span
+    except BaseException as e:
+        current_span.error = '%s: %s' % (type(e).__name__, e)
+        raise
+    finally:
+        _current.reset(token)
+        current_span.end = time.time()
+        tracer.finish(current_span)
+
+
+class ContextThreadPoolExecutor(concurrent.futures.ThreadPoolExecutor):
+    """Runs every job in a copy of the submitter's context, trace span included."""
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super(ContextThreadPoolExecutor, self).submit(
+            contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def traced(name):
+    """Decorator running the function in a span called name."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
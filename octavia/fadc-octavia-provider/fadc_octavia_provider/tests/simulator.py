@@ -0,0 +1,535 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+FortiADC REST simulator for benchmarks and offline testing.
+
+Simulator keeps the configuration of one device in memory and answers the
+REST calls of the agent like a FortiADC does: {"payload": ...} bodies, 0 or
+a negative error code for writes, 401 "Token is expired", 424 for a missing
+parent. status_history windows slide with time and carry generated traffic,
+one sample per span of the requested range divided by stats_window seconds
+(stats_interval when given), on a grid aligned to the epoch like the
+agent's stats pipeline assumes.
+
+Latency, jitter, a device wide concurrency limit, random or scripted
+failures, dropped connections and token expiry can be injected.
+
+The simulator is either mounted in process on the sessions a SessionPool
+opens to its host (install()), or served on a local port for other
+processes (serve(), or python -m fadc_octavia_provider.tests.simulator).
+"""
+
+import argparse
+import collections
+import json
+import random
+import ssl
+import threading
+import time
+from http import server
+from urllib.parse import parse_qs
+from urllib.parse import urlsplit
+
+import requests
+from requests import adapters
+from oslo_log import log as logging
+
+from fadc_octavia_provider.fortiadc_agent import fadc_api
+from fadc_octavia_provider.fortiadc_agent import stats_pipeline
+
+LOG = logging.getLogger(__name__)
+
+api_root = '/api'
+
+# payload error codes
+OK = 0
+NOT_FOUND = -1
+EXISTS = -15
+IN_USE = -23
+MEMBER_EXISTS = -38
+
+VDOM = '/vdom'
+SYSTEM_GLOBAL = '/system_global'
+INTERFACE = '/system_interface'
+VIRTUAL_SERVER = '/load_balance_virtual_server'
+POOL = '/load_balance_pool'
+POOL_MEMBER = '/load_balance_pool_child_pool_member'
+REAL_SERVER = '/load_balance_real_server'
+HEALTH_CHECK = '/system_health_check'
+ROUTE = '/router_static'
+NAT_POOL = '/load_balance_ippool'
+VS_STATS = '/status_history/vs'
+RS_STATS = '/status_history/rs'
+
+vdom_resources = (VIRTUAL_SERVER, POOL, REAL_SERVER, HEALTH_CHECK, ROUTE, NAT_POOL)
+# tables whose entries get a numeric mkey from the device
+auto_mkey = (ROUTE, POOL_MEMBER)
+stats_fields = ('in_bytes', 'out_bytes', 'total_sessions', 'current_sessions')
+
+too_many_logins = ('Too many bad login attempts or reached max number of logins. '
+                   'Please try again in a few minutes.')
+
+
+class Reply(object):
+
+    def __init__(self, status, body):
+        self.status = status
+        self.body = body
+
+    def text(self):
+        return self.body if isinstance(self.body, str) else json.dumps(self.body)
+
+
+def _payload(payload, status=200):
+    return Reply(status, {'payload': payload})
+
+
+class Simulator(object):
+
+    def __init__(self, host='fadc-sim', username='admin', password='password',
+                 latency=0, jitter=0, failure_rate=0, failure_status=500,
+                 drop_rate=0, max_concurrency=0, token_ttl=0, max_sessions=0,
+                 rs_ready_delay=0, stats_window=60, stats_interval=None,
+                 interfaces=('port1', 'port2', 'port3', 'port4'), seed=None):
+        self.host = host
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.drop_rate = drop_rate
+        self.token_ttl = token_ttl
+        self.max_sessions = max_sessions
+        self.rs_ready_delay = rs_ready_delay
+        self.stats_window = stats_window
+        self.stats_interval = stats_interval
+        self.random = random.Random(seed)
+        self._slots = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self._lock = threading.RLock()
+        self._latency_by_path = {}
+        self._scripted = []
+        self._tokens = {}
+        self._expired = set()
+        self._next_mkey = 0
+        self.calls = collections.Counter()
+        self.system_global = {'mkey': '', 'vdom-admin': 'disable', 'hostname': host}
+        self.interfaces = collections.OrderedDict(
+            (name, {'mkey': name, 'vdom': 'root', 'ip': '0.0.0.0/0', 'mode': 'static',
+                    'allowaccess': ''}) for name in interfaces)
+        self.vdoms = collections.OrderedDict()
+        self._add_vdom({'mkey': 'root'})
+
+    # injection
+
+    def set_latency(self, path_prefix, latency, jitter=0):
+        """Latency of the resources under path_prefix, e.g. '/load_balance_pool'."""
+        with self._lock:
+            self._latency_by_path[path_prefix] = (latency, jitter)
+
+    def fail_next(self, count=1, path=None, method=None, status=None, payload=None):
+        """Fail the next count requests matching path prefix and method.
+
+        The reply is HTTP status, or when payload is given a 200 carrying
+        that error code, like the device does for a rejected write.
+        """
+        with self._lock:
+            self._scripted.append([count, path, method, status or self.failure_status, payload])
+
+    def expire_tokens(self):
+        with self._lock:
+            self._expired.update(self._tokens)
+            self._tokens.clear()
+
+    def reset_calls(self):
+        with self._lock:
+            self.calls.clear()
+
+    def should_drop(self):
+        return bool(self.drop_rate) and self.random.random() < self.drop_rate
+
+    def _delay(self, path):
+        latency, jitter = self.latency, self.jitter
+        for prefix, value in self._latency_by_path.items():
+            if path.startswith(prefix):
+                latency, jitter = value
+        delay = latency + (self.random.uniform(0, jitter) if jitter else 0)
+        if delay > 0:
+            time.sleep(delay)
+
+    def _injected(self, method, path):
+        with self._lock:
+            for rule in self._scripted:
+                count, prefix, rule_method, status, payload = rule
+                if (prefix is None or path.startswith(prefix)) and rule_method in (None, method):
+                    rule[0] -= 1
+                    if rule[0] <= 0:
+                        self._scripted.remove(rule)
+                    if payload is not None:
+                        return _payload(payload)
+                    return Reply(status, {'payload': NOT_FOUND, 'message': 'injected failure'})
+        if self.failure_rate and self.random.random() < self.failure_rate:
+            return Reply(self.failure_status, {'payload': NOT_FOUND, 'message': 'injected failure'})
+        return None
+
+    # request entry point
+
+    def handle(self, method, path, query='', body=None, headers=None):
+        """Reply to one REST request, path includes the /api root."""
+        if not path.startswith(api_root):
+            return Reply(404, {'message': 'Not Found'})
+        path = path[len(api_root):]
+        if self._slots:
+            self._slots.acquire()
+        try:
+            self._delay(path)
+            with self._lock:
+                self.calls[(method, path)] += 1
+            reply = self._injected(method, path)
+            if reply is not None:
+                return reply
+            params = dict((k, v[0]) for k, v in parse_qs(query).items())
+            if method == 'GET':
+                # the agent sends its config form encoded with some GETs,
+                # the device ignores it
+                body = None
+            elif isinstance(body, (bytes, str)) and body:
+                try:
+                    body = json.loads(body)
+                except ValueError:
+                    return Reply(400, {'message': 'Bad Request'})
+            with self._lock:
+                return self._dispatch(method, path, params, body, headers or {})
+        finally:
+            if self._slots:
+                self._slots.release()
+
+    def _dispatch(self, method, path, params, body, headers):
+        if path == '/user/login' and method == 'POST':
+            return self._login(body or {})
+        if path == '/platform/version':
+            return _payload({'version': fadc_api.__version__.replace('.', '-')})
+        reply = self._authorize(headers)
+        if reply is not None:
+            return reply
+        if path == '/user/logout':
+            self._tokens.pop(self._token(headers), None)
+            return _payload(OK)
+        if path == '/refresh_token':
+            self._tokens.pop(self._token(headers), None)
+            return Reply(200, {'token': self._issue()})
+        if path == SYSTEM_GLOBAL:
+            if method == 'PUT':
+                self.system_global.update(body or {})
+                return _payload(OK)
+            return _payload(dict(self.system_global))
+        if path == INTERFACE:
+            return self._table(method, self.interfaces, params, body, INTERFACE)
+        if path == VDOM:
+            return self._vdom(method, params, body)
+        if path == VS_STATS:
+            return self._stats(VIRTUAL_SERVER, params)
+        if path == RS_STATS:
+            return self._stats(REAL_SERVER, params)
+        if path not in vdom_resources and path != POOL_MEMBER:
+            return Reply(404, {'message': 'Not Found'})
+
+        vdom = self.vdoms.get(params.get('vdom'))
+        if vdom is None:
+            return Reply(424, {'payload': NOT_FOUND, 'message': 'vdom does not exist'})
+        if path == POOL_MEMBER:
+            members = vdom['members'].get(params.get('pkey'))
+            if members is None:
+                return Reply(424, {'payload': NOT_FOUND, 'message': 'pool does not exist'})
+            return self._member(method, vdom, members, params, body)
+        return self._table(method, vdom[path], params, body, path, vdom)
+
+    # authentication
+
+    def _token(self, headers):
+        auth = headers.get('Authorization') or ''
+        return auth[len('Bearer '):] if auth.startswith('Bearer ') else None
+
+    def _authorize(self, headers):
+        token = self._token(headers)
+        issued = self._tokens.get(token)
+        if issued is not None and self.token_ttl and time.time() - issued > self.token_ttl:
+            del self._tokens[token]
+            self._expired.add(token)
+        if token in self._tokens:
+            return None
+        if token in self._expired:
+            return Reply(401, {'message': 'Token is expired'})
+        return Reply(401, {'message': 'Unauthorized'})
+
+    def _issue(self):
+        token = '%032x' % self.random.getrandbits(128)
+        self._tokens[token] = time.time()
+        return token
+
+    def _login(self, body):
+        if body.get('username') != self.username or body.get('password') != self.password:
+            return Reply(401, {'message': 'Authentication failure'})
+        if self.max_sessions and len(self._tokens) >= self.max_sessions:
+            return Reply(403, too_many_logins)
+        return Reply(200, {'token': self._issue()})
+
+    # configuration tables
+
+    def _add_vdom(self, config):
+        vdom = dict((resource, collections.OrderedDict()) for resource in vdom_resources)
+        vdom['config'] = dict(config)
+        vdom['members'] = {}
+        vdom['ready'] = {}
+        vdom['stats'] = {}
+        self.vdoms[config['mkey']] = vdom
+
+    def _vdom(self, method, params, body):
+        if method == 'GET':
+            return _payload([dict(v['config']) for v in self.vdoms.values()])
+        if method == 'POST':
+            if self.system_global.get('vdom-admin') != 'enable':
+                return Reply(403, {'message': 'vdom-admin is disabled'})
+            if body['mkey'] in self.vdoms:
+                return _payload(EXISTS)
+            self._add_vdom(body)
+            return _payload(OK)
+        if method == 'DELETE':
+            if self.vdoms.pop(params.get('mkey'), None) is None:
+                return _payload(NOT_FOUND)
+            return _payload(OK)
+        return Reply(405, {'message': 'Method Not Allowed'})
+
+    def _new_mkey(self):
+        self._next_mkey += 1
+        return str(self._next_mkey)
+
+    def _in_use(self, path, mkey, vdom):
+        if vdom is None:
+            return False
+        if path == POOL:
+            return any(vs.get('pool') == mkey for vs in vdom[VIRTUAL_SERVER].values())
+        if path == REAL_SERVER:
+            return any(m.get('real_server_id') == mkey
+                       for members in vdom['members'].values() for m in members.values())
+        if path == HEALTH_CHECK:
+            return any(mkey in (p.get('health_check_list') or '').split()
+                       for p in vdom[POOL].values())
+        return False
+
+    def _table(self, method, table, params, body, path, vdom=None):
+        mkey = params.get('mkey')
+        if method == 'GET':
+            if mkey is None:
+                return _payload([dict(e) for e in table.values()])
+            if mkey not in table:
+                return _payload(NOT_FOUND)
+            return _payload(dict(table[mkey]))
+        if method == 'POST':
+            config = dict(body or {})
+            if path in auto_mkey:
+                config['mkey'] = self._new_mkey()
+            elif not config.get('mkey'):
+                return Reply(400, {'message': 'mkey is required'})
+            if config['mkey'] in table:
+                return _payload(EXISTS)
+            table[config['mkey']] = config
+            if path == POOL:
+                vdom['members'][config['mkey']] = collections.OrderedDict()
+            elif path == REAL_SERVER:
+                vdom['ready'][config['mkey']] = time.time() + self.rs_ready_delay
+            return _payload(OK)
+        if mkey not in table:
+            return _payload(NOT_FOUND)
+        if method == 'PUT':
+            table[mkey].update(body or {})
+            table[mkey]['mkey'] = mkey
+            return _payload(OK)
+        if method == 'DELETE':
+            if self._in_use(path, mkey, vdom):
+                return _payload(IN_USE)
+            del table[mkey]
+            if path == POOL:
+                vdom['members'].pop(mkey, None)
+            elif path == REAL_SERVER:
+                vdom['ready'].pop(mkey, None)
+                vdom['stats'].pop(mkey, None)
+            elif path == VIRTUAL_SERVER:
+                vdom['stats'].pop(mkey, None)
+            return _payload(OK)
+        return Reply(405, {'message': 'Method Not Allowed'})
+
+    def _member(self, method, vdom, members, params, body):
+        if method in ('POST', 'PUT'):
+            body = dict(body or {})
+            enabled = body.get('status', 'enable') == 'enable'
+            body['availability'] = 'available' if enabled else 'disabled'
+        if method == 'POST':
+            rs_id = body.get('real_server_id')
+            if vdom['ready'].get(rs_id, float('inf')) > time.time():
+                # unknown real server, or one the device has not settled yet
+                return _payload(NOT_FOUND)
+            if any(m.get('real_server_id') == rs_id and m.get('port') == body.get('port')
+                   for m in members.values()):
+                return _payload(MEMBER_EXISTS)
+        return self._table(method, members, params, body, POOL_MEMBER, vdom)
+
+    # statistics
+
+    def _stats(self, table, params):
+        vdom = self.vdoms.get(params.get('vdom'))
+        if vdom is None or params.get('mkey') not in vdom[table]:
+            return _payload(NOT_FOUND)
+        now = time.time()
+        mkey = params['mkey']
+        window = vdom['stats'].get(mkey)
+        if window is None:
+            window = {'at': now, 'samples': collections.deque(
+                [self._sample() for _ in range(self.stats_window)], maxlen=self.stats_window)}
+            vdom['stats'][mkey] = window
+        interval = self.stats_interval or stats_pipeline.sample_interval(
+            params.get('range'), self.stats_window)
+        # one new sample per interval boundary passed since the last request
+        steps = int(now // interval - window['at'] // interval)
+        if steps:
+            window['at'] = now
+            for _ in range(min(steps, self.stats_window)):
+                window['samples'].append(self._sample())
+        samples = list(window['samples'])
+        return _payload(dict((field, [str(s[i]) for s in samples])
+                             for i, field in enumerate(stats_fields)))
+
+    def _sample(self):
+        sessions = self.random.randint(0, 100)
+        return (sessions * self.random.randint(500, 20000),
+                sessions * self.random.randint(1000, 50000),
+                sessions,
+                self.random.randint(0, 50))
+
+
+class SimulatorAdapter(adapters.BaseAdapter):
+    """requests transport that hands requests to a Simulator."""
+
+    def __init__(self, simulator):
+        super(SimulatorAdapter, self).__init__()
+        self.simulator = simulator
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.simulator.should_drop():
+            raise requests.ConnectionError('connection dropped by the simulator', request=request)
+        parts = urlsplit(request.url)
+        reply = self.simulator.handle(request.method, parts.path, parts.query,
+                                      request.body, request.headers)
+        response = requests.Response()
+        response.status_code = reply.status
+        response._content = reply.text().encode('utf-8')
+        response.encoding = 'utf-8'
+        response.headers['Content-Type'] = 'application/json'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def install(simulator, pool, host=None):
+    """Route the sessions pool opens to host, the simulator host by
+    default, to simulator. Sessions already pooled keep their transport."""
+    pool.adapters[host or simulator.host] = SimulatorAdapter(simulator)
+
+
+def uninstall(simulator, pool, host=None):
+    pool.adapters.pop(host or simulator.host, None)
+
+
+class SimulatorHandler(server.BaseHTTPRequestHandler):
+
+    simulator = None
+    protocol_version = 'HTTP/1.1'
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else None
+        if self.simulator.should_drop():
+            self.close_connection = True
+            return
+        parts = urlsplit(self.path)
+        reply = self.simulator.handle(self.command, parts.path, parts.query, body,
+                                      dict(self.headers.items()))
+        text = reply.text().encode('utf-8')
+        self.send_response(reply.status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(text)))
+        self.end_headers()
+        self.wfile.write(text)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        LOG.debug('simulator %s - %s', self.address_string(), format % args)
+
+
+def serve(simulator, address=('127.0.0.1', 0), certfile=None, keyfile=None):
+    """HTTP(S) server of simulator, started on a daemon thread.
+
+    The agent always talks https, pass a certificate to point it at the
+    server. server.server_address has the bound port.
+    """
+    handler = type('Handler', (SimulatorHandler,), {'simulator': simulator})
+    httpd = server.ThreadingHTTPServer(address, handler)
+    httpd.daemon_threads = True
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        httpd.socket = context.wrap_socket(httpd.socket, server_side=True)
+    thread = threading.Thread(target=httpd.serve_forever, name='fadc-simulator', daemon=True)
+    thread.start()
+    return httpd
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FortiADC REST simulator')
+    parser.add_argument('--address', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--cert', help='certificate file, serve https')
+    parser.add_argument('--key', help='private key file of --cert')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--latency', type=float, default=0, help='seconds per request')
+    parser.add_argument('--jitter', type=float, default=0, help='random extra seconds, at most')
+    parser.add_argument('--failure-rate', type=float, default=0)
+    parser.add_argument('--drop-rate', type=float, default=0)
+    parser.add_argument('--max-concurrency', type=int, default=0)
+    parser.add_argument('--token-ttl', type=float, default=0)
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args(argv)
+    simulator = Simulator(username=args.username, password=args.password,
+                          latency=args.latency, jitter=args.jitter,
+                          failure_rate=args.failure_rate, drop_rate=args.drop_rate,
+                          max_concurrency=args.max_concurrency,
+                          token_ttl=args.token_ttl, seed=args.seed)
+    httpd = serve(simulator, (args.address, args.port), args.cert, args.key)
+    print('FortiADC simulator on %s:%d' % httpd.server_address[:2])
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        httpd.shutdown()
+
+
+if __name__ == '__main__':
+    main()
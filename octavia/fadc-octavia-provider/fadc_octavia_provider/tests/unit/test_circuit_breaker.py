@@ -0,0 +1,89 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+from unittest import mock
+
+import requests
+
+from fadc_octavia_provider.fortiadc_agent.servicemanager import circuit_breaker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(circuit_breaker.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = circuit_breaker.CircuitBreaker('fadc.test', failure_threshold=2,
+                                                      reset_timeout=30)
+
+    def unreachable(self):
+        with self.assertRaises(requests.ConnectionError):
+            with self.breaker.attempt():
+                raise requests.ConnectionError('refused')
+
+    def trip(self):
+        self.unreachable()
+        self.unreachable()
+        self.assertEqual(circuit_breaker.OPEN, self.breaker.state)
+
+    def test_opens_after_the_threshold_and_fails_fast(self):
+        self.unreachable()
+        self.assertEqual(circuit_breaker.CLOSED, self.breaker.state)
+        self.unreachable()
+        with self.assertRaises(circuit_breaker.DeviceUnavailable) as ctx:
+            with self.breaker.attempt():
+                self.fail('request sent through an open breaker')
+        self.assertEqual(30, ctx.exception.retry_in)
+
+    def test_half_open_lets_a_single_probe_through(self):
+        self.trip()
+        self.now += 30
+        self.assertTrue(self.breaker.admit())
+        self.assertEqual(circuit_breaker.HALF_OPEN, self.breaker.state)
+        # the others keep failing fast while the probe runs
+        with self.assertRaises(circuit_breaker.DeviceUnavailable):
+            self.breaker.admit()
+        self.breaker.success(probe=True)
+        self.assertEqual(circuit_breaker.CLOSED, self.breaker.state)
+        self.assertFalse(self.breaker.admit())
+
+    def test_failed_probe_opens_for_another_timeout(self):
+        self.trip()
+        self.now += 30
+        self.unreachable()
+        self.assertEqual(circuit_breaker.OPEN, self.breaker.state)
+        self.now += 29
+        with self.assertRaises(circuit_breaker.DeviceUnavailable):
+            self.breaker.admit()
+        self.now += 1
+        self.assertTrue(self.breaker.admit())
+
+    def test_probe_without_an_answer_frees_the_probe_slot(self):
+        self.trip()
+        self.now += 30
+        with self.assertRaises(ValueError):
+            with self.breaker.attempt():
+                raise ValueError('bad payload')
+        self.assertEqual(circuit_breaker.HALF_OPEN, self.breaker.state)
+        self.assertTrue(self.breaker.admit())
+
+    def test_zero_threshold_never_opens(self):
+        self.breaker = circuit_breaker.disabled('fadc.test')
+        for i in range(10):
+            self.unreachable()
+        self.assertEqual(circuit_breaker.CLOSED, self.breaker.state)
@@ -0,0 +1,43 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+import requests
+
+from fadc_octavia_provider.fortiadc_agent.servicemanager import circuit_breaker
+from fadc_octavia_provider.fortiadc_agent.servicemanager import device_limiter
+
+
+class TestDeviceBusy(unittest.TestCase):
+
+    def setUp(self):
+        self.limiter = device_limiter.DeviceLimiter('fadc.test', max_concurrent=1)
+        self.limiter.acquire()
+        self.addCleanup(self.limiter.release)
+
+    def test_no_slot_raises_device_busy(self):
+        with self.assertRaises(circuit_breaker.DeviceBusy) as ctx:
+            self.limiter.acquire(timeout=0.01)
+        self.assertIsInstance(ctx.exception, requests.ConnectionError)
+        self.assertEqual('fadc.test', ctx.exception.host)
+
+    def test_device_busy_is_not_a_breaker_failure(self):
+        breaker = circuit_breaker.CircuitBreaker('fadc.test', failure_threshold=1)
+        with self.assertRaises(circuit_breaker.DeviceBusy):
+            with breaker.attempt():
+                self.limiter.acquire(timeout=0.01)
+        self.assertEqual(circuit_breaker.CLOSED, breaker.state)
+        self.assertEqual(0, breaker.failures)
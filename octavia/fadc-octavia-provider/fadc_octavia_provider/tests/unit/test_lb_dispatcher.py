@@ -0,0 +1,194 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import random
+import threading
+import time
+import types
+import unittest
+
+from fadc_octavia_provider.fortiadc_agent import lb_dispatcher
+
+TIMEOUT = 5
+
+
+class TestKeyedExecutor(unittest.TestCase):
+
+    def executor(self, **kwargs):
+        executor = lb_dispatcher.KeyedExecutor(**kwargs)
+        self.addCleanup(executor.shutdown, False)
+        return executor
+
+    def test_jobs_of_a_key_run_in_submission_order(self):
+        executor = self.executor(max_workers=8)
+        ran = []
+
+        def job(key, i):
+            def run():
+                time.sleep(random.random() * 0.005)
+                ran.append((key, i))
+            return run
+        for i in range(10):
+            for key in ('lb1', 'lb2', 'lb3'):
+                executor.submit(key, 'fadc.test', job(key, i))
+        executor.shutdown()
+        for key in ('lb1', 'lb2', 'lb3'):
+            self.assertEqual(list(range(10)), [i for k, i in ran if k == key])
+
+    def test_failed_job_does_not_stop_its_key(self):
+        executor = self.executor()
+        ran = []
+        executor.submit('lb1', None, lambda: 1 / 0)
+        executor.submit('lb1', None, lambda: ran.append('next'))
+        executor.shutdown()
+        self.assertEqual(['next'], ran)
+
+    def test_device_limit_bounds_the_keys_running_per_device(self):
+        executor = self.executor(max_workers=8, device_limit=2)
+        lock = threading.Lock()
+        running = {'fadc1': 0, 'fadc2': 0}
+        peak = dict(running)
+
+        def job(device):
+            def run():
+                with lock:
+                    running[device] += 1
+                    peak[device] = max(peak[device], running[device])
+                time.sleep(0.01)
+                with lock:
+                    running[device] -= 1
+            return run
+        for i in range(6):
+            for device in running:
+                executor.submit('%s-lb%d' % (device, i), device, job(device))
+        executor.shutdown()
+        self.assertEqual({'fadc1': 2, 'fadc2': 2}, peak)
+
+    def test_background_work_does_not_hold_up_provisioning(self):
+        executor = self.executor(max_workers=1, background_workers=1)
+        release = threading.Event()
+        done = threading.Event()
+        executor.submit('sync_state', None, lambda: release.wait(TIMEOUT), background=True)
+        executor.submit('lb1', None, done.set)
+        self.assertTrue(done.wait(TIMEOUT))
+        self.assertEqual(0, executor.pending())
+        release.set()
+
+    def test_backlog_wait_ends_when_provisioning_drains(self):
+        executor = self.executor(max_workers=1)
+        release = threading.Event()
+        executor.submit('lb1', None, lambda: release.wait(TIMEOUT))
+        executor.submit('lb2', None, lambda: None)
+        self.assertGreater(executor.wait_backlog(0, 0.05), 0.04)
+        release.set()
+        executor.wait_backlog(0, TIMEOUT)
+        self.assertEqual(0, executor.pending())
+
+
+class TestDispatcherOrder(unittest.TestCase):
+
+    def setUp(self):
+        self.lookup = threading.Event()
+        self.dispatcher = lb_dispatcher.Dispatcher(self.resolver, types.SimpleNamespace(
+            d_projects={'p1': {'fadc_FQDN': 'fadc1'}, 'p2': {'fadc_FQDN': 'fadc2'}},
+            fadc_dispatch_workers=4, fadc_dispatch_device_concurrency=2,
+            fadc_background_workers=1, fadc_background_yield_backlog=0,
+            fadc_coalesce_window=0))
+        self.addCleanup(self.dispatcher.shutdown, False)
+        self.ran = []
+
+    def resolver(self, pool_id=None, listener_id=None):
+        self.lookup.wait(TIMEOUT)
+        return 'lb1', 'p1'
+
+    def cast(self, method, **kwargs):
+        return self.dispatcher.submit(method, kwargs, lambda: self.ran.append(method))
+
+    def test_cast_naming_its_lb_waits_behind_a_pending_lookup(self):
+        self.cast('create_member', member={'member_id': 'm1', 'pool_id': 'pool1'})
+        self.cast('create_pool', pool={'pool_id': 'pool2', 'loadbalancer_id': 'lb1',
+                                       'project_id': 'p1'})
+        time.sleep(0.05)
+        self.assertEqual([], self.ran)
+        self.lookup.set()
+        self.dispatcher.shutdown()
+        self.assertEqual(['create_member', 'create_pool'], self.ran)
+        self.assertEqual(('lb1', 'fadc1', None), self.dispatcher.route(
+            'create_member', {'member': {'pool_id': 'pool1'}}))
+
+    def test_background_casts_do_not_wait_for_lookups(self):
+        self.cast('create_member', member={'member_id': 'm1', 'pool_id': 'pool1'})
+        self.cast('sync_stats', name='sync_stats')
+        deadline = time.time() + TIMEOUT
+        while not self.ran and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(['sync_stats'], self.ran)
+        self.lookup.set()
+        self.dispatcher.shutdown()
+        self.assertEqual(['sync_stats', 'create_member'], self.ran)
+
+
+class TestCoalescing(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = lb_dispatcher.Dispatcher(lambda **kwargs: (None, None),
+                                                   types.SimpleNamespace(d_projects={}))
+        self.addCleanup(self.dispatcher.shutdown, False)
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.ran = []
+        # the queue of lb1 is busy, the updates wait behind this cast
+        self.dispatcher.submit('create_listener', {'listener': {'loadbalancer_id': 'lb1'}},
+                               lambda: self.release.wait(TIMEOUT))
+
+    def update_pool(self, pool_id, **updates):
+        kwargs = {'original_pool': {'pool_id': pool_id, 'loadbalancer_id': 'lb1'},
+                  'pool_updates': updates}
+        return self.dispatcher.submit('update_pool', kwargs, lambda: self.ran.append(
+            (pool_id, kwargs['pool_updates'])))
+
+    def test_waiting_update_absorbs_later_ones_later_values_win(self):
+        self.assertTrue(self.update_pool('pool1', name='a', lb_algorithm='ROUND_ROBIN'))
+        self.assertFalse(self.update_pool('pool1', name='b'))
+        self.assertFalse(self.update_pool('pool1', description='c'))
+        self.release.set()
+        self.dispatcher.shutdown()
+        self.assertEqual([('pool1', {'name': 'b', 'lb_algorithm': 'ROUND_ROBIN',
+                                     'description': 'c'})], self.ran)
+
+    def test_updates_of_other_objects_are_not_merged(self):
+        self.assertTrue(self.update_pool('pool1', name='a'))
+        self.assertTrue(self.update_pool('pool2', name='b'))
+        self.assertTrue(self.update_pool('pool1', name='c'))
+        self.release.set()
+        self.dispatcher.shutdown()
+        self.assertEqual([('pool1', {'name': 'a'}), ('pool2', {'name': 'b'}),
+                          ('pool1', {'name': 'c'})], self.ran)
+
+    def test_started_update_is_not_merged_into(self):
+        self.release.set()
+        started = threading.Event()
+        proceed = threading.Event()
+        self.addCleanup(proceed.set)
+        kwargs = {'original_pool': {'pool_id': 'pool1', 'loadbalancer_id': 'lb1'},
+                  'pool_updates': {'name': 'a'}}
+        self.dispatcher.submit('update_pool', kwargs,
+                               lambda: (started.set(), proceed.wait(TIMEOUT)))
+        self.assertTrue(started.wait(TIMEOUT))
+        self.assertTrue(self.update_pool('pool1', name='b'))
+        proceed.set()
+        self.dispatcher.shutdown()
+        self.assertEqual({'name': 'a'}, kwargs['pool_updates'])
+        self.assertEqual([('pool1', {'name': 'b'})], self.ran)
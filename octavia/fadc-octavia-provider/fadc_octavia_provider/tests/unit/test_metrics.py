@@ -0,0 +1,62 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+
+from fadc_octavia_provider.fortiadc_agent import metrics
+
+
+class TestSnapshotDir(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def mode(self, path):
+        return stat.S_IMODE(os.lstat(path).st_mode)
+
+    def test_directory_is_created_private(self):
+        directory = metrics.private_dir(os.path.join(self.root, 'state', 'metrics'))
+        self.assertEqual(0o700, self.mode(directory))
+
+    def test_open_directory_of_this_user_is_closed(self):
+        directory = os.path.join(self.root, 'metrics')
+        os.mkdir(directory)
+        os.chmod(directory, 0o777)
+        metrics.private_dir(directory)
+        self.assertEqual(0o700, self.mode(directory))
+
+    def test_symlink_is_refused(self):
+        target = os.path.join(self.root, 'elsewhere')
+        os.mkdir(target)
+        link = os.path.join(self.root, 'metrics')
+        os.symlink(target, link)
+        self.assertRaises(Exception, metrics.private_dir, link)
+
+    def test_snapshots_of_live_processes_are_merged(self):
+        directory = metrics.private_dir(os.path.join(self.root, 'metrics'))
+        registry = metrics.Registry()
+        registry.counter('fadc_test_total', 'test').inc(3)
+        metrics.write_snapshot(directory, registry)
+        with open(os.path.join(directory, 'metrics-999999999.json'), 'w') as f:
+            f.write('{}')
+        snapshots = metrics.read_snapshots(directory)
+        self.assertEqual(1, len(snapshots))
+        self.assertIn('fadc_test_total 3', metrics.render(metrics.merge(snapshots)))
+        self.assertEqual(['metrics-%d.json' % os.getpid()], os.listdir(directory))
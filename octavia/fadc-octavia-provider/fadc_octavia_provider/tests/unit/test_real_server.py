@@ -0,0 +1,124 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import types
+import unittest
+from unittest import mock
+
+from fadc_octavia_provider.fortiadc_agent.fadc_api.member_index import MemberIndex
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb import real_server
+
+
+class TestPoolMemberLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MemberIndex()
+        connector = types.SimpleNamespace(session=None, token=None, member_index=self.index)
+        self.child = real_server.RSpool_member('fadc.test', connector, False)
+        self.member = types.SimpleNamespace(id='rs-2', project_id='vdom', pool_id='pool-1',
+                                            protocol_port=80, weight=1)
+        self.index.load('vdom', 'pool-1', [{'mkey': '1', 'real_server_id': 'rs-1', 'port': '80'}])
+
+    def _listing(self, elements):
+        def getall(member):
+            self.index.load(member.project_id, member.pool_id, elements)
+            return elements
+        return mock.patch.object(self.child, 'getall', side_effect=getall)
+
+    def test_member_unknown_to_the_index_is_listed_for_its_mkey(self):
+        listed = [{'mkey': '1', 'real_server_id': 'rs-1', 'port': '80'},
+                  {'mkey': '2', 'real_server_id': 'rs-2', 'port': '80'}]
+        with self._listing(listed) as getall:
+            ele = self.child.lookup(self.member, need_mkey=True)
+        self.assertEqual('2', ele['mkey'])
+        getall.assert_called_once_with(self.member)
+
+    def test_member_missing_from_the_device_drops_a_failed_listing(self):
+        with mock.patch.object(self.child, 'getall', return_value=False):
+            self.assertIsNone(self.child.lookup(self.member, need_mkey=True))
+        self.assertFalse(self.index.loaded('vdom', 'pool-1'))
+
+    def test_existence_check_trusts_the_index(self):
+        with mock.patch.object(self.child, 'getall') as getall:
+            self.assertIsNone(self.child.lookup(self.member))
+        getall.assert_not_called()
+
+
+class TestPoolMemberExists(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MemberIndex()
+        connector = types.SimpleNamespace(session=None, token=None, member_index=self.index)
+        self.child = real_server.RSpool_member('fadc.test', connector, False)
+        self.member = types.SimpleNamespace(id='rs-1', project_id='vdom', pool_id='pool-1',
+                                            protocol_port=80, weight=1)
+        self.index.load('vdom', 'pool-1', [{'mkey': '1', 'real_server_id': 'rs-1', 'port': '80'}])
+
+    def test_index_alone_answers_without_confirm(self):
+        with mock.patch.object(self.child, 'getone') as getone:
+            self.assertTrue(self.child.is_exist(self.member))
+        getone.assert_not_called()
+
+    def test_confirm_reads_the_member_back(self):
+        with mock.patch.object(self.child, 'getone',
+                               return_value={'mkey': '1', 'real_server_id': 'rs-1', 'port': '80'}):
+            self.assertTrue(self.child.is_exist(self.member, confirm=True))
+        self.assertTrue(self.index.loaded('vdom', 'pool-1'))
+
+    def test_member_gone_from_device_is_not_skipped(self):
+        with mock.patch.object(self.child, 'getone', return_value=False):
+            self.assertFalse(self.child.is_exist(self.member, confirm=True))
+        self.assertFalse(self.index.loaded('vdom', 'pool-1'))
+
+
+class TestSyncChild(unittest.TestCase):
+
+    def setUp(self):
+        connector = types.SimpleNamespace(session=None, token=None, member_index=MemberIndex())
+        self.rs = real_server.RS('fadc.test', connector, False)
+        self.member = types.SimpleNamespace(id='rs-1', project_id='vdom', pool_id='pool-1',
+                                            protocol_port=80, weight=1)
+        for name, value in (('ready_initial_delay', 0), ('ready_timeout', 5)):
+            patcher = mock.patch.object(real_server, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(real_server.RSpool_member, 'is_exist', return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_member_is_written_once_its_real_server_is_ready(self):
+        not_ready = real_server.MemberNotReady('not yet')
+        with mock.patch.object(real_server.RSpool_member, 'create',
+                               side_effect=[not_ready, not_ready, None]) as create:
+            self.rs.sync_child(self.member, 'create')
+        self.assertEqual(3, create.call_count)
+
+    def test_other_errors_are_raised_at_once(self):
+        with mock.patch.object(real_server.RSpool_member, 'create',
+                               side_effect=Exception('Add member to pool failed')) as create:
+            self.assertRaises(Exception, self.rs.sync_child, self.member, 'create')
+        create.assert_called_once_with(self.member)
+
+    def test_unknown_real_server_is_not_ready(self):
+        child = real_server.RSpool_member('fadc.test', self.rs.connector, False)
+        answer = mock.Mock(status_code=200)
+        answer.json.return_value = {'payload': -1}
+        with mock.patch.object(child, 'doAction', return_value=lambda *args: answer):
+            self.assertRaises(real_server.MemberNotReady, child.create, self.member)
+            # a missing pool is an HTTP error, not worth waiting for
+            answer.status_code = 424
+            with self.assertRaises(Exception) as ctx:
+                child.create(self.member)
+            self.assertNotIsInstance(ctx.exception, real_server.MemberNotReady)
@@ -0,0 +1,167 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import types
+import unittest
+from unittest import mock
+import uuid
+
+from fadc_octavia_provider.fortiadc_agent import reconciler
+from fadc_octavia_provider.fortiadc_agent.fadc_api.base import RequestAction
+from fadc_octavia_provider.fortiadc_agent.fadc_api.member_index import MemberIndex
+
+VDOM = 'vdom'
+
+
+def new_id():
+    return str(uuid.uuid4())
+
+
+def loadbalancer(n_members=1):
+    pool_id = new_id()
+    members = [types.SimpleNamespace(id=new_id(), ip_address='10.0.0.%d' % (i + 1), enabled=True,
+                                     protocol_port=80, weight=1, project_id=VDOM, pool_id=pool_id)
+               for i in range(n_members)]
+    pool = types.SimpleNamespace(id=pool_id, members=members, health_monitor=None)
+    return types.SimpleNamespace(id=new_id(), listeners=[], pools=[pool])
+
+
+def on_device(device, *lbs):
+    """Add lbs to device as the flows would have created them."""
+    device.exists = True
+    for lb in lbs:
+        for pool in lb.pools:
+            device.pools[pool.id] = {'mkey': pool.id, 'health_check_list': ''}
+            children = device.pool_members.setdefault(pool.id, {})
+            for member in pool.members:
+                device.real_servers[member.id] = {'mkey': member.id, 'address': member.ip_address,
+                                                  'status': 'enable'}
+                children[member.id] = {'real_server_id': member.id, 'port': '80', 'weight': '1'}
+    return device
+
+
+class ReconcilerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        connector = types.SimpleNamespace(session=None, token=None, member_index=MemberIndex(),
+                                          vdom_admin_enabled=True)
+        self.driver = types.SimpleNamespace(
+            host='fadc.test', connector=connector, conf=types.SimpleNamespace(debug_mode=False),
+            listener=mock.Mock(), pool=mock.Mock(), member=mock.Mock(),
+            healthmonitor=mock.Mock(), loadbalancer=mock.Mock())
+        self.device = reconciler.DeviceConfig(VDOM)
+
+    def reconciler(self, **kwargs):
+        o_reconciler = reconciler.Reconciler(self.driver, **kwargs)
+        o_reconciler.read = mock.Mock(return_value=self.device)
+        self.handled = []
+        o_reconciler.handler = lambda change: lambda obj: self.handled.append(
+            (change.action, change.kind, obj.id))
+        return o_reconciler
+
+
+class TestDiff(ReconcilerTestCase):
+
+    def test_vdom_in_sync_has_no_changes(self):
+        lb = loadbalancer(2)
+        on_device(self.device, lb)
+        self.assertEqual([], self.reconciler().diff(VDOM, [lb]))
+
+    def test_drift_updates_only_the_differing_fields(self):
+        lb = loadbalancer()
+        member = lb.pools[0].members[0]
+        on_device(self.device, lb)
+        self.device.real_servers[member.id]['address'] = '10.9.9.9'
+        changes = self.reconciler().diff(VDOM, [lb])
+        self.assertEqual([(RequestAction.UPDATE, reconciler.MEMBER, member.id, ['address'])],
+                         [(c.action, c.kind, c.obj.id, c.fields) for c in changes])
+        self.assertIs(lb, changes[0].loadbalancer)
+
+    def test_missing_vdom_creates_everything_parents_first(self):
+        lb = loadbalancer()
+        changes = self.reconciler().diff(VDOM, [lb])
+        self.assertEqual([(RequestAction.CREATE, reconciler.LOADBALANCER),
+                          (RequestAction.CREATE, reconciler.POOL),
+                          (RequestAction.CREATE, reconciler.MEMBER)],
+                         [(c.action, c.kind) for c in changes])
+
+    def test_unknown_octavia_ids_are_orphans(self):
+        lb = loadbalancer()
+        on_device(self.device, lb)
+        orphan = new_id()
+        self.device.real_servers[orphan] = {'mkey': orphan}
+        self.device.pool_members[lb.pools[0].id][orphan] = {'real_server_id': orphan,
+                                                            'port': '80', 'weight': '1'}
+        changes = self.reconciler().diff(VDOM, [lb])
+        self.assertEqual([(RequestAction.DELETE, reconciler.POOL_MEMBER, orphan),
+                          (RequestAction.DELETE, reconciler.REAL_SERVER, orphan)],
+                         [(c.action, c.kind, c.obj.id) for c in changes])
+        self.assertEqual(lb.pools[0].id, changes[0].obj.pool_id)
+        self.assertIsNone(changes[0].loadbalancer)
+
+    def test_known_ids_and_foreign_objects_are_not_orphans(self):
+        lb = loadbalancer()
+        other = loadbalancer()
+        on_device(self.device, lb, other)
+        self.device.real_servers['manual-server'] = {'mkey': 'manual-server'}
+        self.assertEqual([], self.reconciler().diff(VDOM, [lb], reconciler.object_ids(other)))
+
+
+class TestApply(ReconcilerTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.lb = loadbalancer()
+        on_device(self.device, self.lb)
+        self.orphan = new_id()
+        self.device.real_servers[self.orphan] = {'mkey': self.orphan}
+
+    def test_orphans_are_only_reported_by_default(self):
+        with mock.patch.object(reconciler.metrics.RECONCILE_ORPHANS, 'inc') as inc:
+            applied, failed = self.reconciler().reconcile(VDOM, [self.lb])
+        self.assertEqual(([], []), (applied, failed))
+        self.assertEqual([], self.handled)
+        inc.assert_called_once_with(kind=reconciler.REAL_SERVER, result='reported')
+
+    def test_orphan_is_deleted_only_once_confirmed(self):
+        confirm = mock.Mock(return_value=False)
+        self.reconciler(delete_orphans=True, confirm_orphan=confirm).reconcile(VDOM, [self.lb])
+        confirm.assert_called_once_with(self.orphan)
+        self.assertEqual([], self.handled)
+
+        confirm.return_value = True
+        self.reconciler(delete_orphans=True, confirm_orphan=confirm).reconcile(VDOM, [self.lb])
+        self.assertEqual([(RequestAction.DELETE, reconciler.REAL_SERVER, self.orphan)],
+                         self.handled)
+
+    def test_load_balancer_changed_since_read_is_left_to_its_flow(self):
+        changed = loadbalancer()
+        for lb in (self.lb, changed):
+            lb.pools[0].members[0].enabled = False
+        on_device(self.device, changed)
+        still_current = mock.Mock(side_effect=lambda lb: lb is not changed)
+        applied, failed = self.reconciler(still_current=still_current).reconcile(
+            VDOM, [self.lb, changed])
+        self.assertEqual([(RequestAction.UPDATE, reconciler.MEMBER, self.lb.pools[0].members[0].id)],
+                         self.handled)
+        self.assertEqual(1, len(applied))
+        self.assertEqual([mock.call(self.lb), mock.call(changed)], still_current.call_args_list)
+
+    def test_failed_recheck_skips_the_load_balancer(self):
+        self.lb.pools[0].members[0].enabled = False
+        still_current = mock.Mock(side_effect=Exception('database gone'))
+        applied, failed = self.reconciler(still_current=still_current).reconcile(VDOM, [self.lb])
+        self.assertEqual(([], []), (applied, failed))
+        self.assertEqual([], self.handled)
@@ -0,0 +1,65 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import types
+import unittest
+
+from fadc_octavia_provider.fortiadc_agent.servicemanager import session_pool
+from fadc_octavia_provider.tests import simulator
+
+
+class TestSessionPool(unittest.TestCase):
+
+    def setUp(self):
+        self.simulator = simulator.Simulator(host='fadc-pool-test', seed=1)
+        self.pool = session_pool.SessionPool(idle_timeout=60, token_refresh_interval=0)
+        simulator.install(self.simulator, self.pool)
+        self.addCleanup(self.pool.close_all)
+        self.device = types.SimpleNamespace(fadc_FQDN=self.simulator.host,
+                                            fadc_username='admin', fadc_password='password',
+                                            certificate_verify=False, ca_file=None)
+
+    def _logouts(self):
+        return self.simulator.calls[('GET', '/user/logout')]
+
+    def _logins(self):
+        return self.simulator.calls[('POST', '/user/login')]
+
+    def test_acquire_reuses_the_pooled_session(self):
+        first = self.pool.acquire(self.device)
+        second = self.pool.acquire(self.device)
+        self.assertIs(first, second)
+        self.assertTrue(first.token)
+        self.assertEqual(1, self._logins())
+
+    def test_dropped_session_is_logged_out_after_its_last_request(self):
+        connector = self.pool.acquire(self.device)
+        with connector.using():
+            self.pool.discard(connector)
+            self.assertEqual(0, self._logouts())
+            # a task still holding the session logs in again
+            connector.token = ''
+            connector.login('admin', 'password')
+        self.assertEqual(1, self._logouts())
+        self.assertFalse(connector.token)
+        self.assertIsNot(connector, self.pool.acquire(self.device))
+
+    def test_adapter_is_per_pool(self):
+        other = session_pool.SessionPool(token_refresh_interval=0)
+        self.addCleanup(other.close_all)
+        self.assertNotIn(self.simulator.host, other.adapters)
+        self.pool.acquire(self.device)
+        simulator.uninstall(self.simulator, self.pool)
+        self.assertNotIn(self.simulator.host, self.pool.adapters)
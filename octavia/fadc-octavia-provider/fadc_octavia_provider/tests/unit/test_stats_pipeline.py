@@ -0,0 +1,147 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+from fadc_octavia_provider.fortiadc_agent import stats_pipeline
+
+# a one hour window of 60 samples, one per minute
+PTYPE = '0'
+INTERVAL = 60
+NOW = 1000000 * INTERVAL + 30
+
+
+def payload(samples):
+    return {'in_bytes': samples,
+            'out_bytes': [2 * v for v in samples],
+            'total_sessions': [1] * len(samples),
+            'current_sessions': [0] * (len(samples) - 1) + [7]}
+
+
+def counters(stats):
+    return dict((s['id'], (s['bytes_in'], s['bytes_out'], s['total_connections']))
+                for s in stats)
+
+
+class TestStatsAggregator(unittest.TestCase):
+
+    def setUp(self):
+        self.stored = {}
+        self.aggregator = stats_pipeline.StatsAggregator(
+            baseline=lambda ids: dict((i, self.stored[i]) for i in ids if i in self.stored))
+        self.window = list(range(1, 61))
+
+    def test_samples_after_the_mark_are_added_to_the_stored_counters(self):
+        self.stored['l1'] = [100, 200, 10]
+        stats = self.aggregator.aggregate({'l1': payload(self.window)}, PTYPE,
+                                          {'l1': NOW - 3 * INTERVAL}, NOW)
+        self.assertEqual({'l1': (100 + 58 + 59 + 60, 200 + 2 * (58 + 59 + 60), 13)},
+                         counters(stats))
+        self.assertEqual(7, stats[0]['active_connections'])
+
+    def test_listener_without_a_mark_keeps_its_stored_counters(self):
+        self.stored['l1'] = [100, 200, 10]
+        stats = self.aggregator.aggregate({'l1': payload(self.window), 'l2': payload(self.window)},
+                                          PTYPE, {}, NOW)
+        self.assertEqual({'l1': (100, 200, 10), 'l2': (1830, 3660, 60)}, counters(stats))
+
+    def test_slice_of_an_unstored_sweep_is_counted_by_the_next(self):
+        mark = NOW - 2 * INTERVAL
+        self.aggregator.aggregate({'l1': payload(self.window)}, PTYPE, {'l1': mark}, NOW)
+        # Octavia did not take the report, the mark did not move
+        later = self.window[1:] + [61]
+        stats = self.aggregator.aggregate({'l1': payload(later)}, PTYPE, {'l1': mark},
+                                          NOW + INTERVAL)
+        self.assertEqual(59 + 60 + 61, counters(stats)['l1'][0])
+
+    def test_marks_are_per_listener(self):
+        stats = self.aggregator.aggregate(
+            {'l1': payload(self.window), 'l2': payload(self.window)}, PTYPE,
+            {'l1': NOW - INTERVAL, 'l2': NOW - 2 * INTERVAL}, NOW)
+        self.assertEqual({'l1': (60, 120, 1), 'l2': (119, 238, 2)}, counters(stats))
+
+    def test_python_path_matches_numpy(self):
+        payloads = {'l1': payload(self.window), 'l2': payload(self.window[::-1])}
+        marks = {'l1': NOW - 5 * INTERVAL, 'l2': NOW - 9 * INTERVAL}
+        expected = self.aggregator.aggregate(payloads, PTYPE, marks, NOW)
+        with mock.patch.object(stats_pipeline, 'np', None):
+            self.assertEqual(expected, stats_pipeline.StatsAggregator().aggregate(
+                payloads, PTYPE, marks, NOW))
+
+    def test_reset_takes_the_lost_samples_from_the_previous_window(self):
+        mark = NOW - 2 * INTERVAL
+        self.aggregator.aggregate({'l1': payload(self.window)}, PTYPE, {'l1': mark}, NOW)
+        # the device restarted, its history only holds the newest sample
+        restarted = [0] * 59 + [5]
+        with mock.patch.object(stats_pipeline.metrics.STATS_COUNTER_RESETS, 'inc') as inc:
+            stats = self.aggregator.aggregate({'l1': payload(restarted)}, PTYPE,
+                                              {'l1': mark}, NOW + INTERVAL)
+        inc.assert_called_once_with(1)
+        self.assertEqual(59 + 60 + 5, counters(stats)['l1'][0])
+
+    def test_unreadable_stored_counters_report_nothing(self):
+        aggregator = stats_pipeline.StatsAggregator(baseline=mock.Mock(side_effect=Exception))
+        self.assertEqual([], aggregator.aggregate({'l1': payload(self.window)}, PTYPE, {}, NOW))
+
+
+class TestAccumulate(unittest.TestCase):
+
+    def test_new_object_counts_the_whole_window(self):
+        stats = stats_pipeline.accumulate(payload(list(range(1, 61))), PTYPE, None, NOW)
+        self.assertEqual({'bytes_in': 1830, 'bytes_out': 3660, 'total_connections': 60,
+                          'active_connections': 7}, stats)
+
+    def test_last_sample_grows_by_the_samples_after_it(self):
+        last = (NOW - 2 * INTERVAL, {'bytes_in': 100.0, 'bytes_out': 200.0,
+                                     'total_connections': 10.0})
+        stats = stats_pipeline.accumulate(payload(list(range(1, 61))), PTYPE, last, NOW)
+        self.assertEqual((100 + 59 + 60, 200 + 2 * (59 + 60), 12),
+                         (stats['bytes_in'], stats['bytes_out'], stats['total_connections']))
+
+
+class TestStatsMarks(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'state', 'marks.json')
+        self.marks = stats_pipeline.StatsMarks(self.path)
+
+    def test_marks_are_shared_through_the_file(self):
+        self.marks.advance(['l1', 'l2'], 100)
+        self.assertEqual({'l1': 100}, stats_pipeline.StatsMarks(self.path).get(['l1', 'l3']))
+
+    def test_marks_never_move_back(self):
+        self.marks.advance(['l1'], 100)
+        self.marks.advance(['l1', 'l2'], 50)
+        self.assertEqual({'l1': 100, 'l2': 50}, self.marks.get(['l1', 'l2']))
+
+    def test_prune_forgets_gone_listeners(self):
+        self.marks.advance(['l1', 'l2'], 100)
+        self.marks.prune(['l2'])
+        self.assertEqual({'l2': 100}, self.marks.get(['l1', 'l2']))
+
+    def test_one_sweep_at_a_time(self):
+        other = stats_pipeline.StatsMarks(self.path)
+        with self.marks.exclusive() as mine:
+            self.assertTrue(mine)
+            with other.exclusive() as theirs:
+                self.assertFalse(theirs)
+        with other.exclusive() as theirs:
+            self.assertTrue(theirs)
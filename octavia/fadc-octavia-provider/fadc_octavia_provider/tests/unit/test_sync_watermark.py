@@ -0,0 +1,65 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import datetime
+import os
+import shutil
+import tempfile
+import unittest
+
+from fadc_octavia_provider.fortiadc_agent import sync_watermark
+
+STAMP = datetime.datetime(2024, 5, 1, 12, 0, 0)
+
+
+class TestWatermark(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'state', 'watermark.json')
+        self.watermark = sync_watermark.Watermark(self.path)
+
+    def test_no_mark_checks_every_change(self):
+        self.assertIsNone(self.watermark.get())
+        self.assertIsNone(self.watermark.since())
+
+    def test_since_overlaps_the_mark(self):
+        self.watermark.advance(STAMP)
+        self.assertEqual(STAMP - sync_watermark.overlap, self.watermark.since())
+
+    def test_mark_is_shared_through_the_file_and_never_moves_back(self):
+        self.watermark.advance(STAMP)
+        other = sync_watermark.Watermark(self.path)
+        other.advance(STAMP - datetime.timedelta(hours=1))
+        self.assertEqual(STAMP, other.get())
+        other.advance(STAMP + datetime.timedelta(hours=1))
+        self.assertEqual(STAMP + datetime.timedelta(hours=1), self.watermark.get())
+
+    def test_unreadable_file_means_no_mark(self):
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+        self.assertIsNone(self.watermark.get())
+
+    def test_one_pass_at_a_time_across_processes(self):
+        other = sync_watermark.Watermark(self.path)
+        with self.watermark.exclusive() as mine:
+            self.assertTrue(mine)
+            with self.watermark.exclusive() as again:
+                self.assertFalse(again)
+            with other.exclusive() as theirs:
+                self.assertFalse(theirs)
+        with other.exclusive() as theirs:
+            self.assertTrue(theirs)
@@ -0,0 +1,94 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+from unittest import mock
+
+from oslo_config import cfg
+from taskflow import task
+from taskflow.patterns import unordered_flow
+
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import taskflow_engine
+from fadc_octavia_provider.fortiadc_agent import tracing
+
+
+# the task_flow options with their defaults
+cfg.CONF.import_group('task_flow', 'octavia.common.config')
+
+
+class _Tracer(object):
+
+    def __init__(self):
+        self.spans = []
+
+    def finish(self, span):
+        self.spans.append(span)
+
+
+class _SpanTask(task.Task):
+
+    def execute(self):
+        with tracing.span('task.' + self.name):
+            pass
+
+
+class MemberTask(task.Task):
+
+    def execute(self):
+        pass
+
+
+# stands in for a task class of fortiadc_driver_tasks
+MemberTask.__module__ = taskflow_engine.driver_tasks_module
+
+
+class TestFadcTaskFlowEngine(unittest.TestCase):
+
+    def test_default_config_uses_context_executor(self):
+        engine = taskflow_engine.FadcTaskFlowEngine()
+        self.assertFalse(engine.per_device)
+        self.assertIsInstance(engine.executor, taskflow_engine.ContextThreadPoolExecutor)
+
+    def test_task_spans_keep_the_flow_trace_with_default_config(self):
+        tracer = _Tracer()
+        flow = unordered_flow.Flow('test-flow')
+        flow.add(_SpanTask(name='first'), _SpanTask(name='second'))
+        with mock.patch.object(tracing, '_tracer', tracer):
+            engine = taskflow_engine.FadcTaskFlowEngine()
+            with tracing.span('flow.test') as parent:
+                engine.taskflow_load(flow).run()
+
+        task_spans = [s for s in tracer.spans if s.name.startswith('task.')]
+        self.assertEqual(2, len(task_spans))
+        for span in task_spans:
+            self.assertEqual(parent.trace_id, span.trace_id)
+            self.assertEqual(parent.span_id, span.parent_id)
+
+
+class TestMetricsListener(unittest.TestCase):
+
+    def test_tasks_are_labelled_by_class(self):
+        flow = unordered_flow.Flow('test-members')
+        flow.add(*[MemberTask(name='test-members-%d' % i) for i in range(3)])
+        flow.add(_SpanTask(name='not-a-driver-task'))
+        engine = taskflow_engine.FadcTaskFlowEngine().taskflow_load(flow)
+        with mock.patch.object(metrics.TASK_SECONDS, 'observe') as observe:
+            with taskflow_engine.MetricsListener(engine, 'test'):
+                engine.run()
+
+        labels = set(call[1]['task'] for call in observe.call_args_list)
+        self.assertEqual({'MemberTask'}, labels)
+        self.assertEqual(3, observe.call_count)
@@ -0,0 +1,142 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from fadc_octavia_provider.fortiadc_agent import timeseries
+
+FIELDS = ('bytes_in', 'active_connections')
+
+
+def _write(path, writer, count):
+    ring = timeseries.RingBuffer(FIELDS, 64, path)
+    for n in range(count):
+        ring.append({'bytes_in': writer, 'active_connections': n}, writer * 1000 + n)
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.path = os.path.join(self.directory, 'listener-l1.ts')
+
+    def fill(self, ring, count):
+        for n in range(count):
+            ring.append({'bytes_in': n * 10, 'active_connections': n}, 100 + n)
+
+    def test_wraparound_keeps_the_newest_samples_oldest_first(self):
+        for path in (None, self.path):
+            ring = timeseries.RingBuffer(FIELDS, 4, path)
+            self.fill(ring, 6)
+            self.assertEqual(4, len(ring))
+            self.assertEqual([102, 103, 104, 105], [ts for ts, _ in ring.samples()])
+            self.assertEqual((105, {'bytes_in': 50.0, 'active_connections': 5.0}), ring.latest())
+            self.assertEqual([104, 105], [ts for ts, _ in ring.samples(since=104)])
+
+    def test_history_survives_a_restart_other_capacity_starts_over(self):
+        self.fill(timeseries.RingBuffer(FIELDS, 4, self.path), 3)
+        self.assertEqual(3, len(timeseries.RingBuffer(FIELDS, 4, self.path)))
+        self.assertEqual(0, len(timeseries.RingBuffer(FIELDS, 8, self.path)))
+
+    def test_rate_skips_counter_resets_and_percentile_interpolates(self):
+        ring = timeseries.RingBuffer(FIELDS)
+        for ts, value in ((0, 100), (10, 200), (20, 50), (30, 150)):
+            ring.append({'bytes_in': value, 'active_connections': ts}, ts)
+        # +100, reset to 50, +100 over 30 seconds
+        self.assertAlmostEqual(250 / 30.0, ring.rate('bytes_in'))
+        self.assertAlmostEqual(10.0, ring.rate('bytes_in', window=10, now=30))
+        self.assertEqual(15.0, ring.percentile('active_connections', 50))
+        self.assertEqual(30.0, ring.percentile('active_connections', 100))
+        self.assertIsNone(timeseries.RingBuffer(FIELDS).percentile('bytes_in', 95))
+
+    def test_concurrent_writers_lose_no_sample(self):
+        threads = [threading.Thread(target=_write, args=(self.path, writer, 10))
+                   for writer in (1, 2)]
+        context = multiprocessing.get_context('fork')
+        processes = [context.Process(target=_write, args=(self.path, writer, 10))
+                     for writer in (3, 4)]
+        for worker in threads + processes:
+            worker.start()
+        for worker in threads + processes:
+            worker.join()
+        self.assertEqual([0] * len(processes), [p.exitcode for p in processes])
+        samples = timeseries.RingBuffer(FIELDS, 64, self.path).samples()
+        self.assertEqual(40, len(samples))
+        for writer in (1, 2, 3, 4):
+            self.assertEqual([writer * 1000 + n for n in range(10)],
+                             [ts for ts, sample in samples if sample['bytes_in'] == writer])
+
+
+class TestTimeSeriesStore(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.store = timeseries.TimeSeriesStore(self.directory, 16)
+
+    def record(self, store, kind, object_id, *values):
+        for n, value in enumerate(values):
+            store.record(kind, [{'id': object_id, 'bytes_in': value, 'bytes_out': value,
+                                 'total_connections': value, 'active_connections': value}],
+                         1000 + 10 * n)
+
+    def test_prune_drops_memory_and_files_of_every_process(self):
+        self.record(self.store, timeseries.LISTENER, 'l1', 1)
+        self.record(self.store, timeseries.LISTENER, 'l2', 1)
+        self.record(self.store, timeseries.MEMBER, 'm1', 1)
+        # written by another consumer process
+        other = timeseries.TimeSeriesStore(self.directory, 16)
+        self.record(other, timeseries.LISTENER, 'l3', 1)
+        self.store.prune(timeseries.LISTENER, ['l1'])
+        self.assertEqual(['listener-l1.ts', 'member-m1.ts'], sorted(os.listdir(self.directory)))
+        self.assertEqual([(timeseries.LISTENER, 'l1'), (timeseries.MEMBER, 'm1')],
+                         sorted(self.store._series))
+
+    def test_memory_store_prunes_its_rings(self):
+        store = timeseries.TimeSeriesStore()
+        self.record(store, timeseries.MEMBER, 'm1', 1)
+        self.record(store, timeseries.MEMBER, 'm2', 1)
+        store.prune(timeseries.MEMBER, ['m2'])
+        self.assertEqual([(timeseries.MEMBER, 'm2')], list(store._series))
+
+    def test_snapshot_serves_the_history_other_processes_wrote(self):
+        self.record(self.store, timeseries.LISTENER, 'l1', 0, 100, 200)
+        self.record(self.store, timeseries.MEMBER, 'm1', 0, 10)
+        reader = timeseries.TimeSeriesStore(self.directory, 16)
+        snapshot = reader.snapshot(window=60, now=1030)
+        self.assertEqual([[{'listener': 'l1'}, 10.0]],
+                         snapshot['fadc_listener_bytes_in_per_second']['samples'])
+        self.assertEqual([[{'member': 'm1'}, 1.0]],
+                         snapshot['fadc_member_total_connections_per_second']['samples'])
+        self.assertEqual([[{'listener': 'l1'}, 190.0]],
+                         snapshot['fadc_listener_active_connections_p95']['samples'])
+        # history older than the window is left out
+        self.assertEqual([], reader.snapshot(window=60, now=2000)[
+            'fadc_listener_bytes_in_per_second']['samples'])
+
+    def test_snapshot_does_not_bring_back_pruned_objects(self):
+        self.record(self.store, timeseries.LISTENER, 'l1', 1)
+        reader = timeseries.TimeSeriesStore(self.directory, 16)
+        reader.snapshot(now=1000)
+        self.store.prune(timeseries.LISTENER, [])
+        self.assertEqual([], reader.snapshot(now=1000)[
+            'fadc_listener_bytes_in_per_second']['samples'])
+        self.assertEqual([], os.listdir(self.directory))
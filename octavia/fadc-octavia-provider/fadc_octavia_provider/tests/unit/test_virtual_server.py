@@ -0,0 +1,65 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import threading
+import time
+import unittest
+from unittest import mock
+
+from fadc_octavia_provider.fortiadc_agent.fadc_api.slb import virtual_server
+from fadc_octavia_provider.fortiadc_agent import tracing
+
+
+class TestStatsExecutor(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.dict(virtual_server._stats_executors, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_bounded_pool_per_device(self):
+        executor = virtual_server.stats_executor('fadc1', 2)
+        self.addCleanup(executor.shutdown)
+        self.assertIs(executor, virtual_server.stats_executor('fadc1', 2))
+        other = virtual_server.stats_executor('fadc2', 2)
+        self.addCleanup(other.shutdown)
+        self.assertIsNot(executor, other)
+        lock = threading.Lock()
+        running = [0, 0]
+
+        def job(_):
+            with lock:
+                running[0] += 1
+                running[1] = max(running)
+            time.sleep(0.01)
+            with lock:
+                running[0] -= 1
+        # two vdoms of the device at the same time share its bound
+        callers = [threading.Thread(target=lambda: list(executor.map(job, range(4))))
+                   for _ in range(2)]
+        for caller in callers:
+            caller.start()
+        for caller in callers:
+            caller.join()
+        self.assertEqual(2, running[1])
+
+    def test_requests_stay_in_the_trace_of_the_sweep(self):
+        executor = virtual_server.stats_executor('fadc1')
+        self.addCleanup(executor.shutdown)
+        tracer = mock.Mock()
+        with mock.patch.object(tracing, '_tracer', tracer):
+            with tracing.span('sync_stats') as root:
+                inner = list(executor.map(lambda _: tracing.current(), range(3)))
+        self.assertEqual([root] * 3, inner)
@@ -0,0 +1,332 @@
+# Copyright (c) 2024  Fortinet Inc.
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+Provisioning benchmark of the agent against the FortiADC simulator.
+
+Drives the servicemanager classes the flow tasks call, and the per vdom
+work of sync_state (Reconciler) and sync_stats (Listener.get_stats), against
+an in-process Simulator or against the device given with --host. Neither
+the Octavia database nor Neutron is involved: the objects are data models
+built here and VIP plugging is skipped. Every load balancer gets a project,
+and so a vdom, of its own.
+
+Scenarios, run in this order on the same device state:
+    create_lbs      load balancer, pool and listener, one op per LB
+    create_members  --members members per pool, one op per member
+    batch_members   --members more per pool, one batch_update per pool
+    sync_state      reconcile of one vdom, one op per vdom
+    sync_stats      statistics of one vdom, one op per vdom
+    cascade_delete  listener, members, pool and LB, one op per LB
+
+Each reports ops/sec, p50/p99 latency, REST calls and logins per op, taken
+from the agent metrics. --output writes the results as JSON, the password
+left out.
+
+Run it from the source tree with the agent and its dependencies installed:
+    python tools/benchmark.py --lbs 20 --members 10
+"""
+
+import argparse
+from concurrent import futures
+import datetime
+import json
+import sys
+import time
+
+from oslo_log import log as logging
+from oslo_utils import uuidutils
+
+from octavia.common import data_models
+from fadc_octavia_provider.fortiadc_agent import metrics
+from fadc_octavia_provider.fortiadc_agent import reconciler
+from fadc_octavia_provider.fortiadc_agent.servicemanager import session_pool
+from fadc_octavia_provider.fortiadc_agent.fadc_device_driver import FadcdeviceDriver
+from fadc_octavia_provider.tests import simulator
+
+LOG = logging.getLogger(__name__)
+
+scenarios = ('create_lbs', 'create_members', 'batch_members',
+             'sync_state', 'sync_stats', 'cascade_delete')
+
+
+class NoNetworkDriver(object):
+    """VIP plugging is Neutron work, outside of what is measured."""
+
+    def plug_vip_to_port(self, ip_address, port_id):
+        pass
+
+    def unplug_vip_from_port(self, ip_address, port_id):
+        pass
+
+
+class BenchDriver(FadcdeviceDriver):
+    network_driver = NoNetworkDriver()
+
+
+class BenchConf(object):
+
+    def __init__(self, d_projects, **options):
+        self.d_projects = d_projects
+        self.debug_mode = False
+        for key, value in options.items():
+            setattr(self, key, value)
+
+
+def device_config(host, username, password, interface='port2'):
+    """fadc_devices entry of the benchmarked device, see init_device_conf."""
+    return {
+        'fadc_FQDN': host,
+        'fadc_username': username,
+        'fadc_password': password,
+        'fadc_vdom_network_mapping': [interface],
+        'fadc_bind_vip_port_id': 'benchmark',
+        'fadc_vdom_network_allowAccess': {interface: 'http https ping'},
+        'fadc_vdom_network_ip': {interface: '10.20.2.206/24'},
+        'fadc_vdom_default_gw': '10.20.2.1',
+        'fadc_vs_dev_intf': interface,
+        'fadc_vs_packet_forward_method': '',
+        'fadc_vs_nat_pool': [],
+        'fadc_vs_nat_intf': interface,
+        'fadc_vs_persistency': '',
+        'fadc_get_stats_interval': '2',
+        'fadc_healthcheck_port': 80,
+        'certificate_verify': False,
+        'ca_file': '',
+    }
+
+
+def _ip(n):
+    return '10.%d.%d.%d' % ((n >> 16) & 255, (n >> 8) & 255, n & 255)
+
+
+def build_loadbalancer(n):
+    project_id = 'bench%05d' % n
+    lb = data_models.LoadBalancer(id=uuidutils.generate_uuid(), project_id=project_id,
+                                  vip=data_models.Vip(ip_address=_ip(n + 1)),
+                                  listeners=[], pools=[])
+    pool = data_models.Pool(id=uuidutils.generate_uuid(), project_id=project_id,
+                            protocol='HTTP', lb_algorithm='ROUND_ROBIN',
+                            load_balancer=lb, members=[], listeners=[])
+    listener = data_models.Listener(id=uuidutils.generate_uuid(), project_id=project_id,
+                                    protocol='HTTP', protocol_port=80,
+                                    connection_limit=-1, enabled=True,
+                                    load_balancer=lb, default_pool=pool)
+    pool.listeners.append(listener)
+    lb.pools.append(pool)
+    lb.listeners.append(listener)
+    return lb
+
+
+def build_members(pool, count, first):
+    return [data_models.Member(id=uuidutils.generate_uuid(), project_id=pool.project_id,
+                               pool_id=pool.id, pool=pool, ip_address=_ip(first + i),
+                               protocol_port=8080, weight=1, enabled=True)
+            for i in range(count)]
+
+
+def _percentile(values, q):
+    values = sorted(values)
+    if not values:
+        return None
+    pos = (len(values) - 1) * q / 100.0
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+def _rest_calls():
+    return sum(count for _, _, count in metrics.REST_REQUEST_SECONDS.samples().values())
+
+
+def _logins():
+    return sum(metrics.LOGINS.samples().values())
+
+
+def run_scenario(name, ops, concurrency):
+    """Run the callables in ops on concurrency threads, their statistics."""
+    def timed(op):
+        start = time.time()
+        try:
+            op()
+            return time.time() - start, True
+        except Exception as e:
+            LOG.warning('%s: operation failed: %s', name, e)
+            return time.time() - start, False
+
+    calls, logins = _rest_calls(), _logins()
+    start = time.time()
+    with futures.ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(timed, ops))
+    elapsed = time.time() - start
+    latencies = [latency for latency, _ in results]
+    count = len(results) or 1
+    return {
+        'scenario': name,
+        'ops': len(results),
+        'errors': sum(1 for _, ok in results if not ok),
+        'seconds': elapsed,
+        'ops_per_sec': len(results) / elapsed if elapsed else None,
+        'p50': _percentile(latencies, 50),
+        'p99': _percentile(latencies, 99),
+        'rest_calls_per_op': (_rest_calls() - calls) / count,
+        'logins_per_op': (_logins() - logins) / count,
+    }
+
+
+class Benchmark(object):
+
+    def __init__(self, device, lbs, members, concurrency, **options):
+        self.lbs = [build_loadbalancer(n) for n in range(lbs)]
+        self.conf = BenchConf(dict((lb.project_id, device) for lb in self.lbs), **options)
+        self.members = members
+        self.concurrency = concurrency
+        self.changes = []
+
+    def driver(self, lb):
+        return BenchDriver(self.conf, lb.project_id)
+
+    def create_lbs(self):
+        def op(lb):
+            driver = self.driver(lb)
+            driver.loadbalancer.create(lb)
+            driver.pool.create(lb.pools[0])
+            driver.listener.create(lb.listeners[0])
+        return [lambda lb=lb: op(lb) for lb in self.lbs]
+
+    def create_members(self):
+        ops = []
+        for n, lb in enumerate(self.lbs):
+            pool = lb.pools[0]
+            new = build_members(pool, self.members, (n + 1) << 12)
+            pool.members.extend(new)
+            ops.extend(lambda lb=lb, m=m: self.driver(lb).member.create(m) for m in new)
+        return ops
+
+    def batch_members(self):
+        def op(lb, new):
+            failed = self.driver(lb).member.batch_update(new, [], [])
+            if failed:
+                raise Exception('%d of %d members failed' % (len(failed), len(new)))
+        ops = []
+        for n, lb in enumerate(self.lbs):
+            pool = lb.pools[0]
+            new = build_members(pool, self.members, ((n + 1) << 12) + self.members)
+            pool.members.extend(new)
+            ops.append(lambda lb=lb, new=new: op(lb, new))
+        return ops
+
+    def sync_state(self):
+        def op(lb):
+            changes, failed = reconciler.Reconciler(self.driver(lb)).reconcile(lb.project_id, [lb])
+            # the device is in sync, every change is drift the benchmark caused
+            self.changes.extend(changes)
+            if failed:
+                raise Exception('%d changes failed' % len(failed))
+        return [lambda lb=lb: op(lb) for lb in self.lbs]
+
+    def sync_stats(self):
+        def op(lb):
+            if not self.driver(lb).listener.get_stats(lb.listeners):
+                raise Exception('no statistics of vdom %s' % lb.project_id)
+        return [lambda lb=lb: op(lb) for lb in self.lbs]
+
+    def cascade_delete(self):
+        def op(lb):
+            driver = self.driver(lb)
+            pool = lb.pools[0]
+            driver.listener.delete(lb.listeners[0])
+            for member in pool.members:
+                driver.member.delete(member)
+            driver.pool.delete(pool)
+            driver.loadbalancer.delete(lb)
+        return [lambda lb=lb: op(lb) for lb in self.lbs]
+
+    def run(self, names=scenarios):
+        results = []
+        for name in names:
+            self.changes = []
+            result = run_scenario(name, getattr(self, name)(), self.concurrency)
+            if name == 'sync_state':
+                result['changes'] = len(self.changes)
+            results.append(result)
+        return results
+
+
+def _print(results, out=sys.stdout):
+    out.write('%-16s %6s %6s %10s %9s %9s %10s %10s\n' % (
+        'scenario', 'ops', 'errors', 'ops/sec', 'p50 ms', 'p99 ms', 'rest/op', 'logins/op'))
+    for r in results:
+        out.write('%-16s %6d %6d %10.1f %9.1f %9.1f %10.2f %10.3f\n' % (
+            r['scenario'], r['ops'], r['errors'], r['ops_per_sec'] or 0,
+            (r['p50'] or 0) * 1000, (r['p99'] or 0) * 1000,
+            r['rest_calls_per_op'], r['logins_per_op']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='FortiADC agent provisioning benchmark')
+    parser.add_argument('--lbs', type=int, default=20, help='load balancers, one vdom each')
+    parser.add_argument('--members', type=int, default=10, help='members per pool and scenario')
+    parser.add_argument('--concurrency', type=int, default=8, help='operations in flight')
+    parser.add_argument('--scenarios', default=','.join(scenarios))
+    parser.add_argument('--host', help='benchmark this device instead of the simulator')
+    parser.add_argument('--username', default='admin')
+    parser.add_argument('--password', default='password')
+    parser.add_argument('--latency', type=float, default=0.01, help='simulator seconds per request')
+    parser.add_argument('--jitter', type=float, default=0.005, help='simulator random extra seconds')
+    parser.add_argument('--failure-rate', type=float, default=0, help='simulator failed requests')
+    parser.add_argument('--max-concurrency', type=int, default=0,
+                        help='requests the simulator serves at once, 0 for no limit')
+    parser.add_argument('--cache-ttl', type=int, default=2, help='fadc_get_cache_ttl')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args(argv)
+
+    names = [name for name in args.scenarios.split(',') if name]
+    unknown = set(names) - set(scenarios)
+    if unknown:
+        parser.error('unknown scenarios: %s' % ', '.join(sorted(unknown)))
+
+    sim = None
+    host = args.host
+    if not host:
+        sim = simulator.Simulator(username=args.username, password=args.password,
+                                  latency=args.latency, jitter=args.jitter,
+                                  failure_rate=args.failure_rate,
+                                  max_concurrency=args.max_concurrency, seed=args.seed)
+        host = sim.host
+    device = device_config(host, args.username, args.password)
+    bench = Benchmark(device, args.lbs, args.members, args.concurrency,
+                      fadc_get_cache_ttl=args.cache_ttl,
+                      fadc_batch_concurrency=args.concurrency,
+                      fadc_stats_concurrency=args.concurrency)
+    if sim:
+        simulator.install(sim, session_pool.get_session_pool(bench.conf))
+
+    started = datetime.datetime.utcnow().isoformat() + 'Z'
+    results = bench.run(names)
+    _print(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'started': started,
+                       'device': args.host or 'simulator',
+                       'config': dict((k, v) for k, v in vars(args).items()
+                                      if k != 'password'),
+                       'results': results}, f, indent=2)
+    return 1 if any(r['errors'] for r in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())